@@ -15,6 +15,91 @@ def create_app(config_name='default'):
     # Load configuration
     app.config.from_object(config[config_name])
     
+    # Size the shared result cache
+    from app.cache import result_cache
+    result_cache.configure(
+        maxsize=app.config['RESULT_CACHE_SIZE'],
+        ttl=app.config['RESULT_CACHE_TTL']
+    )
+    
+    # Configure the near-duplicate campaign index
+    from app.near_duplicates import near_duplicate_index
+    near_duplicate_index.configure(
+        threshold=app.config['NEAR_DUPLICATE_THRESHOLD'],
+        maxsize=app.config['NEAR_DUPLICATE_INDEX_SIZE'],
+        max_age=app.config['NEAR_DUPLICATE_MAX_AGE']
+    )
+    
+    # Bound concurrent analyses and their wait queue
+    from app.admission import admission
+    admission.configure(
+        concurrency=app.config['ANALYZE_CONCURRENCY'],
+        queue_size=app.config['ANALYZE_QUEUE_SIZE']
+    )
+    
+    # Map the learned model when its artifacts have been trained
+    import os
+    from app.learned import learned_classifier
+    model_path = os.path.join(app.config['MODEL_DIR'], app.config['MODEL_FILENAME'])
+    vectorizer_path = os.path.join(app.config['MODEL_DIR'], app.config['VECTORIZER_FILENAME'])
+    if os.path.exists(model_path) and os.path.exists(vectorizer_path):
+        learned_classifier.load(model_path, vectorizer_path)
+    
+    # Compile the configured rule pack and watch its file for changes
+    from app.models import email_classifier
+    from app.rule_packs import RuleReloader, load_rule_pack
+    email_classifier.set_rules(load_rule_pack(app.config['RULES_PATH'], app.config['RULES_CACHE_DIR']))
+    if app.config['RULES_RELOAD_INTERVAL'] > 0:
+        reloader = RuleReloader(
+            email_classifier,
+            app.config['RULES_PATH'],
+            cache_dir=app.config['RULES_CACHE_DIR'],
+            interval=app.config['RULES_RELOAD_INTERVAL']
+        )
+        app.extensions['rule_reloader'] = reloader
+        
+        @app.before_request
+        def reload_rules():
+            reloader.check()
+    
+    # Early-exit cascade over the rule-based and learned classifiers
+    from app.cascade import cascade
+    cascade.configure(
+        enabled=app.config['CASCADE_ENABLED'],
+        keyword_margin=app.config['CASCADE_KEYWORD_MARGIN'],
+        full_margin=app.config['CASCADE_FULL_MARGIN'],
+        budget=app.config['CASCADE_BUDGET']
+    )
+    
+    # Bound the compose-time analysis sessions
+    from app.incremental import session_store
+    session_store.configure(
+        maxsize=app.config['INCREMENTAL_SESSIONS'],
+        idle_timeout=app.config['INCREMENTAL_IDLE_TIMEOUT'],
+        max_chars=app.config['INCREMENTAL_MAX_CHARS']
+    )
+    
+    # Durable job queue, worked through in the background
+    from app.jobs import job_queue, job_runner
+    job_queue.configure(path=app.config['JOBS_DB'], result_ttl=app.config['JOBS_RESULT_TTL'])
+    job_runner.start(workers=app.config['JOBS_WORKERS'], niceness=app.config['JOBS_NICENESS'])
+    
+    # Classification counters, written to the stats store in the background
+    from app.stats import stats_recorder
+    stats_recorder.configure(
+        path=app.config['STATS_DB'],
+        flush_interval=app.config['STATS_FLUSH_INTERVAL'],
+        retention_days=app.config['STATS_RETENTION_DAYS']
+    )
+    stats_recorder.start()
+    
+    # Stage and request latency metrics
+    from app import metrics
+    metrics.instrument_classifier(email_classifier, enabled=app.config['METRICS_ENABLED'])
+    metrics.instrument_cascade(cascade, enabled=app.config['METRICS_ENABLED'])
+    if app.config['METRICS_ENABLED']:
+        metrics.init_app(app)
+    
     # Register blueprints
     from app.routes import main_bp
     app.register_blueprint(main_bp)
@@ -0,0 +1,139 @@
+"""
+Bounded admission control in front of the email classifier
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+class Overloaded(Exception):
+    """Raised when an analysis is shed instead of queued"""
+    
+    def __init__(self, status, reason, retry_after):
+        super().__init__(f'Server overloaded: {reason}')
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Limit concurrent analyses, queue a bounded number FIFO and shed the rest
+    
+    A request is rejected with 429 when the queue is full, and with 503 when
+    its deadline would pass while queued. The queue wait is estimated from a
+    moving average of analysis time.
+    """
+    
+    def __init__(self, concurrency=4, queue_size=32, clock=time.monotonic):
+        if concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.clock = clock
+        self.service_time = None
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_deadline = 0
+        self.timed_out = 0
+    
+    def configure(self, concurrency=None, queue_size=None):
+        """Change the limits; concurrency must be at least 1"""
+        if concurrency is not None and concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        with self._lock:
+            if concurrency is not None:
+                self.concurrency = concurrency
+            if queue_size is not None:
+                self.queue_size = queue_size
+            self._wake()
+    
+    def _expected_wait(self, position):
+        """Seconds until the request at a 1-based queue position starts"""
+        if self.service_time is None:
+            return 0.0
+        return math.ceil(position / self.concurrency) * self.service_time
+    
+    def _retry_after(self):
+        """Whole seconds for the current queue to drain, at least 1"""
+        return max(1, math.ceil(self._expected_wait(len(self._waiters) + 1)))
+    
+    def _wake(self):
+        """Hand free slots to the oldest waiters"""
+        while self._waiters and self.active < self.concurrency:
+            self.active += 1
+            self.admitted += 1
+            self._waiters.popleft().set()
+    
+    def acquire(self, timeout):
+        """Wait up to timeout seconds for a slot, or raise Overloaded"""
+        with self._lock:
+            if self.active < self.concurrency and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return
+            
+            if len(self._waiters) >= self.queue_size:
+                self.rejected_queue_full += 1
+                raise Overloaded(429, 'analysis queue is full', self._retry_after())
+            
+            if self._expected_wait(len(self._waiters) + 1) > timeout:
+                self.rejected_deadline += 1
+                raise Overloaded(503, 'deadline would be missed in the queue', self._retry_after())
+            
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self.queued += 1
+        
+        if waiter.wait(timeout):
+            return
+        
+        with self._lock:
+            # A slot may have been handed over just as the wait timed out
+            if waiter.is_set():
+                return
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+            raise Overloaded(503, 'deadline passed in the queue', self._retry_after())
+    
+    def release(self, elapsed):
+        """Free a slot after an analysis that took elapsed seconds"""
+        with self._lock:
+            if self.service_time is None:
+                self.service_time = elapsed
+            else:
+                self.service_time += 0.2 * (elapsed - self.service_time)
+            self.active -= 1
+            self._wake()
+    
+    @contextmanager
+    def slot(self, timeout):
+        """Hold a slot for the duration of the block"""
+        self.acquire(timeout)
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.release(self.clock() - start)
+    
+    def stats(self):
+        """Limits, queue depth and admission counters"""
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'queue_depth': len(self._waiters),
+                'service_time': self.service_time,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected_queue_full': self.rejected_queue_full,
+                'rejected_deadline': self.rejected_deadline,
+                'timed_out': self.timed_out
+            }
+
+# Global admission controller for analyses, configured by create_app
+admission = AdmissionController()
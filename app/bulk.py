@@ -0,0 +1,303 @@
+"""
+Offline bulk classification of mbox, Maildir and NDJSON corpora
+"""
+import csv
+import json
+import mailbox
+import os
+import sys
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from app.chunked import LARGE_BODY
+from app.mime import extract_message
+from app.models import EmailClassifier
+from app.near_duplicates import cluster_corpus
+from app.rule_packs import load_rule_pack
+from app.streaming import iter_ndjson
+
+INPUT_FORMATS = ('mbox', 'maildir', 'ndjson')
+OUTPUT_FORMATS = ('ndjson', 'csv')
+OUTPUT_FIELDS = ['id', 'category', 'display_name', 'confidence', 'risk_level', 'indicators', 'error']
+CLUSTER_FIELDS = ['id', 'cluster', 'similarity', 'representative', 'error']
+
+# Built once per worker process by _init_worker
+_classifier = None
+
+def detect_format(path):
+    """Guess the corpus format from its path"""
+    if os.path.isdir(path):
+        return 'maildir'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'mbox'
+
+def iter_corpus(path, input_format, skip=None):
+    """Yield (index, id, kind, payload) per message, loading only messages not skipped"""
+    skip = skip or (lambda index: False)
+    
+    if input_format == 'ndjson':
+        with open(path, 'rb') as f:
+            for index, (item, error) in enumerate(iter_ndjson(f)):
+                if skip(index):
+                    continue
+                if error:
+                    yield index, index, 'error', error
+                elif isinstance(item, dict):
+                    yield index, item.get('id', index), 'text', item.get('email_content', '')
+                else:
+                    yield index, index, 'text', item
+        return
+    
+    if input_format == 'mbox':
+        box = mailbox.mbox(path, factory=None, create=False)
+        keys = box.iterkeys()
+    elif input_format == 'maildir':
+        box = mailbox.Maildir(path, factory=None, create=False)
+        # Maildir keys come from directory listings, so fix an order for checkpoints
+        keys = sorted(box.iterkeys())
+    else:
+        raise ValueError(f'Unknown input format: {input_format}')
+    
+    try:
+        for index, key in enumerate(keys):
+            if not skip(index):
+                yield index, key, 'raw', box.get_bytes(key)
+    finally:
+        box.close()
+
+def message_text(raw):
+    """Subject and text parts of a raw RFC 822 message, read as /analyze/message reads them"""
+    return extract_message(raw).text
+
+def _init_worker(rules_path=None):
+    """Build the worker's classifier once, on the default or the given rule pack"""
+    global _classifier
+    _classifier = EmailClassifier(load_rule_pack(rules_path) if rules_path else None)
+
+def _analyze_texts(texts):
+    """analyze_batch results, with very large bodies analysed window by window"""
+    batch = iter(_classifier.analyze_batch([text for text in texts if len(text) <= LARGE_BODY]))
+    return [next(batch) if len(text) <= LARGE_BODY else _classifier.analyze_stream(text) for text in texts]
+
+def classify_chunk(chunk):
+    """Classify one chunk of (id, kind, payload) items into output records"""
+    if _classifier is None:
+        _init_worker()
+    
+    seq, items = chunk
+    records = [None] * len(items)
+    texts = []
+    positions = []
+    
+    for position, (item_id, kind, payload) in enumerate(items):
+        try:
+            if kind == 'error':
+                raise ValueError(payload)
+            text = message_text(payload) if kind == 'raw' else payload
+            if not isinstance(text, str):
+                raise ValueError('Item must be a string or an object with email_content')
+        except Exception as e:
+            records[position] = {'id': item_id, 'error': str(e)}
+            continue
+        texts.append(text)
+        positions.append(position)
+    
+    for position, result in zip(positions, _analyze_texts(texts)):
+        records[position] = {
+            'id': items[position][0],
+            'category': result['category'],
+            'display_name': result['display_name'],
+            'confidence': result['confidence'],
+            'risk_level': result['risk_level'],
+            'indicators': sorted(result['indicators'])
+        }
+    
+    return seq, records
+
+class Checkpoint:
+    """Chunk-level progress and output size, saved atomically after every written chunk"""
+    
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.watermark = 0
+        self.done = set()
+        self.offset = None
+        
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('source') != source:
+                raise ValueError(f'Checkpoint {path} was written for a different input or chunk size')
+            self.watermark = state['watermark']
+            self.done = set(state['done'])
+            self.offset = state.get('offset')
+    
+    @property
+    def resuming(self):
+        return self.watermark > 0 or bool(self.done)
+    
+    def is_done(self, seq):
+        return seq < self.watermark or seq in self.done
+    
+    def mark(self, seq, offset=None):
+        """Record a written chunk, and the output size after it, and persist the new state"""
+        self.done.add(seq)
+        self.offset = offset
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+        
+        if self.path:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'source': self.source, 'watermark': self.watermark,
+                           'done': sorted(self.done), 'offset': self.offset}, f)
+            os.replace(tmp_path, self.path)
+
+class RecordWriter:
+    """Incremental NDJSON or CSV output"""
+    
+    def __init__(self, stream, output_format, write_header=True, fieldnames=OUTPUT_FIELDS):
+        self.stream = stream
+        self.output_format = output_format
+        if output_format == 'csv':
+            self._csv = csv.DictWriter(stream, fieldnames=fieldnames, extrasaction='ignore')
+            if write_header:
+                self._csv.writeheader()
+    
+    def write(self, records):
+        for record in records:
+            if self.output_format == 'csv':
+                if 'indicators' in record:
+                    record = dict(record, indicators=';'.join(record['indicators']))
+                self._csv.writerow(record)
+            else:
+                self.stream.write(json.dumps(record) + '\n')
+        self.stream.flush()
+
+def _chunks(items, chunk_size):
+    """Group (index, id, kind, payload) items into chunks numbered by index"""
+    seq, chunk = None, []
+    for index, *item in items:
+        if index // chunk_size != seq and chunk:
+            yield seq, chunk
+            chunk = []
+        seq = index // chunk_size
+        chunk.append(tuple(item))
+    if chunk:
+        yield seq, chunk
+
+def run(input_path, output_path='-', input_format=None, output_format='ndjson', workers=None,
+        chunk_size=64, ordered=True, checkpoint_path=None, max_in_flight=None, rules_path=None):
+    """Classify a corpus, streaming records to output; returns the number written"""
+    input_format = input_format or detect_format(input_path)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+    
+    if checkpoint_path and output_path == '-':
+        raise ValueError('A checkpoint needs a file output')
+    if rules_path:
+        load_rule_pack(rules_path)  # fail here rather than in every worker
+    
+    source = {'input': os.path.abspath(input_path), 'format': input_format, 'chunk_size': chunk_size}
+    checkpoint = Checkpoint(checkpoint_path, source)
+    
+    def skip(index):
+        return checkpoint.is_done(index // chunk_size)
+    
+    chunks = _chunks(iter_corpus(input_path, input_format, skip), chunk_size)
+    
+    if output_path == '-':
+        out = sys.stdout
+    else:
+        out = open(output_path, 'a' if checkpoint.resuming else 'w', newline='', encoding='utf-8')
+        if checkpoint.resuming and checkpoint.offset is not None:
+            # Drop whatever was written after the last checkpoint, including a partly written record
+            out.truncate(checkpoint.offset)
+            out.seek(checkpoint.offset)
+    
+    written = 0
+    try:
+        writer = RecordWriter(out, output_format, write_header=not checkpoint.resuming)
+        
+        def emit(seq, records):
+            nonlocal written
+            writer.write(records)
+            checkpoint.mark(seq, out.tell() if checkpoint.path else None)
+            written += len(records)
+        
+        if workers == 1:
+            _init_worker(rules_path)
+            for chunk in chunks:
+                emit(*classify_chunk(chunk))
+            return written
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules_path,)) as pool:
+            pending = deque() if ordered else set()
+            for chunk in chunks:
+                if ordered:
+                    pending.append(pool.submit(classify_chunk, chunk))
+                else:
+                    pending.add(pool.submit(classify_chunk, chunk))
+                
+                # Bound the number of chunks held by the parent
+                while len(pending) >= max_in_flight:
+                    if ordered:
+                        emit(*pending.popleft().result())
+                    else:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            emit(*future.result())
+            
+            if ordered:
+                for future in pending:
+                    emit(*future.result())
+            else:
+                for future in wait(pending).done:
+                    emit(*future.result())
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    
+    return written
+
+def cluster(input_path, output_path='-', input_format=None, output_format='ndjson', threshold=0.8,
+            max_clusters=50000):
+    """Group a corpus into near-duplicate campaigns in one pass; returns the number written"""
+    input_format = input_format or detect_format(input_path)
+    errors = []
+    
+    def texts():
+        for _, item_id, kind, payload in iter_corpus(input_path, input_format):
+            try:
+                if kind == 'error':
+                    raise ValueError(payload)
+                text = message_text(payload) if kind == 'raw' else payload
+                if not isinstance(text, str):
+                    raise ValueError('Item must be a string or an object with email_content')
+            except Exception as e:
+                errors.append({'id': item_id, 'error': str(e)})
+                continue
+            yield item_id, text
+    
+    out = sys.stdout if output_path == '-' else open(output_path, 'w', newline='', encoding='utf-8')
+    written = 0
+    try:
+        writer = RecordWriter(out, output_format, fieldnames=CLUSTER_FIELDS)
+        for item_id, cluster_id, similarity, representative in cluster_corpus(texts(), threshold, max_clusters=max_clusters):
+            # Errors are reported in input order alongside the clustered items
+            writer.write(errors)
+            written += len(errors)
+            errors.clear()
+            writer.write([{'id': item_id, 'cluster': cluster_id, 'similarity': similarity,
+                           'representative': representative}])
+            written += 1
+        writer.write(errors)
+        written += len(errors)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    
+    return written
@@ -0,0 +1,128 @@
+"""
+In-process result cache for repeated email bodies
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+def content_hash(text):
+    """Fast, collision-resistant key for an email body"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+
+def copy_result(value):
+    """Copy a result made of dicts, lists and scalars so callers cannot mutate the cache"""
+    if isinstance(value, dict):
+        return {key: copy_result(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_result(item) for item in value]
+    return value
+
+class ResultCache:
+    """Thread-safe LRU cache with a TTL, keyed by content hash and rules version"""
+    
+    def __init__(self, maxsize=4096, ttl=600, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._version = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def configure(self, maxsize=None, ttl=None):
+        """Resize the cache or change its TTL, dropping entries that no longer fit"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            while len(self._entries) > max(self.maxsize, 0):
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_or_compute(self, text, version, compute, variant=None):
+        """Return a copy of the cached result for text, computing it on a miss
+        
+        Results for different variants of the same text, such as response
+        profiles, are cached separately. Concurrent misses on the same text
+        wait for a single computation instead of repeating it.
+        """
+        if self.maxsize <= 0:
+            return compute(text)
+        
+        key = (content_hash(text), variant)
+        
+        while True:
+            now = self.clock()
+            with self._lock:
+                # Rule changes make every stored result stale
+                if version != self._version:
+                    if self._entries:
+                        self.invalidations += 1
+                    self._entries.clear()
+                    self._version = version
+                
+                entry = self._entries.get(key)
+                if entry is not None:
+                    expires_at, result = entry
+                    if expires_at > now:
+                        self._entries.move_to_end(key)
+                        self.hits += 1
+                        return copy_result(result)
+                    del self._entries[key]
+                    self.expirations += 1
+                
+                flight = self._pending.get(key)
+                if flight is None:
+                    flight = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            
+            # Another thread is computing this body; wait for it, then look again
+            flight.wait()
+        
+        # Compute outside the lock so a slow analysis does not block other requests
+        try:
+            result = compute(text)
+            with self._lock:
+                if version == self._version:
+                    self._entries[key] = (now + self.ttl, copy_result(result))
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+        finally:
+            with self._lock:
+                del self._pending[key]
+            flight.set()
+        
+        return result
+    
+    def stats(self):
+        """Cache size and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+# Global cache in front of email_classifier, sized by create_app
+result_cache = ResultCache()
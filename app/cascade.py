@@ -0,0 +1,158 @@
+"""
+Tiered classification that stops as soon as one category clearly leads
+"""
+import threading
+import time
+
+from app.learned import learned_classifier
+from app.models import email_classifier
+
+TIERS = ('keywords', 'full', 'learned')
+
+def _lead(scores):
+    """Top category and its lead over the runner-up"""
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if not ranked:
+        return None, 0.0
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    return ranked[0][0], ranked[0][1] - runner_up
+
+class Cascade:
+    """Keyword pass, then the full pipeline, then the learned model, each only when needed
+    
+    A tier decides when its top score leads the runner-up by at least the
+    tier's margin. The next tier is skipped when its expected time, from a
+    moving average of seconds per character, would overrun the latency budget.
+    """
+    
+    def __init__(self, classifier, learned=None, keyword_margin=0.5, full_margin=0.2, budget=0.05,
+                 enabled=False, clock=time.perf_counter):
+        self.classifier = classifier
+        self.learned = learned
+        self.keyword_margin = keyword_margin
+        self.full_margin = full_margin
+        self.budget = budget
+        self.enabled = enabled
+        self.clock = clock
+        self._rates = {tier: None for tier in TIERS}
+        self._lock = threading.Lock()
+        self.decisions = {tier: 0 for tier in TIERS}
+        self.budget_stops = 0
+    
+    def configure(self, enabled=None, keyword_margin=None, full_margin=None, budget=None):
+        """Change the mode, margins or default budget"""
+        if enabled is not None:
+            self.enabled = enabled
+        if keyword_margin is not None:
+            self.keyword_margin = keyword_margin
+        if full_margin is not None:
+            self.full_margin = full_margin
+        if budget is not None:
+            self.budget = budget
+    
+    def _expected(self, tier, size):
+        """Seconds the tier is expected to take on size characters"""
+        rate = self._rates[tier]
+        return 0.0 if rate is None else rate * size
+    
+    def _observe(self, tier, elapsed, size):
+        with self._lock:
+            rate = elapsed / max(size, 1)
+            if self._rates[tier] is None:
+                self._rates[tier] = rate
+            else:
+                self._rates[tier] += 0.2 * (rate - self._rates[tier])
+    
+    def _fits(self, tier, start, size, budget):
+        """Whether the tier is expected to finish within the budget"""
+        return self.clock() - start + self._expected(tier, size) <= budget
+    
+    def _decide(self, result, tier, reason, margin):
+        with self._lock:
+            self.decisions[tier] += 1
+            if reason == 'budget':
+                self.budget_stops += 1
+        result['cascade'] = {'tier': tier, 'reason': reason, 'margin': round(margin * 100, 1)}
+        return result
+    
+    def analyze(self, email_text, budget=None, fields=None):
+        """analyze_email result from the cheapest tier that is confident, within budget seconds"""
+        budget = self.budget if budget is None else budget
+        classifier = self.classifier
+        with_indicators = fields is None or 'indicators' in fields
+        with_features = fields is None or 'features' in fields
+        start = self.clock()
+        
+        with classifier.pinned_rules():
+            if not email_text or not email_text.strip():
+                return self._decide(classifier.analyze_email(email_text, fields), 'keywords', 'margin', 0.0)
+            size = len(email_text)
+            
+            # Tier 1: keyword counts only, plus the indicators and features shown to users
+            clean_text = classifier._clean_text(email_text)
+            keyword_scores = classifier._keyword_classification(clean_text)
+            category, margin = _lead(keyword_scores)
+            self._observe('keywords', self.clock() - start, size)
+            
+            if margin >= self.keyword_margin or not self._fits('full', start, size, budget):
+                # Combined as if the other stages scored nothing, so weak leads fall back to not_spam
+                nothing = dict.fromkeys(keyword_scores, 0.0)
+                scores = classifier._intelligent_score_combination(keyword_scores, nothing, nothing, {})
+                category = max(scores.items(), key=lambda x: x[1])[0]
+                # The features come from the same pattern scan as the indicators, so responses keep one shape
+                if with_features:
+                    features, indicators = classifier.describe(email_text)
+                else:
+                    features = {}
+                    indicators = classifier._find_indicators(email_text) if with_indicators else []
+                result = classifier._create_result(category, scores[category], scores, indicators, features, fields)
+                reason = 'margin' if margin >= self.keyword_margin else 'budget'
+                return self._decide(result, 'keywords', reason, margin)
+            
+            # Tier 2: the full rule-based pipeline
+            tier_start = self.clock()
+            final_scores, indicators, features = classifier._score_email(
+                email_text, clean_text, keyword_scores, with_indicators
+            )
+            category, margin = _lead(final_scores)
+            self._observe('full', self.clock() - tier_start, size)
+            
+            learned = self.learned if self.learned is not None and self.learned.loaded else None
+            if margin >= self.full_margin or learned is None or not self._fits('learned', start, size, budget):
+                result = classifier._create_result(
+                    category, final_scores[category], final_scores, indicators, features, fields
+                )
+                if margin >= self.full_margin:
+                    reason = 'margin'
+                elif learned is None:
+                    reason = 'final'
+                else:
+                    reason = 'budget'
+                return self._decide(result, 'full', reason, margin)
+            
+            # Tier 3: average the rule scores with the learned model's probabilities
+            tier_start = self.clock()
+            probabilities = learned.predict_proba(email_text)
+            self._observe('learned', self.clock() - tier_start, size)
+            
+            blended = {name: (score + probabilities.get(name, 0.0)) / 2 for name, score in final_scores.items()}
+            category, margin = _lead(blended)
+            result = classifier._create_result(category, blended[category], blended, indicators, features, fields)
+            return self._decide(result, 'learned', 'final', margin)
+    
+    def stats(self):
+        """Mode, margins and how often each tier decided"""
+        with self._lock:
+            decided = sum(self.decisions.values())
+            return {
+                'enabled': self.enabled,
+                'keyword_margin': self.keyword_margin,
+                'full_margin': self.full_margin,
+                'budget': self.budget,
+                'decisions': dict(self.decisions),
+                'fast_path_rate': round(self.decisions['keywords'] / decided, 4) if decided else None,
+                'budget_stops': self.budget_stops
+            }
+
+# Global cascade over the shared classifiers, configured by create_app
+cascade = Cascade(email_classifier, learned_classifier)
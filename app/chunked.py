@@ -0,0 +1,208 @@
+"""
+Bounded-memory analysis of very large email bodies in overlapping windows
+"""
+import re
+
+from app.features import character_features
+from app.matching import KeywordCounter, count_email_addresses
+from app.models import NEWSLETTER_WORDS, PROFESSIONAL_INDICATORS, SOCIAL_TERMS, _HTTP_URL_RE, _WHITESPACE_RE
+
+WINDOW_SIZE = 64 * 1024
+
+# Characters of the previous window searched again with the next one; must
+# exceed the longest match of any multi-word pattern or phrase
+OVERLAP = 256
+
+# Bodies above this size are analysed window by window
+LARGE_BODY = 1024 * 1024
+
+# Substrings the pattern and context stages look for in the lowercased text
+PHRASES = tuple(dict.fromkeys(NEWSLETTER_WORDS + PROFESSIONAL_INDICATORS + SOCIAL_TERMS + ['unsubscribe']))
+
+_LAST_SPACE_RE = re.compile(r'\s\S*\Z')
+_SPACE_RE = re.compile(r'\s')
+
+def iter_windows(source, window_size=WINDOW_SIZE):
+    """Yield consecutive pieces of source that each end in whitespace, bar the last
+    
+    source is a string, a text file object or an iterable of strings. A piece
+    is only longer than window_size when a single whitespace-free run is.
+    """
+    if isinstance(source, str):
+        chunks = (source[i:i + window_size] for i in range(0, len(source), window_size))
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(window_size), '')
+    else:
+        chunks = source
+    
+    pending = ''
+    searched = 0
+    for chunk in chunks:
+        pending += chunk
+        while len(pending) >= window_size:
+            match = _LAST_SPACE_RE.search(pending, 0, window_size)
+            if match is None:
+                match = _SPACE_RE.search(pending, max(searched, window_size))
+                if match is None:
+                    searched = len(pending)
+                    break
+            cut = match.start() + 1
+            yield pending[:cut]
+            pending = pending[cut:]
+            searched = 0
+    
+    if pending:
+        yield pending
+
+class _Seen(set):
+    """Pattern names or phrases found so far
+    
+    Stands in for a MatchTable (found) or for the lowercased text (in) in
+    the classifier stages, which only ask about presence.
+    """
+    found = set.__contains__
+
+class ChunkedAnalysis:
+    """Running analysis of an email fed as windows from iter_windows
+    
+    Windows end in whitespace, so the counted regexes, which never match
+    whitespace, are counted per window. Keywords carry their own tail across
+    windows, and presence patterns search each window with the last OVERLAP
+    characters of the one before.
+    """
+    
+    def __init__(self, classifier, overlap=OVERLAP):
+        self.classifier = classifier
+        self.overlap = overlap
+        self._regexes = classifier.pattern_registry.compiled()
+        self._lower_regexes = classifier.pattern_registry.compiled(ignore_case=False)
+        self._keywords = KeywordCounter(classifier.keyword_matcher)
+        
+        self._found = _Seen()
+        self._lower_found = _Seen()
+        self._phrases = _Seen()
+        self._tail = ''
+        self._lower_tail = ''
+        self._tail_cut = False
+        self._lower_tail_cut = False
+        
+        # Whitespace collapsing of _clean_text across windows
+        self._started = False
+        self._space = False
+        
+        self._chars = 0
+        self._words = 0
+        self._word_chars = 0
+        self._sentences = 0
+        self._open_sentence = False
+        self._exclamations = 0
+        self._questions = 0
+        self._caps = 0
+        self._urls = 0
+        self._http_urls = 0
+        self._email_addresses = 0
+        self._phone_numbers = 0
+        self._money = 0
+    
+    def feed(self, window):
+        """Add the next window of the email"""
+        lowered = window.lower()
+        self._count_features(window)
+        self._feed_clean_text(lowered)
+        
+        # The first character of a cut-down tail is only context for \b
+        text = self._tail + window
+        self._search(text, self._tail_cut, self._regexes, self._found)
+        self._tail_cut = self._tail_cut or len(text) > self.overlap
+        self._tail = text[-self.overlap:]
+        
+        text = self._lower_tail + lowered
+        self._search(text, self._lower_tail_cut, self._lower_regexes, self._lower_found)
+        for phrase in PHRASES:
+            if phrase not in self._phrases and phrase in text:
+                self._phrases.add(phrase)
+        self._lower_tail_cut = self._lower_tail_cut or len(text) > self.overlap
+        self._lower_tail = text[-self.overlap:]
+    
+    def _count_features(self, window):
+        counts = character_features(window)
+        self._chars += counts['chars']
+        self._words += counts['words']
+        self._word_chars += counts['word_chars']
+        
+        # A sentence may continue from the previous window
+        if not counts['delimited']:
+            self._open_sentence = self._open_sentence or counts['leading_sentence']
+        else:
+            self._sentences += counts['sentences'] - counts['trailing_sentence']
+            if self._open_sentence and not counts['leading_sentence']:
+                self._sentences += 1
+            self._open_sentence = counts['trailing_sentence']
+        
+        self._exclamations += counts['exclamations']
+        self._questions += counts['questions']
+        self._caps += counts['caps']
+        self._urls += counts['urls']
+        self._http_urls += len(_HTTP_URL_RE.findall(window))
+        self._email_addresses += count_email_addresses(window)
+        self._phone_numbers += counts['phone_numbers']
+        self._money += len(self._regexes['money_amounts'].findall(window))
+    
+    def _feed_clean_text(self, lowered):
+        """Pass the window's part of _clean_text on to the keyword counter"""
+        collapsed = _WHITESPACE_RE.sub(' ', lowered)
+        core = collapsed.strip()
+        if not core:
+            self._space = self._space or bool(collapsed)
+            return
+        
+        if self._started and (self._space or collapsed[0] == ' '):
+            core = ' ' + core
+        self._space = collapsed[-1] == ' '
+        self._started = True
+        self._keywords.feed(core)
+    
+    def _search(self, text, skip_first, regexes, found):
+        """Record the patterns present in text, a window behind its overlap"""
+        pos = 1 if skip_first else 0
+        for name, regex in regexes.items():
+            if name not in found and regex.search(text, pos):
+                found.add(name)
+    
+    def finish(self, fields=None):
+        """The analyze_email result for everything fed so far"""
+        classifier = self.classifier
+        if not self._words:
+            return classifier._create_result('unknown', 0.0, {}, [], {}, fields)
+        
+        if self._open_sentence:
+            self._sentences += 1
+            self._open_sentence = False
+        
+        features = {
+            'char_count': self._chars,
+            'word_count': self._words,
+            'sentence_count': self._sentences,
+            'avg_word_length': self._word_chars / max(self._words, 1),
+            'exclamation_count': self._exclamations,
+            'question_count': self._questions,
+            'caps_ratio': self._caps / max(self._chars, 1),
+            'url_count': self._urls,
+            'email_addresses': self._email_addresses,
+            'phone_numbers': self._phone_numbers,
+            'money_mentions': self._money
+        }
+        
+        keyword_scores = classifier._keyword_scores(self._keywords.finish())
+        pattern_scores = classifier._pattern_classification(self._phrases, self._lower_found)
+        context_scores = classifier._context_classification(self._phrases, features)
+        
+        final_scores = classifier._intelligent_score_combination(
+            keyword_scores, pattern_scores, context_scores, features
+        )
+        primary_category = max(final_scores.items(), key=lambda x: x[1])[0]
+        confidence = final_scores[primary_category]
+        
+        indicators = classifier._collect_indicators(self._found, self._exclamations, self._http_urls)
+        
+        return classifier._create_result(primary_category, confidence, final_scores, indicators, features, fields)
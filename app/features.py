@@ -0,0 +1,115 @@
+"""
+Character-level email features counted in one vectorised pass over the text
+"""
+import re
+
+import numpy as np
+
+_SENTENCE_SPLIT_RE = re.compile(r'[.!?]+')
+_URL_RE = re.compile(r'https?://\S+|www\.\S+')
+_PHONE_NUMBER_RE = re.compile(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b')
+
+# Below this many characters the plain string methods beat NumPy's call overhead
+VECTOR_MIN_CHARS = 256
+
+# Digits a phone number match needs
+_PHONE_DIGITS = 10
+
+def character_features(text):
+    """Counts behind the text features, from one classification of every character
+    
+    Returns a dict with chars, words, word_chars (characters in words),
+    sentences (non-blank pieces between runs of . ! ?), exclamations,
+    questions, caps (str.isupper characters), urls and phone_numbers, all
+    equal to the str and re based counts. For callers that see a text in
+    pieces it also says whether the first and last pieces are non-blank
+    (leading_sentence, trailing_sentence) and whether any . ! ? occurs
+    (delimited).
+    """
+    if len(text) < VECTOR_MIN_CHARS:
+        counts = _count_plain(text)
+    else:
+        counts = _count_vector(text)
+    counts['urls'] = len(_URL_RE.findall(text)) if 'http' in text or 'www.' in text else 0
+    return counts
+
+def _count_plain(text):
+    words = text.split()
+    pieces = _SENTENCE_SPLIT_RE.split(text)
+    return {
+        'chars': len(text),
+        'words': len(words),
+        'word_chars': sum(map(len, words)),
+        'sentences': len([piece for piece in pieces if piece.strip()]),
+        'leading_sentence': bool(pieces[0].strip()),
+        'trailing_sentence': bool(pieces[-1].strip()),
+        'delimited': len(pieces) > 1,
+        'exclamations': text.count('!'),
+        'questions': text.count('?'),
+        'caps': sum(map(str.isupper, text)),
+        'phone_numbers': len(_PHONE_NUMBER_RE.findall(text))
+    }
+
+def _count_vector(text):
+    """_count_plain over a code array: bytes for ASCII text, code points otherwise"""
+    if text.isascii():
+        codes = np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+        extra_spaces = extra_caps = extra_digits = ()
+    else:
+        codes = np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+        # str.isspace, isupper and isdecimal only have to be asked of the non-ASCII characters
+        wide = np.flatnonzero(codes > 127).tolist()
+        extra_spaces = [i for i in wide if text[i].isspace()]
+        extra_caps = [i for i in wide if text[i].isupper()]
+        extra_digits = [i for i in wide if text[i].isdecimal()]
+    
+    # ASCII whitespace as str.split sees it: \t-\r, \x1c-\x1f and space
+    space = (codes == 32) | ((codes >= 9) & (codes <= 13)) | ((codes >= 28) & (codes <= 31))
+    if extra_spaces:
+        space[extra_spaces] = True
+    spaces = int(np.count_nonzero(space))
+    words = int(np.count_nonzero(space[:-1] & ~space[1:])) + (not space[0])
+    
+    # A sentence starts at each non-space character that follows a delimiter, or none
+    visible = codes[~space]
+    delimiter = (visible == 46) | (visible == 33) | (visible == 63)
+    leading = bool(len(visible)) and not delimiter[0]
+    trailing = bool(len(visible)) and not delimiter[-1]
+    sentences = int(np.count_nonzero(delimiter[:-1] & ~delimiter[1:])) + leading
+    
+    return {
+        'chars': len(text),
+        'words': words,
+        'word_chars': len(text) - spaces,
+        'sentences': sentences,
+        'leading_sentence': leading,
+        'trailing_sentence': trailing,
+        'delimited': bool(delimiter.any()),
+        'exclamations': int(np.count_nonzero(codes == 33)),
+        'questions': int(np.count_nonzero(codes == 63)),
+        'caps': int(np.count_nonzero((codes >= 65) & (codes <= 90))) + len(extra_caps),
+        'phone_numbers': _count_phone_numbers(text, codes, extra_digits)
+    }
+
+def _count_phone_numbers(text, codes, extra_digits):
+    """len(_PHONE_NUMBER_RE.findall(text)), searching only runs of digits, dots and hyphens
+    
+    Every match lies inside such a run, so the regex runs over each run
+    long enough to hold one, with the next character left in view for \\b.
+    """
+    digit = (codes >= 48) & (codes <= 57)
+    if extra_digits:
+        digit[extra_digits] = True
+    if np.count_nonzero(digit) < _PHONE_DIGITS:
+        return 0
+    
+    run = digit | (codes == 45) | (codes == 46)
+    edges = np.flatnonzero(np.diff(run.view(np.int8), prepend=0, append=0))
+    starts, ends = edges[::2], edges[1::2]
+    digits = np.concatenate(([0], np.cumsum(digit)))
+    candidates = (digits[ends] - digits[starts]) >= _PHONE_DIGITS
+    
+    count = 0
+    for start, end in zip(starts[candidates].tolist(), ends[candidates].tolist()):
+        count += len(_PHONE_NUMBER_RE.findall(text, start, end + 1))
+    return count
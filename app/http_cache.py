@@ -0,0 +1,71 @@
+"""
+Precompressed responses with cache validators for rarely changing payloads
+"""
+import gzip
+import hashlib
+import os
+import time
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Content codings in order of preference when the client accepts several
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+def file_mtime(*paths):
+    """Latest modification time of paths that exist, else now"""
+    times = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+    return max(times) if times else time.time()
+
+class CachedPayload:
+    """A response body with a strong ETag, a Last-Modified time and its compressed forms
+    
+    Compression runs once, here; responses then pick a stored encoding
+    according to Accept-Encoding and answer conditional requests with 304.
+    """
+    
+    def __init__(self, body, mimetype, last_modified=None, max_age=300):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.max_age = max_age
+        self.last_modified = int(last_modified if last_modified is not None else time.time())
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        
+        self.bodies = {'identity': body}
+        for encoding in ENCODINGS:
+            compressed = _compress(body, encoding)
+            if len(compressed) < len(body):
+                self.bodies[encoding] = compressed
+    
+    def response(self):
+        """The payload for the current request, 304 when the client's copy is current"""
+        encoding = request.accept_encodings.best_match(
+            [encoding for encoding in ENCODINGS if encoding in self.bodies], 'identity'
+        )
+        response = Response(self.bodies[encoding], mimetype=self.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        
+        # Each encoding is a different representation, so it gets its own strong tag
+        response.set_etag(self.etag if encoding == 'identity' else f'{self.etag}-{encoding}')
+        response.last_modified = self.last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
+
+def _compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=11)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+def revalidated(response):
+    """Tag a dynamic response so unchanged bodies are answered with 304"""
+    response.add_etag()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
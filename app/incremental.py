@@ -0,0 +1,407 @@
+"""
+Compose-time analysis sessions that re-analyse only the edited part of a draft
+"""
+import bisect
+import itertools
+import secrets
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from app.chunked import OVERLAP, PHRASES, _Seen, iter_windows
+from app.features import character_features
+from app.matching import count_email_addresses
+from app.models import _HTTP_URL_RE, _WHITESPACE_RE, email_classifier
+
+# Target segment size; an edit re-analyses the segments it touches and the one after
+SEGMENT_SIZE = 1024
+
+# Additive per-segment counts, in the order of the features they feed
+_COUNTS = (
+    'chars', 'words', 'word_chars', 'sentences', 'exclamations', 'questions', 'caps', 'urls',
+    'http_urls', 'email_addresses', 'phone_numbers', 'money'
+)
+
+def _clean_length(text):
+    return len(_WHITESPACE_RE.sub(' ', text).strip())
+
+class _Segment:
+    """A piece of the draft ending in whitespace, bar the last, with what it adds to the totals
+    
+    Everything here depends on the segment's text and the previous segment
+    only: its raw and cleaned tails, whether its last sentence is still
+    open and where its last counted keywords end.
+    """
+    __slots__ = ('text', 'clean', 'counts', 'keywords', 'carry', 'open_sentence', 'found', 'lower_found', 'phrases')
+    
+    def links(self):
+        """The state the next segment's analysis starts from"""
+        return self.open_sentence, self.carry
+
+class IncrementalAnalysis:
+    """A draft held as segments whose counts are kept in running totals
+    
+    The segments end in whitespace, so counted regexes and word splits never
+    cross them, and each holds enough text that keyword and pattern matches
+    reach back at most one segment. An edit re-analyses the segments it
+    touches, then the following ones only while the state they hand on
+    changes, so its cost follows the size of the edit rather than the draft.
+    The result is the analyze_email result for the whole draft.
+    """
+    
+    def __init__(self, classifier, text='', max_chars=None):
+        self.classifier = classifier
+        self.max_chars = max_chars
+        self.version = 0
+        self.lock = threading.Lock()
+        self._rules = None
+        self._length = 0
+        with classifier.pinned_rules() as rules:
+            self._rebuild(rules, text)
+    
+    @property
+    def text(self):
+        return ''.join(segment.text for segment in self._segments)
+    
+    def __len__(self):
+        return self._length
+    
+    def _rebuild(self, rules, text):
+        """Analyse the whole draft from scratch, under rules"""
+        self._rules = rules
+        self._regexes = rules.pattern_registry.compiled()
+        self._lower_regexes = rules.pattern_registry.compiled(ignore_case=False)
+        self._money = self._regexes['money_amounts']
+        self._keep = max(rules.keyword_matcher._lengths, default=1) - 1
+        self._min_clean = max(OVERLAP, self._keep)
+        
+        self._counts = Counter()
+        self._keywords = Counter()
+        self._found = Counter()
+        self._lower_found = Counter()
+        self._phrases = Counter()
+        self._segments = []
+        self._starts = []
+        self._length = len(text)
+        
+        previous = None
+        position = 0
+        pieces = self._split(text)
+        for index, piece in enumerate(pieces):
+            previous = self._analyze(piece, previous, position > OVERLAP, index == len(pieces) - 1)
+            self._segments.append(previous)
+            self._add(previous, 1)
+            position += len(piece)
+        self._index()
+    
+    def _index(self):
+        self._starts = [0, *itertools.accumulate(len(segment.text) for segment in self._segments)][:-1]
+    
+    def _split(self, text):
+        """Segments of text, each but the last ending in whitespace and holding enough content"""
+        segments = []
+        current = ''
+        for piece in iter_windows(text, SEGMENT_SIZE):
+            current += piece
+            if _clean_length(current) >= self._min_clean and current[-1].isspace():
+                segments.append(current)
+                current = ''
+        if current:
+            if segments:
+                segments[-1] += current
+            else:
+                segments.append(current)
+        return segments
+    
+    def _analyze(self, text, previous, context_cut, last):
+        """Counts and matches of one segment, given the segment before it"""
+        segment = _Segment()
+        segment.text = text
+        lowered = text.lower()
+        
+        # Counted regexes never match whitespace, so they never cross segments
+        counts = character_features(text)
+        open_before = previous.open_sentence if previous else False
+        opening = counts['leading_sentence']
+        sentences = counts['sentences'] - opening + (opening and not open_before)
+        segment.open_sentence = counts['trailing_sentence'] if counts['delimited'] else opening or open_before
+        segment.counts = (
+            counts['chars'], counts['words'], counts['word_chars'], sentences, counts['exclamations'],
+            counts['questions'], counts['caps'], counts['urls'], len(_HTTP_URL_RE.findall(text)),
+            count_email_addresses(text), counts['phone_numbers'], len(self._money.findall(text))
+        )
+        
+        # This segment's part of _clean_text; the previous one ends in a collapsed space
+        clean = _WHITESPACE_RE.sub(' ', lowered).lstrip(' ')
+        segment.clean = clean.rstrip(' ') if last else clean
+        self._count_keywords(segment, previous)
+        
+        # Presence patterns, searched with the previous segment's tail as context
+        tail = previous.text[-OVERLAP:] if previous else ''
+        pos = 1 if context_cut else 0
+        context = tail + text
+        lower_context = tail.lower() + lowered
+        segment.found = frozenset(name for name, regex in self._regexes.items() if regex.search(context, pos))
+        segment.lower_found = frozenset(
+            name for name, regex in self._lower_regexes.items() if regex.search(lower_context, pos)
+        )
+        segment.phrases = frozenset(phrase for phrase in PHRASES if phrase in lower_context)
+        return segment
+    
+    def _count_keywords(self, segment, previous):
+        """KeywordCounter's greedy counts of the keywords that end in this segment
+        
+        The previous segment hands on where its last counted occurrence of
+        each keyword ends, so overlapping occurrences are counted once.
+        """
+        matcher = self._rules.keyword_matcher
+        tail = previous.clean[-self._keep:] if previous and self._keep else ''
+        text = tail + segment.clean
+        base = len(tail)
+        next_start = {i: base + end for i, end in previous.carry.items()} if previous else {}
+        counts = Counter()
+        ends = {}
+        
+        if matcher._regex is not None:
+            search = matcher._regex.search
+            lengths = matcher._lengths
+            prefixes = matcher._prefixes
+            match = search(text)
+            while match:
+                start = match.start()
+                for i in prefixes[match.group()]:
+                    end = start + lengths[i]
+                    if end > base and start >= next_start.get(i, 0):
+                        counts[i] += 1
+                        next_start[i] = ends[i] = end
+                match = search(text, start + 1)
+        
+        segment.keywords = counts
+        segment.carry = {i: end - len(text) for i, end in ends.items() if len(text) - end < self._keep}
+    
+    def _add(self, segment, sign):
+        """Add a segment's contribution to the totals, or take it away with sign -1"""
+        for name, value in zip(_COUNTS, segment.counts):
+            self._counts[name] += sign * value
+        for totals, items in ((self._found, segment.found), (self._lower_found, segment.lower_found),
+                              (self._phrases, segment.phrases)):
+            for item in items:
+                totals[item] += sign
+        for i, count in segment.keywords.items():
+            self._keywords[i] += sign * count
+    
+    def apply(self, edits):
+        """Apply (offset, deleted, inserted) edits in order; offsets count characters
+        
+        Raises ValueError, leaving the draft as it was, if any edit does not fit.
+        """
+        length = self._length
+        for edit in edits:
+            offset, deleted, inserted = edit
+            if not (isinstance(offset, int) and isinstance(deleted, int) and isinstance(inserted, str)):
+                raise ValueError('An edit is an integer offset, an integer delete count and an insert string')
+            if offset < 0 or deleted < 0 or offset + deleted > length:
+                raise ValueError(f'Edit at {offset} deleting {deleted} is outside the {length} characters')
+            length += len(inserted) - deleted
+            if self.max_chars is not None and length > self.max_chars:
+                raise ValueError(f'Drafts are limited to {self.max_chars} characters')
+        
+        with self.classifier.pinned_rules() as rules:
+            if rules is not self._rules:
+                self._rebuild(rules, self.text)
+            for offset, deleted, inserted in edits:
+                if deleted or inserted:
+                    self._edit(offset, deleted, inserted)
+            self.version += 1
+    
+    def _edit(self, offset, deleted, inserted):
+        segments = self._segments
+        starts = self._starts
+        if not segments:
+            self._rebuild(self._rules, inserted)
+            return
+        
+        # The segments the edit touches, including the one ending where it starts
+        end = offset + deleted
+        first = max(bisect.bisect_right(starts, offset) - 1, 0)
+        if first > 0 and starts[first] == offset:
+            first -= 1
+        last = max(first, bisect.bisect_right(starts, max(end - 1, offset)) - 1)
+        region_start = starts[first]
+        region = ''.join(segment.text for segment in segments[first:last + 1])
+        region = region[:offset - region_start] + inserted + region[end - region_start:]
+        
+        # Widen the region until it ends in whitespace and holds enough content to stand alone
+        while last + 1 < len(segments) and not (region and region[-1].isspace()):
+            last += 1
+            region += segments[last].text
+        while _clean_length(region) < self._min_clean and (first > 0 or last + 1 < len(segments)):
+            if first > 0:
+                first -= 1
+                region_start = starts[first]
+                region = segments[first].text + region
+            else:
+                last += 1
+                region += segments[last].text
+        
+        self._length += len(inserted) - deleted
+        previous = segments[first - 1] if first > 0 else None
+        at_end = last == len(segments) - 1
+        replaced = segments[first:last + 1]
+        
+        pieces = self._split(region)
+        fresh = []
+        position = region_start
+        for index, piece in enumerate(pieces):
+            previous = self._analyze(
+                piece, previous, previous is not None and position > OVERLAP, at_end and index == len(pieces) - 1
+            )
+            fresh.append(previous)
+            position += len(piece)
+        
+        # Later segments are unchanged text, but they start from new state until it settles
+        following = last + 1
+        while following < len(segments):
+            old = segments[following]
+            new = self._analyze(old.text, previous, position > OVERLAP, following == len(segments) - 1)
+            replaced.append(old)
+            fresh.append(new)
+            previous = new
+            position += len(old.text)
+            following += 1
+            if new.links() == old.links():
+                break
+        
+        for segment in replaced:
+            self._add(segment, -1)
+        for segment in fresh:
+            self._add(segment, 1)
+        segments[first:following] = fresh
+        self._index()
+    
+    def result(self, fields=None):
+        """The analyze_email result for the current draft"""
+        classifier = self.classifier
+        with classifier.pinned_rules() as rules:
+            if rules is not self._rules:
+                self._rebuild(rules, self.text)
+            
+            counts = self._counts
+            if not counts['words']:
+                return classifier._create_result('unknown', 0.0, {}, [], {}, fields)
+            
+            features = {
+                'char_count': counts['chars'],
+                'word_count': counts['words'],
+                'sentence_count': counts['sentences'],
+                'avg_word_length': counts['word_chars'] / max(counts['words'], 1),
+                'exclamation_count': counts['exclamations'],
+                'question_count': counts['questions'],
+                'caps_ratio': counts['caps'] / max(counts['chars'], 1),
+                'url_count': counts['urls'],
+                'email_addresses': counts['email_addresses'],
+                'phone_numbers': counts['phone_numbers'],
+                'money_mentions': counts['money']
+            }
+            
+            found = _Seen(name for name, count in self._found.items() if count)
+            lower_found = _Seen(name for name, count in self._lower_found.items() if count)
+            phrases = _Seen(phrase for phrase, count in self._phrases.items() if count)
+            keyword_counts = [self._keywords[i] for i in range(len(rules.keyword_matcher.keywords))]
+            
+            keyword_scores = classifier._keyword_scores(keyword_counts)
+            pattern_scores = classifier._pattern_classification(phrases, lower_found)
+            context_scores = classifier._context_classification(phrases, features)
+            
+            final_scores = classifier._intelligent_score_combination(
+                keyword_scores, pattern_scores, context_scores, features
+            )
+            primary_category = max(final_scores.items(), key=lambda x: x[1])[0]
+            confidence = final_scores[primary_category]
+            
+            indicators = classifier._collect_indicators(found, counts['exclamations'], counts['http_urls'])
+            
+            return classifier._create_result(primary_category, confidence, final_scores, indicators, features, fields)
+
+class SessionStore:
+    """Incremental analyses by session id, evicted when idle or least recently used"""
+    
+    def __init__(self, classifier, maxsize=1000, idle_timeout=900, max_chars=200000, clock=time.monotonic):
+        self.classifier = classifier
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_chars = max_chars
+        self.clock = clock
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+    
+    def configure(self, maxsize=None, idle_timeout=None, max_chars=None):
+        """Change the session limits"""
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if max_chars is not None:
+            self.max_chars = max_chars
+    
+    def _expire(self, now):
+        """Drop sessions idle for longer than idle_timeout, oldest first"""
+        while self._sessions:
+            session_id, (used, _) = next(iter(self._sessions.items()))
+            if now - used <= self.idle_timeout:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+    
+    def create(self, text=''):
+        """Start a session on text; returns its id and analysis"""
+        if len(text) > self.max_chars:
+            raise ValueError(f'Drafts are limited to {self.max_chars} characters')
+        analysis = IncrementalAnalysis(self.classifier, text, self.max_chars)
+        session_id = secrets.token_urlsafe(16)
+        
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            while self._sessions and len(self._sessions) >= self.maxsize:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            self._sessions[session_id] = (now, analysis)
+            self.created += 1
+        return session_id, analysis
+    
+    def get(self, session_id):
+        """The session's analysis, marked as used; None if unknown or expired"""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+    
+    def delete(self, session_id):
+        """End a session; False if it was not open"""
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+    
+    def stats(self):
+        """Open sessions and how many ended without being closed"""
+        with self._lock:
+            self._expire(self.clock())
+            return {
+                'sessions': len(self._sessions),
+                'maxsize': self.maxsize,
+                'idle_timeout': self.idle_timeout,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
+
+# Global session store over the shared classifier, configured by create_app
+session_store = SessionStore(email_classifier)
@@ -0,0 +1,370 @@
+"""
+Durable background analysis jobs on a local SQLite queue
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import bulk
+from app.models import email_classifier
+from app.stats import stats_recorder
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    single INTEGER NOT NULL,
+    fields TEXT,
+    items TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created);
+CREATE INDEX IF NOT EXISTS jobs_expiry ON jobs (expires);
+CREATE TABLE IF NOT EXISTS job_results (
+    job_id TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    results TEXT NOT NULL,
+    PRIMARY KEY (job_id, chunk)
+);
+'''
+
+class JobQueue:
+    """Jobs and their results in SQLite, shared by every process using the same file
+    
+    A claimed job holds a lease that its worker renews after each chunk. A
+    job whose lease runs out, because its process died, is claimed again and
+    resumes after the last stored chunk.
+    """
+    
+    def __init__(self, path=None, result_ttl=3600, lease=60.0, max_attempts=3, chunk_size=16, clock=time.time):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self._local = threading.local()
+    
+    def configure(self, path=None, result_ttl=None, lease=None, max_attempts=None):
+        """Point the queue at a database file or change its limits"""
+        if path is not None:
+            self.path = path
+            self._local = threading.local()
+        if result_ttl is not None:
+            self.result_ttl = result_ttl
+        if lease is not None:
+            self.lease = lease
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+    
+    def _connect(self):
+        """This thread's connection, creating the schema on first use"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            if self.path is None:
+                raise RuntimeError('Job queue has no database path')
+            # A file: URI such as file:jobs?mode=memory&cache=shared names no directory
+            if not str(self.path).startswith('file:'):
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, uri=True)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+    
+    def submit(self, items, priority=0, fields=None, single=False):
+        """Queue items, each {'email_content'} or {'error'} with an optional 'id'; returns the job id"""
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            'INSERT INTO jobs (id, status, priority, created, single, fields, items, total) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, 'queued', priority, self.clock(), int(single),
+             json.dumps(fields) if fields is not None else None, json.dumps(items), len(items))
+        )
+        return job_id
+    
+    def claim(self):
+        """Lease the most urgent runnable job, or return None"""
+        connection = self._connect()
+        now = self.clock()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Jobs abandoned by a dead worker come first, then the queue by priority
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE status = 'running' AND lease_until < ? "
+                'ORDER BY priority DESC, created LIMIT 1', (now,)
+            ).fetchone() or connection.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                connection.execute('COMMIT')
+                return None
+            
+            if row['attempts'] >= self.max_attempts:
+                connection.execute(
+                    "UPDATE jobs SET status = 'failed', finished = ?, expires = ?, error = ? WHERE id = ?",
+                    (now, now + self.result_ttl, 'Job failed on every attempt', row['id'])
+                )
+                connection.execute('COMMIT')
+                return self.claim()
+            
+            connection.execute(
+                "UPDATE jobs SET status = 'running', started = COALESCE(started, ?), lease_until = ?, "
+                'attempts = attempts + 1 WHERE id = ?',
+                (now, now + self.lease, row['id'])
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        
+        job = dict(row)
+        job['items'] = json.loads(job['items'])
+        job['fields'] = tuple(json.loads(job['fields'])) if job['fields'] else None
+        job['finished_chunks'] = {
+            chunk for (chunk,) in connection.execute('SELECT chunk FROM job_results WHERE job_id = ?', (job['id'],))
+        }
+        return job
+    
+    def save_chunk(self, job_id, chunk, results):
+        """Store one chunk's results and renew the job's lease"""
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            # Idempotent, in case a runner whose lease lapsed stores the same chunk
+            connection.execute(
+                'INSERT OR REPLACE INTO job_results (job_id, chunk, size, results) VALUES (?, ?, ?, ?)',
+                (job_id, chunk, len(results), json.dumps(results))
+            )
+            connection.execute(
+                'UPDATE jobs SET done = (SELECT SUM(size) FROM job_results WHERE job_id = ?), lease_until = ? '
+                'WHERE id = ?',
+                (job_id, self.clock() + self.lease, job_id)
+            )
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+    
+    def finish(self, job_id, error=None):
+        """Mark a job done, or failed with error, and start its expiry clock"""
+        now = self.clock()
+        self._connect().execute(
+            'UPDATE jobs SET status = ?, finished = ?, expires = ?, lease_until = NULL, error = ? WHERE id = ?',
+            ('failed' if error else 'done', now, now + self.result_ttl, error, job_id)
+        )
+    
+    def get(self, job_id):
+        """Status and, once finished, results of a job; None if unknown or expired"""
+        connection = self._connect()
+        row = connection.execute(
+            'SELECT id, status, priority, created, started, finished, expires, single, total, done, error '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None or (row['expires'] is not None and row['expires'] < self.clock()):
+            return None
+        
+        job = {
+            'job_id': row['id'],
+            'status': row['status'],
+            'priority': row['priority'],
+            'created_at': row['created'],
+            'started_at': row['started'],
+            'finished_at': row['finished'],
+            'expires_at': row['expires'],
+            'progress': {'done': row['done'], 'total': row['total']}
+        }
+        if row['error']:
+            job['error'] = row['error']
+        if row['status'] == 'done':
+            results = []
+            for (chunk,) in connection.execute(
+                'SELECT results FROM job_results WHERE job_id = ? ORDER BY chunk', (job_id,)
+            ):
+                results.extend(json.loads(chunk))
+            if row['single']:
+                job['result'] = results[0]['result']
+            else:
+                job['results'] = results
+        return job
+    
+    def purge(self):
+        """Delete jobs whose results have expired; returns how many"""
+        connection = self._connect()
+        now = self.clock()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute(
+                'DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE expires < ?)', (now,)
+            )
+            deleted = connection.execute('DELETE FROM jobs WHERE expires < ?', (now,)).rowcount
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return deleted
+    
+    def stats(self):
+        """Number of jobs by status"""
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = {status: 0 for status in ('queued', 'running', 'done', 'failed')}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+def _init_job_worker(rules_path, niceness):
+    """Lower the worker's CPU priority below request handling, then build its classifier"""
+    if niceness:
+        os.nice(niceness)
+    bulk._init_worker(rules_path)
+
+class JobRunner:
+    """Threads that claim jobs and analyse them in a pool of low-priority processes
+    
+    The threads only wait on the pool, so a backlog neither holds request
+    threads nor competes with them for the interpreter lock.
+    """
+    
+    def __init__(self, queue, classifier, workers=2, niceness=10, poll_interval=1.0, purge_interval=60.0):
+        self.queue = queue
+        self.classifier = classifier
+        self.workers = workers
+        self.niceness = niceness
+        self.poll_interval = poll_interval
+        self.purge_interval = purge_interval
+        self._pool = None
+        self._pool_rules = None
+        self._pool_lock = threading.Lock()
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._last_purge = 0.0
+    
+    def start(self, workers=None, niceness=None):
+        """Start the job threads once"""
+        if workers is not None:
+            self.workers = workers
+        if niceness is not None:
+            self.niceness = niceness
+        
+        # Spawned pool workers import the app too, but never run jobs themselves
+        if self._threads or self.workers <= 0 or multiprocessing.parent_process() is not None:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-runner-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def notify(self):
+        """Wake an idle thread after a submission"""
+        self._wake.set()
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+    
+    def _executor(self):
+        """The process pool, rebuilt when the live rule pack changes"""
+        rules = self.classifier.rules
+        with self._pool_lock:
+            if self._pool is not None and self._pool_rules != rules.id:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_job_worker,
+                    initargs=(rules.source, self.niceness)
+                )
+                self._pool_rules = rules.id
+            return self._pool
+    
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.Error:
+                job = None
+            if job is not None:
+                self._process(job)
+                continue
+            
+            if time.monotonic() - self._last_purge > self.purge_interval:
+                self._last_purge = time.monotonic()
+                try:
+                    self.queue.purge()
+                except sqlite3.Error:
+                    pass
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+    
+    def _process(self, job):
+        """Analyse the job's remaining chunks, storing each as it completes"""
+        items = job['items']
+        fields = job['fields']
+        size = self.queue.chunk_size
+        try:
+            for chunk, start in enumerate(range(0, len(items), size)):
+                if chunk in job['finished_chunks']:
+                    continue
+                if self._stop.is_set():
+                    return  # the lease runs out and another runner resumes here
+                
+                lines = [{'index': index} for index in range(start, min(start + size, len(items)))]
+                texts = []
+                for line in lines:
+                    item = items[line['index']]
+                    if 'id' in item:
+                        line['id'] = item['id']
+                    if 'error' in item:
+                        line['error'] = item['error']
+                    else:
+                        texts.append(item['email_content'])
+                
+                results = iter(self._executor().submit(bulk._analyze_texts, texts).result() if texts else [])
+                for line in lines:
+                    if 'error' not in line:
+                        result = next(results)
+                        stats_recorder.record(result)
+                        if fields is not None:
+                            result = {field: result[field] for field in fields if field in result}
+                        line['success'] = True
+                        line['result'] = result
+                self.queue.save_chunk(job['id'], chunk, lines)
+            
+            self.queue.finish(job['id'])
+        except BrokenProcessPool:
+            # A worker process died; leave the job to be resumed once its lease expires
+            with self._pool_lock:
+                self._pool = None
+        except Exception as e:
+            self.queue.finish(job['id'], error=f'Analysis failed: {e}')
+
+# Global job queue and runner, configured and started by create_app
+job_queue = JobQueue()
+job_runner = JobRunner(job_queue, email_classifier)
@@ -0,0 +1,259 @@
+"""
+Learned TF-IDF and linear model scoring stored as memory-mapped artifacts
+"""
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+MAGIC = b'ESDARRAY'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+_TOKEN_RE = re.compile(r'\w+')
+
+def write_arrays(path, arrays, meta=None):
+    """Atomically write named numpy arrays and JSON metadata as one flat file
+    
+    Layout: MAGIC, a little-endian uint32 header length, the JSON header,
+    then each array's raw bytes at a 64-byte aligned offset.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    
+    # Offsets depend on the header length, so grow it until it fits
+    reserved = 0
+    while True:
+        offset = _align(len(MAGIC) + 4 + reserved)
+        layout = {}
+        for name, array in arrays.items():
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset = _align(offset + array.nbytes)
+        header = json.dumps({'version': FORMAT_VERSION, 'meta': meta or {}, 'arrays': layout}).encode('utf-8')
+        if len(header) <= reserved:
+            break
+        reserved = len(header)
+    
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC + len(header).to_bytes(4, 'little') + header)
+        for name, array in arrays.items():
+            f.write(b'\0' * (layout[name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+class MappedArrays:
+    """Read-only arrays backed by a shared memory map of a write_arrays file"""
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{path} is not a model artifact')
+        start = len(MAGIC) + 4
+        length = int.from_bytes(self._mmap[len(MAGIC):start], 'little')
+        header = json.loads(self._mmap[start:start + length])
+        if header['version'] != FORMAT_VERSION:
+            raise ValueError(f"{path} has unsupported format version {header['version']}")
+        
+        self.meta = header['meta']
+        self.arrays = {}
+        for name, spec in header['arrays'].items():
+            dtype = np.dtype(spec['dtype'])
+            count = math.prod(spec['shape'])
+            array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=spec['offset'])
+            self.arrays[name] = array.reshape(spec['shape'])
+    
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+def term_counts(text):
+    """Counts of the lowercased word unigrams and bigrams of text"""
+    words = _TOKEN_RE.findall(text.lower())
+    counts = Counter(words)
+    counts.update(a + ' ' + b for a, b in zip(words, words[1:]))
+    return counts
+
+def term_hash(term):
+    """Stable 64-bit hash identifying a vocabulary term"""
+    return int.from_bytes(hashlib.blake2b(term.encode('utf-8', 'surrogatepass'), digest_size=8).digest(), 'little')
+
+class TfidfVectorizer:
+    """Sublinear, l2-normalised TF-IDF over a vocabulary of sorted term hashes"""
+    
+    def __init__(self, hashes, idf):
+        self.hashes = hashes
+        self.idf = idf
+    
+    def transform(self, text):
+        """(term indices, weights) of the sparse TF-IDF vector of text"""
+        return self.transform_counts(term_counts(text))
+    
+    def transform_counts(self, counts):
+        """transform() for an already computed term_counts Counter"""
+        if not counts:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+        
+        hashes = np.fromiter((term_hash(term) for term in counts), dtype=np.uint64, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        
+        positions = np.searchsorted(self.hashes, hashes)
+        positions[positions == len(self.hashes)] = 0
+        known = self.hashes[positions] == hashes if len(self.hashes) else np.zeros(len(hashes), dtype=bool)
+        
+        indices = positions[known]
+        weights = (1.0 + np.log(tf[known])) * self.idf[indices]
+        norm = np.sqrt(np.dot(weights, weights))
+        if norm > 0:
+            weights /= norm
+        return indices, weights
+
+class LearnedClassifier:
+    """Multinomial logistic regression over TF-IDF, loaded from mapped artifacts"""
+    
+    def __init__(self):
+        self.vectorizer = None
+        self.classes = []
+        self.coef = None
+        self.intercept = None
+        self.version = None
+    
+    @property
+    def loaded(self):
+        return self.vectorizer is not None
+    
+    def load(self, model_path, vectorizer_path):
+        """Map the artifacts written by train(); cheap, and shared across forks"""
+        vectorizer = MappedArrays(vectorizer_path)
+        model = MappedArrays(model_path)
+        if model.meta.get('vectorizer') != vectorizer.meta.get('id'):
+            raise ValueError('Model and vectorizer artifacts come from different training runs')
+        
+        self.vectorizer = TfidfVectorizer(vectorizer['hashes'], vectorizer['idf'])
+        self.classes = model.meta['classes']
+        self.coef = model['coef']
+        self.intercept = model['intercept']
+        self.version = model.meta['id']
+    
+    def predict_proba(self, text):
+        """{category: probability} for text"""
+        indices, weights = self.vectorizer.transform(text)
+        logits = weights @ self.coef[indices] + self.intercept
+        probabilities = np.exp(logits - logits.max())
+        probabilities /= probabilities.sum()
+        return dict(zip(self.classes, probabilities.tolist()))
+    
+    def predict(self, text):
+        """Most likely category with its confidence and all probabilities, in percent"""
+        probabilities = self.predict_proba(text)
+        category = max(probabilities, key=probabilities.get)
+        return {
+            'category': category,
+            'confidence': round(probabilities[category] * 100, 2),
+            'scores': {name: round(p * 100, 1) for name, p in probabilities.items()},
+            'model_version': self.version
+        }
+
+def train(items, model_path, vectorizer_path, max_features=50000, min_df=2, epochs=300,
+          learning_rate=0.5, l2=1e-4):
+    """Fit TF-IDF and a linear model on (text, label) items and write both artifacts
+    
+    Returns a summary with the class list, vocabulary size and training accuracy.
+    """
+    documents = []
+    labels = []
+    df = Counter()
+    for text, label in items:
+        counts = term_counts(text)
+        documents.append(counts)
+        labels.append(label)
+        df.update(counts.keys())
+    
+    if not documents:
+        raise ValueError('Training corpus is empty')
+    
+    # Most frequent terms first; a term whose 64-bit hash collides shares the earlier slot
+    vocabulary = {}
+    for term, count in sorted(df.items(), key=lambda item: (-item[1], item[0])):
+        if count < min_df or len(vocabulary) >= max_features:
+            break
+        vocabulary.setdefault(term_hash(term), (term, count))
+    
+    hashes = np.array(sorted(vocabulary), dtype=np.uint64)
+    doc_freq = np.array([vocabulary[h][1] for h in hashes.tolist()], dtype=np.float64)
+    idf = (np.log((1 + len(documents)) / (1 + doc_freq)) + 1).astype(np.float32)
+    vectorizer = TfidfVectorizer(hashes, idf)
+    
+    classes = sorted(set(labels))
+    class_index = {label: i for i, label in enumerate(classes)}
+    
+    # Sparse design matrix as (row, column, value) triples
+    rows, columns, values = [], [], []
+    for row, counts in enumerate(documents):
+        indices, weights = vectorizer.transform_counts(counts)
+        rows.append(np.full(len(indices), row, dtype=np.intp))
+        columns.append(indices)
+        values.append(weights)
+    rows = np.concatenate(rows)
+    columns = np.concatenate(columns)
+    values = np.concatenate(values).astype(np.float64)
+    targets = np.zeros((len(documents), len(classes)))
+    targets[np.arange(len(documents)), [class_index[label] for label in labels]] = 1.0
+    
+    coef, intercept = _fit_softmax(rows, columns, values, targets, len(hashes), epochs, learning_rate, l2)
+    
+    run_id = hashlib.blake2b(hashes.tobytes() + idf.tobytes(), digest_size=8).hexdigest()
+    write_arrays(vectorizer_path, {'hashes': hashes, 'idf': idf}, {
+        'id': run_id,
+        'ngram_range': [1, 2],
+        'sublinear_tf': True,
+        'documents': len(documents)
+    })
+    write_arrays(model_path, {'coef': coef.astype(np.float32), 'intercept': intercept.astype(np.float32)}, {
+        'id': f"{run_id}-{hashlib.blake2b(coef.tobytes(), digest_size=4).hexdigest()}",
+        'vectorizer': run_id,
+        'classes': classes
+    })
+    
+    logits = _logits(rows, columns, values, coef, intercept, len(documents))
+    accuracy = float(np.mean(logits.argmax(axis=1) == targets.argmax(axis=1)))
+    return {'classes': classes, 'terms': len(hashes), 'documents': len(documents), 'train_accuracy': accuracy}
+
+def _logits(rows, columns, values, coef, intercept, n_rows):
+    contributions = values[:, None] * coef[columns]
+    logits = np.empty((n_rows, coef.shape[1]))
+    for k in range(coef.shape[1]):
+        logits[:, k] = np.bincount(rows, weights=contributions[:, k], minlength=n_rows)
+    return logits + intercept
+
+def _fit_softmax(rows, columns, values, targets, n_terms, epochs, learning_rate, l2):
+    """Full-batch gradient descent on the l2-regularised softmax loss"""
+    n_rows, n_classes = targets.shape
+    coef = np.zeros((n_terms, n_classes))
+    intercept = np.zeros(n_classes)
+    
+    for _ in range(epochs):
+        logits = _logits(rows, columns, values, coef, intercept, n_rows)
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        error = (probabilities - targets) / n_rows
+        
+        gradient = np.empty_like(coef)
+        for k in range(n_classes):
+            gradient[:, k] = np.bincount(columns, weights=values * error[rows, k], minlength=n_terms)
+        coef -= learning_rate * (gradient + l2 * coef)
+        intercept -= learning_rate * error.sum(axis=0)
+    
+    return coef, intercept
+
+# Global learned model, loaded by create_app when its artifacts exist
+learned_classifier = LearnedClassifier()
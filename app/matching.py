@@ -0,0 +1,271 @@
+"""
+Compiled text matchers shared by the Email Classification System
+"""
+import re
+
+_LOCAL_PART_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._%+-')
+_DOMAIN_RUN_RE = re.compile(r'[A-Za-z0-9.-]*')
+_TLD_RUN_RE = re.compile(r'[A-Z|a-z]*')
+
+# Escapes that match the same characters in either case
+_CASELESS_ESCAPE_RE = re.compile(r'\\[AbBdDsSwWZ]|\\[^0-9A-Za-z]')
+
+def _case_free(pattern):
+    """Whether pattern finds the same matches in lowercased ASCII text as it finds case-insensitively in the original
+    
+    Conservative: uppercase literals or classes, numeric or named character
+    escapes and inline flags that turn case-insensitivity off all disqualify it.
+    """
+    bare = _CASELESS_ESCAPE_RE.sub('', pattern)
+    return '\\' not in bare and '(?-' not in bare and bare == bare.lower()
+
+def _is_word(char):
+    """Whether re treats char as a word character for \\b"""
+    return char.isalnum() or char == '_'
+
+def _has_boundary(text, start, end):
+    """Whether \\b holds at any offset in [start, end)"""
+    before = start > 0 and _is_word(text[start - 1])
+    for char in text[start:end]:
+        word = _is_word(char)
+        if word != before:
+            return True
+        before = word
+    return False
+
+def _domain_end(text, at):
+    """End of the [A-Za-z0-9.-]+\\.[A-Z|a-z]{2,}\\b match after the '@' at offset at, or None"""
+    length = len(text)
+    stop = _DOMAIN_RUN_RE.match(text, at + 1).end()
+    
+    # Backtrack like the regex: last dot first, then the longest TLD
+    dot = text.rfind('.', at + 2, stop)
+    while dot >= 0:
+        tld_end = _TLD_RUN_RE.match(text, dot + 1).end()
+        for end in range(tld_end, dot + 2, -1):
+            if _is_word(text[end - 1]) != (end < length and _is_word(text[end])):
+                return end
+        dot = text.rfind('.', at + 2, dot)
+    return None
+
+def count_email_addresses(text):
+    """len(re.findall(r'\\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\\.[A-Z|a-z]{2,}\\b', text)) in linear time
+    
+    The regex retries every offset of a long run of address characters, so
+    it goes quadratic on input without an '@'. Every match has its local
+    part end at an '@', so this scanner works outward from each '@' and
+    reads any character a bounded number of times.
+    """
+    count = 0
+    start = 0
+    at = text.find('@', 1)
+    while at >= 0:
+        local = at
+        while local > start and text[local - 1] in _LOCAL_PART_CHARS:
+            local -= 1
+        
+        end = None
+        if local < at and _has_boundary(text, local, at):
+            end = _domain_end(text, at)
+        
+        if end is None:
+            start = at + 1
+        else:
+            count += 1
+            start = end
+        at = text.find('@', start + 1)
+    
+    return count
+
+class KeywordMatcher:
+    """Single-pass multi-keyword matcher built from a keyword trie"""
+    
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(k for k in keywords if k))
+        self.index = {keyword: i for i, keyword in enumerate(self.keywords)}
+        
+        # Every keyword that starts at a given offset is a prefix of the
+        # longest keyword starting there, so one longest match per offset
+        # is enough to recover all of them.
+        self._prefixes = {
+            keyword: [self.index[other] for other in self.keywords if keyword.startswith(other)]
+            for keyword in self.keywords
+        }
+        self._lengths = [len(keyword) for keyword in self.keywords]
+        
+        trie = {}
+        for keyword in self.keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        
+        self._regex = re.compile(self._trie_pattern(trie), re.DOTALL) if trie else None
+    
+    def state(self):
+        """JSON-ready compiled form that from_state rebuilds without the trie work"""
+        return {
+            'keywords': self.keywords,
+            'prefixes': [self._prefixes[keyword] for keyword in self.keywords],
+            'pattern': self._regex.pattern if self._regex else None
+        }
+    
+    @classmethod
+    def from_state(cls, state):
+        """Matcher restored from state()"""
+        matcher = cls.__new__(cls)
+        matcher.keywords = list(state['keywords'])
+        matcher.index = {keyword: i for i, keyword in enumerate(matcher.keywords)}
+        matcher._prefixes = dict(zip(matcher.keywords, state['prefixes']))
+        matcher._lengths = [len(keyword) for keyword in matcher.keywords]
+        matcher._regex = re.compile(state['pattern'], re.DOTALL) if state['pattern'] else None
+        return matcher
+    
+    def _trie_pattern(self, node):
+        """Render a trie node as a regex that prefers the longest keyword"""
+        branches = []
+        for char in sorted(k for k in node if k):
+            branches.append(re.escape(char) + self._trie_pattern(node[char]))
+        
+        if not branches:
+            return ''
+        
+        body = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+        if '' in node:
+            if len(branches) == 1 and len(body) > 1:
+                body = '(?:%s)' % body
+            return body + '?'
+        return body
+    
+    def count(self, text):
+        """Count non-overlapping occurrences of every keyword, like str.count"""
+        counter = KeywordCounter(self)
+        counter.feed(text)
+        return counter.finish()
+
+class KeywordCounter:
+    """KeywordMatcher.count over a text that arrives in consecutive pieces
+    
+    Only the last len(longest keyword) - 1 characters are held back between
+    pieces, so a keyword spanning two pieces is still counted once.
+    """
+    
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.counts = [0] * len(matcher.keywords)
+        self._next_start = [0] * len(matcher.keywords)
+        self._pending = ''
+        self._offset = 0
+        self._keep = max(matcher._lengths, default=1) - 1
+    
+    def feed(self, text):
+        self._pending += text
+        self._scan(len(self._pending) - self._keep)
+    
+    def finish(self):
+        """Count what is still held back and return the counts"""
+        self._scan(len(self._pending))
+        return self.counts
+    
+    def _scan(self, limit):
+        """Count the matches starting before limit, which fit wholly in the pending text"""
+        regex = self.matcher._regex
+        if limit <= 0 or regex is None:
+            return
+        
+        counts = self.counts
+        next_start = self._next_start
+        lengths = self.matcher._lengths
+        prefixes = self.matcher._prefixes
+        pending = self._pending
+        offset = self._offset
+        
+        search = regex.search
+        match = search(pending)
+        while match and match.start() < limit:
+            start = offset + match.start()
+            for i in prefixes[match.group()]:
+                if start >= next_start[i]:
+                    counts[i] += 1
+                    next_start[i] = start + lengths[i]
+            # Resume one character later so overlapping keywords are found
+            match = search(pending, match.start() + 1)
+        
+        self._pending = pending[limit:]
+        self._offset = offset + limit
+
+class MatchTable:
+    """Per-text pattern results, each pattern searched and counted at most once"""
+    
+    def __init__(self, regexes, text):
+        self._regexes = regexes
+        self.text = text
+        self._first = {}
+        self._counts = {}
+    
+    def first(self, name):
+        """Offset of the first match, or None when the pattern is absent"""
+        if name not in self._first:
+            match = self._regexes[name].search(self.text)
+            self._first[name] = match.start() if match else None
+        return self._first[name]
+    
+    def found(self, name):
+        """Whether the pattern matches anywhere in the text"""
+        return self.first(name) is not None
+    
+    def count(self, name):
+        """Number of non-overlapping matches, like len(re.findall(...))"""
+        if name not in self._counts:
+            first = self.first(name)
+            self._counts[name] = 0 if first is None else len(self._regexes[name].findall(self.text, first))
+        return self._counts[name]
+
+class LoweredMatchTable(MatchTable):
+    """Case-sensitive results on the lowercase form of an ASCII text
+    
+    Case-free patterns reuse the case-insensitive table of the original text,
+    since lowercasing ASCII keeps every offset in place.
+    """
+    
+    def __init__(self, regexes, text, matches, shared):
+        super().__init__(regexes, text)
+        self._matches = matches
+        self._shared = shared
+    
+    def first(self, name):
+        if name in self._shared:
+            return self._matches.first(name)
+        return super().first(name)
+    
+    def count(self, name):
+        if name in self._shared:
+            return self._matches.count(name)
+        return super().count(name)
+
+class PatternRegistry:
+    """Named regexes compiled once and shared through per-text match tables"""
+    
+    def __init__(self, patterns):
+        self.patterns = dict(patterns)
+        self.case_free = frozenset(name for name, pattern in self.patterns.items() if _case_free(pattern))
+        self._compiled = {}
+    
+    def compiled(self, ignore_case=True):
+        """{name: compiled regex} for one matching mode, compiled on first use"""
+        flags = re.IGNORECASE if ignore_case else 0
+        regexes = self._compiled.get(flags)
+        if regexes is None:
+            # Racing threads compile identical tables, so the last one stored is as good as any
+            regexes = self._compiled[flags] = {name: re.compile(p, flags) for name, p in self.patterns.items()}
+        return regexes
+    
+    def scan(self, text, ignore_case=True):
+        """Return the match table for text"""
+        return MatchTable(self.compiled(ignore_case), text)
+    
+    def scan_lowered(self, lower_text, matches):
+        """Case-sensitive match table for lower_text, the lowercase form of matches.text"""
+        if not matches.text.isascii():
+            return self.scan(lower_text, ignore_case=False)
+        return LoweredMatchTable(self.compiled(ignore_case=False), lower_text, matches, self.case_free)
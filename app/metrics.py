@@ -0,0 +1,258 @@
+"""
+Low-overhead latency histograms exposed in Prometheus text format
+"""
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+from flask import g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Input size classes in characters (or bytes for requests)
+SIZE_CLASSES = ((1024, '1KB'), (10 * 1024, '10KB'), (100 * 1024, '100KB'), (1024 * 1024, '1MB'))
+
+# Public calls timed as a whole, with the stages they run labelled by their input size
+CLASSIFIER_ENTRY_POINTS = ('analyze_email', 'analyze_stream', 'describe')
+
+CLASSIFIER_STAGES = (
+    '_clean_text', '_extract_features', '_keyword_classification', '_pattern_classification',
+    '_context_classification', '_intelligent_score_combination', '_find_indicators', '_create_result'
+)
+
+TIMED_ENDPOINTS = {'main.analyze_email': '/analyze'}
+
+_local = threading.local()
+
+def size_class(size):
+    """Bucket label for an input of the given size, 'unknown' for None"""
+    if size is None:
+        return 'unknown'
+    for limit, label in SIZE_CLASSES:
+        if size <= limit:
+            return label
+    return 'larger'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labels):
+    return '{%s}' % ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+class Histogram:
+    """Thread-safe labelled histogram with fixed buckets"""
+    
+    def __init__(self, name, documentation, labelnames, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def totals(self):
+        """{labelvalues: (count, sum)} for every series"""
+        with self._lock:
+            return {labels: (sum(counts), total) for labels, (counts, total) in self._series.items()}
+    
+    def samples(self):
+        """Yield (suffix, labels, value) samples with cumulative buckets"""
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        
+        for labelvalues, (counts, total) in sorted(series.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield '_bucket', labels + [('le', le)], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, cumulative
+
+class MetricsRegistry:
+    """Histograms plus callables reporting counters and gauges"""
+    
+    def __init__(self):
+        self.histograms = []
+        self.collectors = []
+    
+    def histogram(self, name, documentation, labelnames):
+        histogram = Histogram(name, documentation, labelnames)
+        self.histograms.append(histogram)
+        return histogram
+    
+    def register_collector(self, collector):
+        """Add a callable returning (name, type, help, [(labels, value)]) tuples"""
+        self.collectors.append(collector)
+    
+    def render(self):
+        """All metrics in Prometheus text exposition format"""
+        lines = []
+        for histogram in self.histograms:
+            lines.append(f'# HELP {histogram.name} {histogram.documentation}')
+            lines.append(f'# TYPE {histogram.name} histogram')
+            for suffix, labels, value in histogram.samples():
+                lines.append(f'{histogram.name}{suffix}{_format_labels(labels)} {value}')
+        
+        for collector in self.collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels) if labels else ""} {value}')
+        
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+stage_latency = registry.histogram(
+    'email_classifier_stage_duration_seconds',
+    'Time spent in each classifier entry point and analysis stage',
+    ['stage', 'size']
+)
+
+request_latency = registry.histogram(
+    'http_request_duration_seconds',
+    'Request latency of analysis endpoints',
+    ['endpoint', 'size']
+)
+
+def _timed_analysis(name, func, histogram):
+    """Time a whole analysis call and label its stages with the input size
+    
+    Streams and files have no length up front, so they are sized 'unknown'.
+    """
+    @wraps(func)
+    def wrapper(source, *args, **kwargs):
+        if not source:
+            size = size_class(0)
+        else:
+            size = size_class(len(source) if isinstance(source, str) else None)
+        outer_size = getattr(_local, 'size', None)
+        _local.size = size
+        start = perf_counter()
+        try:
+            return func(source, *args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start, name, size)
+            _local.size = outer_size
+    return wrapper
+
+def _timed_stage(name, func, histogram):
+    """Time a stage, but only while an instrumented analysis is running"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        size = getattr(_local, 'size', None)
+        if size is None:
+            return func(*args, **kwargs)
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start, name.lstrip('_'), size)
+    return wrapper
+
+def instrument_classifier(classifier, enabled=True, histogram=stage_latency):
+    """Wrap (or unwrap) the classifier's entry points and stages with timers
+    
+    Timers live in instance attributes shadowing the class methods, so a
+    classifier without them runs exactly the uninstrumented code.
+    """
+    for name in CLASSIFIER_ENTRY_POINTS + CLASSIFIER_STAGES:
+        classifier.__dict__.pop(name, None)
+    
+    if not enabled:
+        return
+    
+    for name in CLASSIFIER_ENTRY_POINTS:
+        setattr(classifier, name, _timed_analysis(name, getattr(classifier, name), histogram))
+    for name in CLASSIFIER_STAGES:
+        setattr(classifier, name, _timed_stage(name, getattr(classifier, name), histogram))
+
+def instrument_cascade(cascade, enabled=True, histogram=stage_latency):
+    """Wrap (or unwrap) the cascade's analyze with a timer recorded as the 'cascade' stage"""
+    cascade.__dict__.pop('analyze', None)
+    if enabled:
+        cascade.analyze = _timed_analysis('cascade', cascade.analyze, histogram)
+
+def init_app(app):
+    """Time the analysis endpoints of app"""
+    @app.before_request
+    def start_request_timer():
+        if request.endpoint in TIMED_ENDPOINTS:
+            g.metrics_start = perf_counter()
+    
+    @app.after_request
+    def record_request_latency(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            request_latency.observe(
+                perf_counter() - start,
+                TIMED_ENDPOINTS[request.endpoint],
+                size_class(request.content_length or 0)
+            )
+        return response
+
+def _cache_samples():
+    """Counters from the result cache and the near-duplicate index"""
+    from app.cache import result_cache
+    from app.near_duplicates import near_duplicate_index
+    
+    cache = result_cache.stats()
+    near_duplicates = near_duplicate_index.stats()
+    return [
+        ('result_cache_hits_total', 'counter', 'Result cache hits', [([], cache['hits'])]),
+        ('result_cache_misses_total', 'counter', 'Result cache misses', [([], cache['misses'])]),
+        ('result_cache_evictions_total', 'counter', 'Result cache LRU evictions', [([], cache['evictions'])]),
+        ('result_cache_entries', 'gauge', 'Results currently cached', [([], cache['size'])]),
+        ('near_duplicate_matches_total', 'counter', 'Analyses reused from a near-duplicate',
+         [([], near_duplicates['matches'])]),
+        ('near_duplicate_entries', 'gauge', 'Emails in the near-duplicate index', [([], near_duplicates['size'])])
+    ]
+
+def _admission_samples():
+    """Queue depth and shed requests from the admission controller"""
+    from app.admission import admission
+    
+    stats = admission.stats()
+    return [
+        ('analysis_active', 'gauge', 'Analyses currently running', [([], stats['active'])]),
+        ('analysis_queue_depth', 'gauge', 'Analyses waiting for a slot', [([], stats['queue_depth'])]),
+        ('analysis_admitted_total', 'counter', 'Analyses given a slot', [([], stats['admitted'])]),
+        ('analysis_rejected_total', 'counter', 'Analyses shed by the admission controller', [
+            ([('reason', 'queue_full')], stats['rejected_queue_full']),
+            ([('reason', 'deadline')], stats['rejected_deadline']),
+            ([('reason', 'timeout')], stats['timed_out'])
+        ])
+    ]
+
+def _cascade_samples():
+    """Which tier decided, for fast-path hit rates"""
+    from app.cascade import cascade
+    
+    stats = cascade.stats()
+    return [
+        ('cascade_decisions_total', 'counter', 'Cascade analyses by deciding tier', [
+            ([('tier', tier)], count) for tier, count in stats['decisions'].items()
+        ]),
+        ('cascade_budget_stops_total', 'counter', 'Cascade analyses cut short by the latency budget',
+         [([], stats['budget_stops'])])
+    ]
+
+registry.register_collector(_cache_samples)
+registry.register_collector(_admission_samples)
+registry.register_collector(_cascade_samples)
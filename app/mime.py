@@ -0,0 +1,333 @@
+"""
+Streaming RFC 822 / MIME reader that decodes only the text parts of a message
+"""
+import binascii
+import codecs
+import html
+import io
+import re
+from email.parser import BytesHeaderParser
+from email.policy import default as default_policy
+from email.utils import getaddresses, parseaddr
+
+# Longest piece of a line read at once; longer lines arrive in several pieces
+LINE_LIMIT = 64 * 1024
+
+# Header bytes kept per part; the rest of an oversized header block is dropped
+MAX_HEADER_BYTES = 64 * 1024
+
+TEXT_TYPES = ('text/plain', 'text/html')
+
+# Elements whose content is never shown
+HIDDEN_ELEMENTS = ('script', 'style', 'head', 'title')
+
+_BASE64_JUNK_RE = re.compile(rb'[^A-Za-z0-9+/=]')
+_HTML_HIDDEN_OPEN_RE = re.compile(r'<(%s)\b|<!--' % '|'.join(HIDDEN_ELEMENTS), re.IGNORECASE)
+_HTML_HIDDEN_CLOSE_RES = {name: re.compile(r'</%s\s*>' % name, re.IGNORECASE) for name in HIDDEN_ELEMENTS}
+# A tag ends at the next "<" as well as at ">", so an unclosed one never rescans the rest of the input
+_HTML_BREAK_RE = re.compile(r'<(?:br|hr|/?p|/?div|/?tr|/?li|/?h[1-6]|/?table|/?blockquote)\b[^<>]*>', re.IGNORECASE)
+_HTML_INLINE_RE = re.compile(r'</?(?:a|b|i|u|em|strong|span|font|small|big|sub|sup|abbr)\b[^<>]*>', re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r'<[^<>]*>')
+_SPACES_RE = re.compile(r'[ \t\r\f\v\xa0]+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n\s*\n+')
+_AUTH_RESULT_RE = re.compile(r'\b(spf|dkim|dmarc)=(\w+)', re.IGNORECASE)
+
+def _drop_hidden(markup):
+    """markup without comments and hidden elements; one left unclosed runs to the end"""
+    pieces = []
+    pos = 0
+    while True:
+        opened = _HTML_HIDDEN_OPEN_RE.search(markup, pos)
+        if opened is None:
+            pieces.append(markup[pos:])
+            break
+        pieces.append(markup[pos:opened.start()])
+        if opened.group(1):
+            closed = _HTML_HIDDEN_CLOSE_RES[opened.group(1).lower()].search(markup, opened.end())
+            end = closed.end() if closed else -1
+        else:
+            end = markup.find('-->', opened.end())
+            end = end + 3 if end >= 0 else -1
+        if end < 0:
+            break
+        pos = end
+    return ' '.join(pieces)
+
+def strip_html(markup):
+    """Visible text of an HTML part, with block elements as line breaks"""
+    text = _drop_hidden(markup)
+    text = _HTML_BREAK_RE.sub('\n', text)
+    text = _HTML_INLINE_RE.sub('', text)
+    text = _HTML_TAG_RE.sub(' ', text)
+    text = _SPACES_RE.sub(' ', html.unescape(text))
+    return _BLANK_LINES_RE.sub('\n\n', text).strip()
+
+def _domain(address):
+    return address.rpartition('@')[2].lower() if '@' in address else ''
+
+def header_features(headers):
+    """Sender and routing signals from a message's top-level headers"""
+    def get(name):
+        value = headers.get(name)
+        return str(value) if value is not None else ''
+    
+    display_name, from_address = parseaddr(get('From'))
+    from_domain = _domain(from_address)
+    reply_to = [_domain(address) for _, address in getaddresses([get('Reply-To')]) if address]
+    return_path = _domain(parseaddr(get('Return-Path'))[1])
+    
+    # A display name holding another address, as in "paypal.com <x@example.net>"
+    named = re.search(r'[\w.+-]+@([\w-]+\.[\w.-]+)', display_name)
+    
+    authentication = {}
+    for name, outcome in _AUTH_RESULT_RE.findall(' '.join(map(str, headers.get_all('Authentication-Results') or []))):
+        authentication.setdefault(name.lower(), outcome.lower())
+    
+    return {
+        'subject': get('Subject'),
+        'from': from_address,
+        'from_domain': from_domain,
+        'reply_to_differs': any(domain != from_domain for domain in reply_to),
+        'return_path_differs': bool(return_path) and return_path != from_domain,
+        'display_name_mismatch': bool(named) and named.group(1).lower() != from_domain,
+        'received_hops': len(headers.get_all('Received') or []),
+        'has_message_id': bool(get('Message-ID')),
+        'list_unsubscribe': bool(get('List-Unsubscribe')),
+        'authentication': authentication
+    }
+
+class ExtractedMessage:
+    """Text and header features pulled from a raw message"""
+    
+    def __init__(self, headers, parts, attachments):
+        self.headers = headers
+        self.parts = parts
+        self.attachments = attachments
+        self.features = header_features(headers)
+    
+    @property
+    def body(self):
+        """The decoded text parts, HTML reduced to its visible text"""
+        return '\n\n'.join(part['text'] for part in self.parts if part['text'])
+    
+    @property
+    def text(self):
+        """Subject line and body, as analysed"""
+        subject = self.features['subject']
+        return f'{subject}\n\n{self.body}' if subject else self.body
+    
+    def info(self):
+        """Header features and the parts read or skipped, without their text"""
+        return {
+            'headers': self.features,
+            'parts': [{'type': part['type'], 'size': part['size']} for part in self.parts],
+            'attachments': self.attachments
+        }
+
+class _LineReader:
+    """Lines of a binary stream in pieces of at most LINE_LIMIT bytes, over a small buffer"""
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = b''
+        self.pos = 0
+        self.at_line_start = True
+        self.line_start = True
+    
+    def _fill(self):
+        """Append the next block of the stream to the unread part of the buffer"""
+        chunk = self.stream.read(LINE_LIMIT)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+    
+    def readline(self):
+        """Next line or piece of a long line; b'' at the end of the stream"""
+        self.line_start = self.at_line_start
+        while True:
+            end = self.buffer.find(b'\n', self.pos, self.pos + LINE_LIMIT)
+            if end >= 0:
+                end += 1
+                break
+            if len(self.buffer) - self.pos >= LINE_LIMIT:
+                end = self.pos + LINE_LIMIT
+                break
+            if not self._fill():
+                end = len(self.buffer)
+                break
+        line = self.buffer[self.pos:end]
+        self.pos = end
+        if line:
+            self.at_line_start = line.endswith(b'\n')
+        return line
+    
+    def skip(self):
+        """Discard whole lines up to one starting with "-", a possible delimiter; returns the bytes discarded"""
+        skipped = 0
+        while True:
+            if self.at_line_start and self.buffer.startswith(b'-', self.pos):
+                return skipped
+            found = self.buffer.find(b'\n-', self.pos)
+            if found >= 0:
+                skipped += found + 1 - self.pos
+                self.pos = found + 1
+                self.at_line_start = True
+                return skipped
+            # Keep the last byte, which may be the newline before a delimiter
+            end = max(len(self.buffer) - 1, self.pos)
+            skipped += end - self.pos
+            if end > self.pos:
+                self.at_line_start = self.buffer[end - 1:end] == b'\n'
+            self.pos = end
+            if not self._fill():
+                return skipped
+
+def _delimiter(reader, line, boundaries):
+    """(boundary, closing) when line delimits one of the open multiparts, else None"""
+    if not reader.line_start or not line.startswith(b'--'):
+        return None
+    marker = line[2:].rstrip()
+    for boundary in reversed(boundaries):
+        if marker == boundary:
+            return boundary, False
+        if marker == boundary + b'--':
+            return boundary, True
+    return None
+
+def _read_headers(reader, boundaries):
+    """Header block of the next part as a Message, and a delimiter that cut it short"""
+    block = []
+    size = 0
+    while True:
+        line = reader.readline()
+        if not line or (reader.line_start and line in (b'\r\n', b'\n')):
+            end = None
+            break
+        end = _delimiter(reader, line, boundaries)
+        if end is not None:
+            break
+        if size + len(line) <= MAX_HEADER_BYTES:
+            block.append(line)
+            size += len(line)
+    return BytesHeaderParser(policy=default_policy).parsebytes(b''.join(block)), end
+
+def _skip(reader, boundaries):
+    """Discard lines up to the next delimiter; returns it with the bytes skipped"""
+    size = 0
+    while True:
+        size += reader.skip()
+        line = reader.readline()
+        if not line:
+            return None, size
+        end = _delimiter(reader, line, boundaries)
+        if end is not None:
+            return end, size
+        size += len(line)
+
+def _decode_lines(reader, boundaries, encoding, charset):
+    """Decode a leaf part's body as it is read; returns its text, the delimiter and raw size"""
+    try:
+        text_decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    except LookupError:
+        text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    pieces = []
+    pending = b''
+    size = 0
+    end = None
+    while True:
+        line = reader.readline()
+        if not line:
+            break
+        end = _delimiter(reader, line, boundaries)
+        if end is not None:
+            break
+        size += len(line)
+        
+        if encoding == 'base64':
+            # Decode whole 4-character groups, carrying the rest to the next line
+            pending += _BASE64_JUNK_RE.sub(b'', line)
+            usable = len(pending) - len(pending) % 4
+            try:
+                data = binascii.a2b_base64(pending[:usable])
+            except binascii.Error:
+                data = b''
+            pending = pending[usable:]
+        elif encoding == 'quoted-printable':
+            data = binascii.a2b_qp(line)
+        else:
+            data = line
+        pieces.append(text_decoder.decode(data))
+    
+    pieces.append(text_decoder.decode(b'', final=True))
+    return ''.join(pieces), end, size
+
+def _read_part(reader, boundaries, parts, attachments):
+    """Read one part, headers first; returns the delimiter that ended it, None at the end"""
+    headers, end = _read_headers(reader, boundaries)
+    if end is not None:
+        return end
+    return _walk(reader, headers, boundaries, parts, attachments)
+
+def _walk(reader, headers, boundaries, parts, attachments):
+    """Read the body of a part and its children, collecting text parts and attachments"""
+    content_type = headers.get_content_type()
+    boundary = headers.get_param('boundary') if headers.get_content_maintype() == 'multipart' else None
+    attached = headers.get_content_disposition() == 'attachment'
+    
+    if boundary:
+        boundary = str(boundary).encode('utf-8', 'replace')
+        nested = boundaries + [boundary]
+        alternative = content_type == 'multipart/alternative'
+        children = [] if alternative else parts
+        
+        end, _ = _skip(reader, nested)  # preamble
+        while end is not None and end[0] == boundary and not end[1]:
+            end = _read_part(reader, nested, children, attachments)
+        
+        if alternative and children:
+            # The same content in several forms: keep plain text when there is any
+            plain = [part for part in children if part['type'] == 'text/plain']
+            parts.extend(plain or children[:1])
+        if end is not None and end[0] == boundary:
+            end, _ = _skip(reader, boundaries)  # epilogue
+        return end
+    
+    if content_type == 'message/rfc822' and not attached:
+        # A forwarded message: its own headers, then its text
+        return _read_part(reader, boundaries, parts, attachments)
+    
+    if content_type in TEXT_TYPES and not attached:
+        encoding = str(headers.get('Content-Transfer-Encoding', '7bit')).strip().lower()
+        charset = headers.get_content_charset() or 'utf-8'
+        text, end, size = _decode_lines(reader, boundaries, encoding, charset)
+        if content_type == 'text/html':
+            text = strip_html(text)
+        parts.append({'type': content_type, 'size': size, 'text': text.strip()})
+        return end
+    
+    end, size = _skip(reader, boundaries)
+    attachments.append({'type': content_type, 'filename': headers.get_filename(), 'size': size})
+    return end
+
+def extract_message(source):
+    """Parse a raw message, keeping the text of its text/plain and text/html parts
+    
+    source is bytes, a string or a binary file object, read line by line.
+    Attachments and other non-text parts are skipped as they stream past,
+    so memory depends on the size of the text parts only.
+    """
+    if isinstance(source, str):
+        source = source.encode('utf-8', 'surrogateescape')
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    
+    reader = _LineReader(source)
+    parts = []
+    attachments = []
+    
+    headers, _ = _read_headers(reader, [])
+    _walk(reader, headers, [], parts, attachments)
+    return ExtractedMessage(headers, parts, attachments)
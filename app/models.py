@@ -1,101 +1,141 @@
 """
 Advanced Email Classification System for Spam Detection
 """
+import functools
 import re
-import string
-from collections import Counter
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.features import character_features
+from app.matching import count_email_addresses
+from app.rule_packs import load_rule_pack
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_HTTP_URL_RE = re.compile(r'https?://\S+')
+
+NEWSLETTER_WORDS = ['newsletter', 'unsubscribe', 'edition']
+PROFESSIONAL_INDICATORS = ['dear', 'sincerely', 'regards', 'best wishes', 'thank you']
+SOCIAL_TERMS = ['notification', 'friend', 'like', 'share', 'follow']
+
+# Fields of an analysis result, in the order the full profile returns them
+RESULT_FIELDS = (
+    'category', 'display_name', 'confidence', 'color', 'icon', 'scores', 'risk_level', 'indicators',
+    'features', 'rules_version'
+)
+
+# Named response profiles; None keeps every field
+RESPONSE_PROFILES = {
+    'full': None,
+    'compact': ('category', 'confidence', 'risk_level')
+}
+
+UNKNOWN_CATEGORY = {'display_name': 'Unknown', 'color': '#6c757d', 'icon': '❓'}
+
+def _pinned_rules(analysis):
+    """Run an analysis entirely on the rule pack current when it started"""
+    @functools.wraps(analysis)
+    def wrapper(self, *args, **kwargs):
+        with self.pinned_rules():
+            return analysis(self, *args, **kwargs)
+    return wrapper
 
 class EmailClassifier:
     """Advanced Email Classification System with Custom Risk Levels"""
     
-    def __init__(self):
-        # Enhanced classification categories with better keywords
-        self.categories = {
-            'spam': {
-                'keywords': ['free', 'money', 'cash', 'winner', 'lottery', 'congratulations', 
-                           'urgent', 'act now', 'limited time', 'guaranteed', 'bonus', 
-                           'win', 'prize', 'claim', 'inheritance', 'million', 'dollars', 
-                           'viagra', 'pills', 'weight loss', 'make money fast', 'earn money'],
-                'weight': 3.0,
-                'display_name': 'Spam',
-                'color': '#dc3545',
-                'icon': '⚠️'
-            },
-            'not_spam': {
-                'keywords': ['meeting', 'schedule', 'regards', 'best', 'thank you', 'please', 
-                           'project', 'work', 'team', 'update', 'sincerely', 'business', 
-                           'attached', 'report', 'deadline', 'conference', 'colleague'],
-                'weight': 1.0,
-                'display_name': 'Not Spam',
-                'color': '#28a745',
-                'icon': '✅'
-            },
-            'promotional': {
-                'keywords': ['sale', 'discount', 'offer', 'promotion', 'coupon', 'save', 
-                           'special', 'exclusive', 'deal', 'shop now', 'buy', 'store',
-                           'black friday', 'cyber monday', 'clearance', 'markdown'],
-                'weight': 2.0,
-                'display_name': 'Promotional',
-                'color': '#fd7e14',
-                'icon': '🏷️'
-            },
-            'phishing': {
-                'keywords': ['verify account', 'suspended', 'security alert', 'update payment',
-                           'confirm identity', 'account locked', 'expires today', 'click here immediately',
-                           'immediate action', 'suspended account', 'security breach', 'verify now',
-                           'update billing', 'confirm details'],
-                'weight': 4.0,
-                'display_name': 'Phishing',
-                'color': '#dc3545',
-                'icon': '🎣'
-            },
-            'newsletter': {
-                'keywords': ['newsletter', 'subscribe', 'unsubscribe', 'monthly', 'weekly',
-                           'updates', 'news', 'insights', 'industry', 'publication', 'digest',
-                           'edition', 'issue', 'article', 'blog post'],
-                'weight': 1.0,
-                'display_name': 'Newsletter',
-                'color': '#17a2b8',
-                'icon': '📰'
-            },
-            'social': {
-                'keywords': ['friend request', 'notification', 'tagged', 'liked', 'shared',
-                           'comment', 'follow', 'connect', 'facebook', 'instagram', 'twitter',
-                           'linkedin', 'social media', 'profile', 'post'],
-                'weight': 1.5,
-                'display_name': 'Social',
-                'color': '#6f42c1',
-                'icon': '👥'
-            }
-        }
-        
-        # Enhanced pattern detection
-        self.patterns = {
-            'money_amounts': r'\$\d{1,3}(?:,\d{3})*(?:\.\d{2})?',
-            'percentages': r'\d+%\s*(?:off|discount|save)',
-            'urgency': r'\b(?:urgent|immediate|expires?|hurry|act now|limited time|final notice)\b',
-            'caps_words': r'\b[A-Z]{4,}\b',
-            'multiple_exclamation': r'!{2,}',
-            'suspicious_phrases': r'\b(?:click here|act now|limited time|expires today|verify now)\b',
-            'business_formal': r'\b(?:dear|sincerely|regards|meeting|schedule|attached)\b',
-            'social_words': r'\b(?:like|share|follow|friend|connect|tag)\b'
-        }
+    def __init__(self, rules=None):
+        # Categories, patterns and thresholds come from a compiled rule pack
+        self.rules = rules if rules is not None else load_rule_pack()
+        self._pinned = threading.local()
     
-    def analyze_email(self, email_text):
-        """Improved email analysis with custom risk levels"""
+    @contextmanager
+    def pinned_rules(self):
+        """Keep this thread on the current rule pack until the block ends"""
+        if getattr(self._pinned, 'rules', None) is not None:
+            yield self._pinned.rules
+            return
+        self._pinned.rules = self.rules
+        try:
+            yield self._pinned.rules
+        finally:
+            self._pinned.rules = None
+    
+    def set_rules(self, rules):
+        """Switch to another rule pack; analyses already running finish on the old one"""
+        self.rules = rules
+    
+    @property
+    def active_rules(self):
+        """The rule pack of the analysis running on this thread, else the current one"""
+        return getattr(self._pinned, 'rules', None) or self.rules
+    
+    @property
+    def rules_version(self):
+        return self.active_rules.id
+    
+    @property
+    def categories(self):
+        return self.active_rules.categories
+    
+    @property
+    def patterns(self):
+        return self.active_rules.patterns
+    
+    @property
+    def pattern_signals(self):
+        return self.active_rules.pattern_signals
+    
+    @property
+    def risk_thresholds(self):
+        return self.active_rules.risk_thresholds
+    
+    @property
+    def keyword_matcher(self):
+        return self.active_rules.keyword_matcher
+    
+    @property
+    def pattern_registry(self):
+        return self.active_rules.pattern_registry
+    
+    @_pinned_rules
+    def analyze_email(self, email_text, fields=None):
+        """Improved email analysis with custom risk levels
+        
+        fields limits the result to those RESULT_FIELDS, skipping the work
+        of building the others.
+        """
         if not email_text or not email_text.strip():
-            return self._create_result('unknown', 0.0, {}, [], {})
+            return self._create_result('unknown', 0.0, {}, [], {}, fields)
+        
+        final_scores, indicators, features = self._score_email(
+            email_text, with_indicators=fields is None or 'indicators' in fields
+        )
         
+        # Determine primary category and confidence
+        primary_category = max(final_scores.items(), key=lambda x: x[1])[0]
+        confidence = final_scores[primary_category]
+        
+        return self._create_result(primary_category, confidence, final_scores, indicators, features, fields)
+    
+    def _score_email(self, email_text, clean_text=None, keyword_scores=None, with_indicators=True):
+        """Final scores, indicators and features of a non-empty email
+        
+        clean_text and keyword_scores may be passed in when already computed.
+        """
         # Clean and prepare text
-        clean_text = self._clean_text(email_text)
+        if clean_text is None:
+            clean_text = self._clean_text(email_text)
         original_text = email_text.lower()
+        matches, lower_matches = self._scan_patterns(email_text, original_text)
         
         # Extract features
-        features = self._extract_features(email_text)
+        features = self._extract_features(email_text, matches)
         
         # Multi-algorithm classification
-        keyword_scores = self._keyword_classification(clean_text)
-        pattern_scores = self._pattern_classification(original_text)
+        if keyword_scores is None:
+            keyword_scores = self._keyword_classification(clean_text)
+        pattern_scores = self._pattern_classification(original_text, lower_matches)
         context_scores = self._context_classification(original_text, features)
         
         # Combine all scoring methods
@@ -103,78 +143,252 @@ class EmailClassifier:
             keyword_scores, pattern_scores, context_scores, features
         )
         
-        # Determine primary category and confidence
-        primary_category = max(final_scores.items(), key=lambda x: x[1])[0]
-        confidence = final_scores[primary_category]
-        
         # Find specific indicators
-        indicators = self._find_indicators(email_text)
+        indicators = self._find_indicators(email_text, matches) if with_indicators else []
         
-        return self._create_result(primary_category, confidence, final_scores, indicators, features)
+        return final_scores, indicators, features
     
-    def _create_result(self, category, confidence, scores, indicators, features):
-        """Create formatted result dictionary"""
-        category_info = self.categories.get(category, {
-            'display_name': 'Unknown',
-            'color': '#6c757d',
-            'icon': '❓'
-        })
+    @_pinned_rules
+    def analyze_stream(self, source, window_size=64 * 1024, fields=None):
+        """Analyze a very large email window by window in bounded memory
         
-        # Format scores for display
-        formatted_scores = []
-        for cat, score in scores.items():
-            cat_info = self.categories.get(cat, {'display_name': cat.title(), 'color': '#6c757d'})
-            formatted_scores.append({
-                'category': cat,
-                'display_name': cat_info['display_name'],
-                'score': round(score * 100, 1),
-                'color': cat_info['color']
-            })
-        
-        formatted_scores.sort(key=lambda x: x['score'], reverse=True)
-        
-        return {
+        source is a string, a text file object or an iterable of text chunks.
+        The result is identical to analyze_email on the whole text.
+        """
+        from app.chunked import ChunkedAnalysis, iter_windows
+        
+        analysis = ChunkedAnalysis(self)
+        for window in iter_windows(source, window_size):
+            analysis.feed(window)
+        return analysis.finish(fields)
+    
+    def analyze_message(self, source, fields=None):
+        """Analyze a raw RFC 822 message from its subject and text parts
+        
+        source is bytes, a string or a binary file object, read as it is
+        parsed; attachments are skipped without being decoded. The result
+        carries the header features and parts under 'message'.
+        """
+        from app.mime import extract_message
+        
+        message = extract_message(source)
+        result = self.analyze_email(message.text, fields)
+        result['message'] = message.info()
+        return result
+    
+    @_pinned_rules
+    def describe(self, email_text):
+        """Features and warning indicators of an email, as analyze_email reports them, without scoring it"""
+        matches = self.pattern_registry.scan(email_text)
+        return self._extract_features(email_text, matches), self._find_indicators(email_text, matches)
+    
+    @_pinned_rules
+    def analyze_batch(self, texts):
+        """Analyze many emails at once, scoring the whole batch as matrices
+        
+        Results match analyze_email for every text; only the score
+        combination differs, running as NumPy operations over the batch.
+        """
+        texts = list(texts)
+        results = [None] * len(texts)
+        
+        rows = []
+        keyword_counts = []
+        pattern_hits = []
+        context_signals = []
+        row_features = []
+        row_indicators = []
+        
+        for i, email_text in enumerate(texts):
+            if not email_text or not email_text.strip():
+                results[i] = self._create_result('unknown', 0.0, {}, [], {})
+                continue
+            
+            clean_text = self._clean_text(email_text)
+            original_text = email_text.lower()
+            matches, lower_matches = self._scan_patterns(email_text, original_text)
+            features = self._extract_features(email_text, matches)
+            
+            rows.append(i)
+            keyword_counts.append(self.keyword_matcher.count(clean_text))
+            pattern_hits.append(
+                [lower_matches.found(name) for name, _ in self.pattern_signals] +
+                [any(word in original_text for word in NEWSLETTER_WORDS)]
+            )
+            context_signals.append((
+                sum(1 for indicator in PROFESSIONAL_INDICATORS if indicator in original_text),
+                features['exclamation_count'],
+                features['caps_ratio'],
+                features['money_mentions'],
+                features['word_count'],
+                'unsubscribe' in original_text,
+                sum(1 for term in SOCIAL_TERMS if term in original_text)
+            ))
+            row_features.append(features)
+            row_indicators.append(self._find_indicators(email_text, matches))
+        
+        if not rows:
+            return results
+        
+        categories = list(self.categories.keys())
+        combined = self._combine_score_matrices(
+            self._keyword_score_matrix(np.array(keyword_counts, dtype=np.float64)),
+            self._pattern_score_matrix(np.array(pattern_hits, dtype=bool)),
+            self._context_score_matrix(np.array(context_signals, dtype=np.float64))
+        )
+        primary = combined.argmax(axis=1)
+        
+        for row, i in enumerate(rows):
+            final_scores = dict(zip(categories, combined[row].tolist()))
+            primary_category = categories[primary[row]]
+            results[i] = self._create_result(
+                primary_category, final_scores[primary_category], final_scores,
+                row_indicators[row], row_features[row]
+            )
+        
+        return results
+    
+    def _keyword_score_matrix(self, counts):
+        """Keyword scores from a documents x keywords count matrix"""
+        weights = np.zeros((len(self.keyword_matcher.keywords), len(self.categories)))
+        index = self.keyword_matcher.index
+        
+        for column, data in enumerate(self.categories.values()):
+            for keyword in data['keywords']:
+                context_bonus = 1.5 if len(keyword.split()) > 1 else 1.0
+                weights[index[keyword], column] += data['weight'] * context_bonus
+        
+        return np.minimum(counts @ weights / 20.0, 1.0)
+    
+    def _pattern_score_matrix(self, hits):
+        """Pattern scores from a documents x pattern signals indicator matrix"""
+        columns = {category: i for i, category in enumerate(self.categories.keys())}
+        signals = [increments for _, increments in self.pattern_signals]
+        signals.append({'newsletter': 0.4})
+        
+        # Accumulate one signal at a time so sums match the per-email order
+        scores = np.zeros((hits.shape[0], len(columns)))
+        for signal, increments in enumerate(signals):
+            for category, increment in increments.items():
+                scores[:, columns[category]] += np.where(hits[:, signal], increment, 0.0)
+        
+        return scores
+    
+    def _context_score_matrix(self, signals):
+        """Context scores from a documents x context signals matrix"""
+        columns = {category: i for i, category in enumerate(self.categories.keys())}
+        professional, exclamations, caps_ratio, money, words, unsubscribe, social = signals.T
+        
+        scores = np.zeros((signals.shape[0], len(columns)))
+        scores[:, columns['not_spam']] += np.where(
+            professional >= 2, 0.4, np.where(professional >= 1, 0.2, 0.0)
+        )
+        scores[:, columns['spam']] += np.where((exclamations > 5) | (caps_ratio > 0.3), 0.4, 0.0)
+        scores[:, columns['spam']] += np.where(money > 0, 0.3, 0.0)
+        scores[:, columns['promotional']] += np.where(money > 0, 0.2, 0.0)
+        scores[:, columns['newsletter']] += np.where((words > 100) & (unsubscribe > 0), 0.5, 0.0)
+        scores[:, columns['social']] += np.where(social >= 2, 0.4, 0.0)
+        
+        return scores
+    
+    def _combine_score_matrices(self, keyword_scores, pattern_scores, context_scores):
+        """Vectorized counterpart of _intelligent_score_combination"""
+        combined = keyword_scores * 0.4 + pattern_scores * 0.4 + context_scores * 0.2
+        
+        # Ensure minimum threshold for not_spam
+        floor = (combined < 0.2).all(axis=1)
+        combined[floor, list(self.categories.keys()).index('not_spam')] = 0.7
+        
+        # Normalize rows, summing columns in order like the per-email path
+        total = np.zeros(combined.shape[0])
+        for column in range(combined.shape[1]):
+            total += combined[:, column]
+        positive = total > 0
+        combined[positive] /= total[positive, None]
+        
+        return combined
+    
+    def _scan_patterns(self, email_text, original_text):
+        """Match tables for the original text and its lowercased form"""
+        # Each detection pattern is searched at most once; the table is shared by all stages
+        matches = self.pattern_registry.scan(email_text)
+        return matches, self.pattern_registry.scan_lowered(original_text, matches)
+    
+    def _create_result(self, category, confidence, scores, indicators, features, fields=None):
+        """Create formatted result dictionary, limited to fields when given"""
+        category_meta = self.active_rules.category_meta
+        category_info = category_meta.get(category, UNKNOWN_CATEGORY)
+        
+        result = {
             'category': category,
             'display_name': category_info['display_name'],
             'confidence': round(confidence * 100, 2),
             'color': category_info['color'],
-            'icon': category_info['icon'],
-            'scores': formatted_scores,
-            'risk_level': self._assess_risk(category, confidence, features),
-            'indicators': indicators,
-            'features': features
+            'icon': category_info['icon']
         }
+        
+        # Format scores for display
+        if fields is None or 'scores' in fields:
+            formatted_scores = []
+            for cat, score in scores.items():
+                cat_info = category_meta.get(cat)
+                formatted_scores.append({
+                    'category': cat,
+                    'display_name': cat_info['display_name'] if cat_info else cat.title(),
+                    'score': round(score * 100, 1),
+                    'color': cat_info['color'] if cat_info else '#6c757d'
+                })
+            formatted_scores.sort(key=lambda x: x['score'], reverse=True)
+            result['scores'] = formatted_scores
+        
+        if fields is None or 'risk_level' in fields:
+            result['risk_level'] = self._assess_risk(category, confidence, features)
+        result['indicators'] = indicators
+        result['features'] = features
+        result['rules_version'] = self.rules_version
+        
+        if fields is None:
+            return result
+        return {field: result[field] for field in fields if field in result}
     
     def _clean_text(self, text):
         """Clean and normalize text"""
         text = text.lower()
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = _WHITESPACE_RE.sub(' ', text).strip()
         return text
     
-    def _extract_features(self, text):
+    def _extract_features(self, text, matches=None):
         """Extract detailed email features"""
-        words = text.split()
-        sentences = re.split(r'[.!?]+', text)
+        if matches is None:
+            matches = self.pattern_registry.scan(text)
+        
+        # Words, sentences, punctuation, capitals, URLs and phone numbers in one pass
+        counts = character_features(text)
         
         features = {
-            'char_count': len(text),
-            'word_count': len(words),
-            'sentence_count': len([s for s in sentences if s.strip()]),
-            'avg_word_length': sum(len(word) for word in words) / max(len(words), 1),
-            'exclamation_count': text.count('!'),
-            'question_count': text.count('?'),
-            'caps_ratio': sum(1 for c in text if c.isupper()) / max(len(text), 1),
-            'url_count': len(re.findall(r'https?://\S+|www\.\S+', text)),
-            'email_addresses': len(re.findall(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', text)),
-            'phone_numbers': len(re.findall(r'\b\d{3}[-.]?\d{3}[-.]?\d{4}\b', text)),
-            'money_mentions': len(re.findall(self.patterns['money_amounts'], text))
+            'char_count': counts['chars'],
+            'word_count': counts['words'],
+            'sentence_count': counts['sentences'],
+            'avg_word_length': counts['word_chars'] / max(counts['words'], 1),
+            'exclamation_count': counts['exclamations'],
+            'question_count': counts['questions'],
+            'caps_ratio': counts['caps'] / max(len(text), 1),
+            'url_count': counts['urls'],
+            'email_addresses': count_email_addresses(text),
+            'phone_numbers': counts['phone_numbers'],
+            'money_mentions': matches.count('money_amounts')
         }
         
         return features
     
     def _keyword_classification(self, clean_text):
         """Enhanced keyword-based classification"""
+        return self._keyword_scores(self.keyword_matcher.count(clean_text))
+    
+    def _keyword_scores(self, counts):
+        """Category scores from keyword counts aligned with keyword_matcher.keywords"""
         scores = {category: 0.0 for category in self.categories.keys()}
+        index = self.keyword_matcher.index
         
         for category, data in self.categories.items():
             category_score = 0
@@ -182,8 +396,8 @@ class EmailClassifier:
             weight = data['weight']
             
             for keyword in keywords:
-                if keyword in clean_text:
-                    frequency = clean_text.count(keyword)
+                frequency = counts[index[keyword]]
+                if frequency:
                     context_bonus = 1.5 if len(keyword.split()) > 1 else 1.0
                     category_score += weight * frequency * context_bonus
             
@@ -191,34 +405,20 @@ class EmailClassifier:
         
         return scores
     
-    def _pattern_classification(self, text):
+    def _pattern_classification(self, text, matches=None):
         """Enhanced pattern-based classification"""
         scores = {category: 0.0 for category in self.categories.keys()}
         
-        # Spam patterns
-        if re.search(self.patterns['money_amounts'], text):
-            scores['spam'] += 0.4
-            scores['promotional'] += 0.2
-        
-        if re.search(self.patterns['urgency'], text):
-            scores['spam'] += 0.5
-            scores['phishing'] += 0.6
-        
-        if re.search(self.patterns['multiple_exclamation'], text):
-            scores['spam'] += 0.3
-            scores['promotional'] += 0.2
+        if matches is None:
+            matches = self.pattern_registry.scan(text, ignore_case=False)
         
-        # Business patterns
-        if re.search(self.patterns['business_formal'], text):
-            scores['not_spam'] += 0.4
-            scores['newsletter'] += 0.2
-        
-        # Social patterns
-        if re.search(self.patterns['social_words'], text):
-            scores['social'] += 0.5
+        for name, increments in self.pattern_signals:
+            if matches.found(name):
+                for category, increment in increments.items():
+                    scores[category] += increment
         
         # Newsletter patterns
-        if any(word in text for word in ['newsletter', 'unsubscribe', 'edition']):
+        if any(word in text for word in NEWSLETTER_WORDS):
             scores['newsletter'] += 0.4
         
         return scores
@@ -228,8 +428,7 @@ class EmailClassifier:
         scores = {category: 0.0 for category in self.categories.keys()}
         
         # Professional email indicators
-        professional_indicators = ['dear', 'sincerely', 'regards', 'best wishes', 'thank you']
-        professional_count = sum(1 for indicator in professional_indicators if indicator in text)
+        professional_count = sum(1 for indicator in PROFESSIONAL_INDICATORS if indicator in text)
         
         if professional_count >= 2:
             scores['not_spam'] += 0.4
@@ -249,8 +448,7 @@ class EmailClassifier:
             scores['newsletter'] += 0.5
         
         # Social media structure
-        social_terms = ['notification', 'friend', 'like', 'share', 'follow']
-        social_count = sum(1 for term in social_terms if term in text)
+        social_count = sum(1 for term in SOCIAL_TERMS if term in text)
         if social_count >= 2:
             scores['social'] += 0.4
         
@@ -282,44 +480,12 @@ class EmailClassifier:
     def _assess_risk(self, category, confidence, features):
         """
         CUSTOM RISK LEVELS BY CATEGORY AND PERCENTAGE!
-        Modify these percentages to change when HIGH/MEDIUM/LOW risk appears
+        Change the percentages under "risk_thresholds" in the rule pack
+        (app/rules/default.json) to move when HIGH/MEDIUM/LOW risk appears
         """
         
-        # 🎯 CUSTOMIZE THESE PERCENTAGES FOR EACH CATEGORY:
-        risk_thresholds = {
-            'spam': {
-                'high': 70,    # 70%+ confidence = HIGH risk
-                'medium': 40,  # 40-69% confidence = MEDIUM risk
-                'low': 0       # Below 40% = LOW risk
-            },
-            'phishing': {
-                'high': 60,    # 60%+ confidence = HIGH risk (more sensitive)
-                'medium': 30,  # 30-59% confidence = MEDIUM risk
-                'low': 0       # Below 30% = LOW risk
-            },
-            'promotional': {
-                'high': 85,    # 85%+ confidence = HIGH risk
-                'medium': 50,  # 50-84% confidence = MEDIUM risk
-                'low': 0       # Below 50% = LOW risk
-            },
-            'not_spam': {
-                'high': 95,    # 95%+ confidence = HIGH risk (very safe)
-                'medium': 80,  # 80-94% confidence = MEDIUM risk
-                'low': 0       # Below 80% = LOW risk
-            },
-            'newsletter': {
-                'high': 90,    # 90%+ confidence = HIGH risk
-                'medium': 60,  # 60-89% confidence = MEDIUM risk
-                'low': 0       # Below 60% = LOW risk
-            },
-            'social': {
-                'high': 80,    # 80%+ confidence = HIGH risk
-                'medium': 50,  # 50-79% confidence = MEDIUM risk
-                'low': 0       # Below 50% = LOW risk
-            }
-        }
-        
         # Get thresholds for this category
+        risk_thresholds = self.risk_thresholds
         thresholds = risk_thresholds.get(category, risk_thresholds['spam'])
         
         # Convert confidence to percentage if needed
@@ -333,27 +499,34 @@ class EmailClassifier:
         else:
             return 'low'
     
-    def _find_indicators(self, text):
+    def _find_indicators(self, text, matches=None):
         """Find specific warning indicators"""
+        if matches is None:
+            matches = self.pattern_registry.scan(text)
+        
+        return self._collect_indicators(matches, text.count('!'), len(_HTTP_URL_RE.findall(text)))
+    
+    def _collect_indicators(self, matches, exclamation_count, http_url_count):
+        """Warning indicators from pattern matches and punctuation/link counts"""
         indicators = []
         
         warning_checks = {
-            'Money Amount': self.patterns['money_amounts'],
-            'Urgency Words': self.patterns['urgency'],
-            'Excessive Caps': self.patterns['caps_words'],
-            'Multiple Exclamations': self.patterns['multiple_exclamation'],
-            'Suspicious Links': self.patterns['suspicious_phrases']
+            'Money Amount': 'money_amounts',
+            'Urgency Words': 'urgency',
+            'Excessive Caps': 'caps_words',
+            'Multiple Exclamations': 'multiple_exclamation',
+            'Suspicious Links': 'suspicious_phrases'
         }
         
-        for indicator_name, pattern in warning_checks.items():
-            if re.search(pattern, text, re.IGNORECASE):
+        for indicator_name, pattern_name in warning_checks.items():
+            if matches.found(pattern_name):
                 indicators.append(indicator_name)
         
         # Additional manual checks
-        if text.count('!') > 5:
+        if exclamation_count > 5:
             indicators.append('Excessive Punctuation')
         
-        if len(re.findall(r'https?://\S+', text)) > 2:
+        if http_url_count > 2:
             indicators.append('Multiple URLs')
         
         return list(set(indicators))
@@ -0,0 +1,252 @@
+"""
+MinHash/LSH index for recognising near-duplicate email campaigns
+"""
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from app.cache import copy_result
+
+_TOKEN_RE = re.compile(r'\w+')
+_DIGIT_RE = re.compile(r'\d')
+_DIGIT_TOKEN = b'#'
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+class MinHasher:
+    """Word-shingle MinHash signatures with deterministic permutations"""
+    
+    def __init__(self, num_perm=64, shingle_size=3, seed=1, block_size=4096):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.block_size = block_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)[:, None]
+    
+    def shingles(self, text):
+        """32-bit hashes of the word shingles in text"""
+        # Amounts, dates and tracking tokens vary within a campaign, so any
+        # token containing a digit hashes the same
+        word_hashes = {}
+        words = []
+        for word in _TOKEN_RE.findall(text.lower()):
+            if word not in word_hashes:
+                key = _DIGIT_TOKEN if _DIGIT_RE.search(word) else word.encode('utf-8', 'surrogatepass')
+                word_hashes[word] = zlib.crc32(key)
+            words.append(word_hashes[word])
+        words = np.array(words, dtype=np.uint64)
+        
+        if len(words) < self.shingle_size:
+            return words[:1] if len(words) else words
+        
+        # Polynomial combination of consecutive word hashes
+        hashes = np.zeros(len(words) - self.shingle_size + 1, dtype=np.uint64)
+        for offset in range(self.shingle_size):
+            hashes = hashes * np.uint64(1000003) + words[offset:len(hashes) + offset]
+        return np.unique(hashes & _MAX_HASH)
+    
+    def signature(self, shingles):
+        """MinHash signature of a shingle hash array, or None when it is empty"""
+        if not len(shingles):
+            return None
+        # Permute a block of shingles at a time so memory stays at num_perm x block_size
+        signature = None
+        for start in range(0, len(shingles), self.block_size):
+            block = shingles[start:start + self.block_size]
+            # Wraparound in the uint64 products is deliberate and deterministic
+            with np.errstate(over='ignore'):
+                permuted = ((self._a * block + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+            lowest = permuted.min(axis=1)
+            signature = lowest if signature is None else np.minimum(signature, lowest)
+        return signature.astype(np.uint32)
+
+class NearDuplicateIndex:
+    """Bounded, age-limited LSH index of recently classified emails"""
+    
+    def __init__(self, threshold=0.8, maxsize=10000, max_age=3600, num_perm=64, bands=16,
+                 min_shingles=8, clock=time.monotonic):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.min_shingles = min_shingles
+        self.clock = clock
+        self.hasher = MinHasher(num_perm=num_perm)
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._version = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.matches = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def configure(self, threshold=None, maxsize=None, max_age=None):
+        """Change matching and eviction settings"""
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if max_age is not None:
+                self.max_age = max_age
+            self._evict(self.clock())
+    
+    def _band_keys(self, signature):
+        """LSH bucket keys, one per band of the signature"""
+        rows = self.rows
+        return [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+    
+    def _evict(self, now):
+        """Drop entries past max_age, then the oldest beyond maxsize"""
+        while self._entries:
+            entry_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= max(self.maxsize, 0) and now - entry['added'] < self.max_age:
+                break
+            self._remove(entry_id)
+            self.evictions += 1
+    
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        for key in entry['band_keys']:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+    
+    def _best_match(self, signature, band_keys):
+        """Closest indexed entry at or above the threshold, as (entry, similarity)"""
+        candidates = set()
+        for key in band_keys:
+            candidates.update(self._buckets.get(key, ()))
+        
+        best, best_similarity = None, self.threshold
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            similarity = float(np.mean(entry['signature'] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = entry, similarity
+        return best, best_similarity
+    
+    def _add(self, signature, band_keys, result, now):
+        """Index a new cluster representative and return its cluster id"""
+        entry_id = self._next_id
+        self._next_id += 1
+        cluster = f'c{entry_id:x}'
+        self._entries[entry_id] = {
+            'signature': signature,
+            'band_keys': band_keys,
+            'cluster': cluster,
+            'result': result,
+            'added': now
+        }
+        for key in band_keys:
+            self._buckets.setdefault(key, set()).add(entry_id)
+        self._evict(now)
+        return cluster
+    
+    def analyze(self, text, version, compute, describe=None):
+        """Reuse the result of a near-duplicate of text, or compute and index it
+        
+        A reused result keeps the match's category and scores; describe(text),
+        when given, returns the (features, indicators) that belong to text
+        itself. The returned result carries a near_duplicate entry saying
+        whether a match was reused, the campaign cluster and the estimated
+        similarity.
+        """
+        if self.maxsize <= 0:
+            return compute(text)
+        shingles = self.hasher.shingles(text)
+        if len(shingles) < self.min_shingles:
+            return compute(text)
+        
+        signature = self.hasher.signature(shingles)
+        band_keys = self._band_keys(signature)
+        now = self.clock()
+        
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._buckets.clear()
+                self._version = version
+            
+            self._evict(now)
+            entry, similarity = self._best_match(signature, band_keys)
+            if entry is not None:
+                self.matches += 1
+                result = copy_result(entry['result'])
+            else:
+                self.misses += 1
+                result = None
+        
+        if result is not None:
+            if describe is not None:
+                result['features'], result['indicators'] = describe(text)
+            result['near_duplicate'] = {
+                'matched': True,
+                'cluster': entry['cluster'],
+                'similarity': round(similarity, 3)
+            }
+            return result
+        
+        result = compute(text)
+        
+        with self._lock:
+            if version == self._version:
+                cluster = self._add(signature, band_keys, copy_result(result), now)
+            else:
+                cluster = None
+        
+        result['near_duplicate'] = {'matched': False, 'cluster': cluster, 'similarity': 1.0}
+        return result
+    
+    def stats(self):
+        """Index size and match counters"""
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'max_age': self.max_age,
+                'threshold': self.threshold,
+                'matches': self.matches,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+def cluster_corpus(items, threshold=0.8, num_perm=64, bands=16, min_shingles=1, max_clusters=50000):
+    """Assign campaign clusters to (id, text) items in one pass
+    
+    Yields (id, cluster, similarity, representative) where representative is
+    the id of the first message of the cluster. Memory is bounded by
+    max_clusters representatives, about 6 KB each with the default signature
+    size. Beyond that the oldest clusters are forgotten, so a late repeat of
+    one starts a new cluster.
+    """
+    index = NearDuplicateIndex(threshold=threshold, maxsize=max_clusters, max_age=float('inf'),
+                               num_perm=num_perm, bands=bands, min_shingles=min_shingles)
+    
+    for item_id, text in items:
+        signature = index.hasher.signature(index.hasher.shingles(text))
+        if signature is None:
+            yield item_id, None, None, item_id
+            continue
+        
+        band_keys = index._band_keys(signature)
+        entry, similarity = index._best_match(signature, band_keys)
+        if entry is not None:
+            yield item_id, entry['cluster'], round(similarity, 3), entry['result']
+        else:
+            cluster = index._add(signature, band_keys, item_id, 0)
+            yield item_id, cluster, 1.0, item_id
+
+# Global near-duplicate index in front of email_classifier, configured by create_app
+near_duplicate_index = NearDuplicateIndex()
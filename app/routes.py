@@ -1,8 +1,32 @@
 """
 Flask Routes for Email Spam Detection Application
 """
-from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory, Response
-from app.models import email_classifier
+import json
+import os
+
+from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory, Response, stream_with_context, abort, url_for
+from app import metrics
+from app.admission import Overloaded, admission
+from app.cache import result_cache
+from app.cascade import cascade
+from app.chunked import LARGE_BODY
+from app.http_cache import CachedPayload, file_mtime, revalidated
+from app.incremental import session_store
+from app.jobs import job_queue, job_runner
+from app.learned import learned_classifier
+from app.mime import extract_message
+from app.models import RESPONSE_PROFILES, RESULT_FIELDS, email_classifier
+from app.near_duplicates import near_duplicate_index
+from app import samples
+from app.samples import SAMPLE_EMAILS
+from app.stats import stats_recorder
+from app.streaming import iter_json_array, iter_ndjson, StreamFormatError
+
+# Result entries added outside the classifier, selectable in a field list
+OPTIONAL_FIELDS = ('learned', 'cascade', 'message')
+
+# Result entries every analysis is counted by in /api/stats
+STATS_FIELDS = ('category', 'risk_level')
 
 # Create blueprint
 main_bp = Blueprint('main', __name__)
@@ -10,7 +34,23 @@ main_bp = Blueprint('main', __name__)
 @main_bp.route('/')
 def index():
     """Main page route"""
-    return render_template('index.html')
+    template_path = os.path.join(current_app.root_path, current_app.template_folder, 'index.html')
+    
+    # Re-render only when templates auto-reload and the file changed
+    stamp = file_mtime(template_path) if current_app.jinja_env.auto_reload else None
+    page = _cached_payload('index', stamp, lambda: CachedPayload(
+        render_template('index.html'), 'text/html', file_mtime(template_path),
+        current_app.config['HTTP_CACHE_MAX_AGE']
+    ))
+    return page.response()
+
+def _cached_payload(key, stamp, build):
+    """The app's CachedPayload for key, built on first use and again whenever stamp changes"""
+    payloads = current_app.extensions.setdefault('cached_payloads', {})
+    entry = payloads.get(key)
+    if entry is None or entry[0] != stamp:
+        entry = payloads[key] = (stamp, build())
+    return entry[1]
 
 @main_bp.route('/analyze', methods=['POST'])
 def analyze_email():
@@ -23,73 +63,418 @@ def analyze_email():
         
         email_content = data.get('email_content', '').strip()
         
-        if not email_content:
-            return jsonify({'error': 'Email content cannot be empty'}), 400
+        error = _validate_email_content(email_content)
+        if error:
+            return jsonify({'error': error}), 400
         
-        if len(email_content) < 10:
-            return jsonify({'error': 'Email content too short for meaningful analysis'}), 400
+        try:
+            fields = _response_fields(data.get('profile', request.args.get('profile')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         # Analyze email
-        analysis_result = email_classifier.analyze_email(email_content)
+        analysis_result = _cached_analysis(email_content, fields)
         
         return jsonify({
             'success': True,
             'result': analysis_result
         })
-        
+    
+    except Overloaded as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
     except Exception as e:
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
-@main_bp.route('/sample/<category>')
-def get_sample_email(category):
-    """Get sample email for testing"""
-    samples = {
-        'spam': "URGENT! CONGRATULATIONS! You have won $1,000,000 in our international lottery! This is not a scam! You must click here immediately and send your bank details to claim your prize! ACT NOW! LIMITED TIME! Don't miss this once-in-a-lifetime opportunity!",
+@main_bp.route('/analyze/message', methods=['POST'])
+def analyze_message():
+    """API endpoint for a raw RFC 822 message, streamed as the request body"""
+    try:
+        fields = _response_fields(request.args.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        # Only text parts are decoded; attachments stream past unread
+        message = extract_message(request.stream)
+        email_content = message.text.strip()
         
-        'not_spam': "Dear John,\n\nI hope this email finds you well. I wanted to follow up on our project meeting yesterday regarding the quarterly timeline and resource allocation.\n\nCould we schedule a brief call this week to discuss the next steps? I'm available Thursday or Friday afternoon.\n\nPlease let me know your availability.\n\nBest regards,\nSarah Smith\nProject Manager",
+        error = _validate_email_content(email_content)
+        if error:
+            return jsonify({'error': error, 'message': message.info()}), 400
         
-        'promotional': "🎉 HUGE BLACK FRIDAY SALE! 🎉\n\nSave up to 70% on all electronics this weekend only!\n• Laptops starting at $299\n• Smartphones 50% off\n• Free shipping on orders over $50\n\nUse code: SAVE70\nShop now at TechStore.com - Sale ends Sunday midnight!",
+        analysis_result = _cached_analysis(email_content, fields)
+        if fields is None or 'message' in fields:
+            analysis_result['message'] = message.info()
         
-        'phishing': "SECURITY ALERT: Your account has been temporarily suspended!\n\nWe detected unusual login activity on your account. Your account will be permanently closed within 24 hours unless you verify your identity immediately.\n\nClick here to verify now and enter your username, password, and banking details to restore access.\n\nThis is urgent - do not ignore this message!",
+        return jsonify({
+            'success': True,
+            'result': analysis_result
+        })
+    
+    except Overloaded as e:
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, e.status
+    except Exception as e:
+        return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+
+@main_bp.route('/analyze/sessions', methods=['POST'])
+def create_session():
+    """Start a compose-time analysis session on an initial draft"""
+    data = request.get_json(silent=True) or {}
+    email_content = data.get('email_content', '')
+    if not isinstance(email_content, str):
+        return jsonify({'error': 'email_content must be a string'}), 400
+    
+    try:
+        fields = _response_fields(data.get('profile', request.args.get('profile')))
+        session_id, analysis = session_store.create(email_content)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    response = jsonify(_session_state(session_id, analysis, fields))
+    response.headers['Location'] = url_for('main.update_session', session_id=session_id)
+    return response, 201
+
+@main_bp.route('/analyze/sessions/<session_id>', methods=['PATCH'])
+def update_session(session_id):
+    """Apply edits to a session's draft and analyse the result"""
+    analysis = session_store.get(session_id)
+    if analysis is None:
+        return jsonify({'error': 'Unknown or expired session; start a new one with the full draft'}), 404
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('edits'), list):
+        return jsonify({'error': 'Send a JSON object with a list of edits'}), 400
+    
+    try:
+        fields = _response_fields(data.get('profile', request.args.get('profile')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        edits = [(edit['offset'], edit.get('delete', 0), edit.get('insert', '')) for edit in data['edits']]
+    except (KeyError, TypeError, AttributeError):
+        return jsonify({'error': 'Each edit is an object with offset, delete and insert'}), 400
+    
+    with analysis.lock:
+        # Edits are offsets into the draft as of version; anything else means the client is out of step
+        if data.get('version', analysis.version) != analysis.version:
+            return jsonify({'error': 'Draft version mismatch', 'version': analysis.version, 'length': len(analysis)}), 409
+        try:
+            analysis.apply(edits)
+        except ValueError as e:
+            return jsonify({'error': str(e), 'version': analysis.version, 'length': len(analysis)}), 400
+        return jsonify(_session_state(session_id, analysis, fields))
+
+@main_bp.route('/analyze/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """End a compose-time analysis session"""
+    if not session_store.delete(session_id):
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    return '', 204
+
+def _session_state(session_id, analysis, fields):
+    """Response body for a session's current draft"""
+    return {
+        'success': True,
+        'session_id': session_id,
+        'version': analysis.version,
+        'length': len(analysis),
+        'result': analysis.result(fields)
+    }
+
+@main_bp.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """API endpoint for batch analysis, streamed back as NDJSON"""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = iter_ndjson(request.stream)
+    elif request.mimetype == 'application/json':
+        items = ((item, None) for item in iter_json_array(request.stream))
+    else:
+        return jsonify({'error': 'Send a JSON array or an NDJSON body'}), 415
+    
+    def generate():
+        index = 0
+        try:
+            for item, error in items:
+                yield json.dumps(_analyze_batch_item(index, item, error)) + '\n'
+                index += 1
+        except StreamFormatError as e:
+            yield json.dumps({'index': index, 'error': f'Batch aborted: {str(e)}'}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def _analyze_batch_item(index, item, error=None):
+    """Analyze one batch item, reporting failures on the item itself"""
+    line = {'index': index}
+    profile = request.args.get('profile')
+    
+    if isinstance(item, dict):
+        if 'id' in item:
+            line['id'] = item['id']
+        email_content = item.get('email_content', '')
+        profile = item.get('profile', profile)
+    else:
+        email_content = item
+    
+    if error is None and not isinstance(email_content, str):
+        error = 'Item must be a string or an object with email_content'
+    
+    if error is None:
+        email_content = email_content.strip()
+        error = _validate_email_content(email_content)
+    
+    if error is None:
+        try:
+            fields = _response_fields(profile)
+        except ValueError as e:
+            error = str(e)
+    
+    if error:
+        line['error'] = error
+        return line
+    
+    try:
+        result = _cached_analysis(email_content, fields)
+    except Overloaded as e:
+        line['error'] = str(e)
+        line['retry_after'] = e.retry_after
+        return line
+    except Exception as e:
+        line['error'] = f'Analysis failed: {str(e)}'
+        return line
+    
+    line['success'] = True
+    line['result'] = result
+    return line
+
+@main_bp.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue one email or a list of emails for background analysis"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Send a JSON object with email_content or emails'}), 400
+    
+    priority = data.get('priority', 0)
+    if not isinstance(priority, int) or isinstance(priority, bool):
+        return jsonify({'error': 'priority must be an integer'}), 400
+    
+    try:
+        fields = _response_fields(data.get('profile'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if 'emails' in data:
+        emails = data['emails']
+        if not isinstance(emails, list) or not emails:
+            return jsonify({'error': 'emails must be a non-empty list'}), 400
+        if len(emails) > current_app.config['JOBS_MAX_EMAILS']:
+            return jsonify({'error': f"A job holds at most {current_app.config['JOBS_MAX_EMAILS']} emails"}), 413
+        items = [_job_item(item) for item in emails]
+        single = False
+    else:
+        email_content = data.get('email_content', '')
+        email_content = email_content.strip() if isinstance(email_content, str) else ''
+        error = _validate_email_content(email_content)
+        if error:
+            return jsonify({'error': error}), 400
+        items = [{'email_content': email_content}]
+        single = True
+    
+    job_id = job_queue.submit(items, priority, fields, single)
+    job_runner.notify()
+    
+    status_url = url_for('main.get_job', job_id=job_id)
+    response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url})
+    response.headers['Location'] = status_url
+    return response, 202
+
+@main_bp.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Status of a job, with its results once done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job)
+
+def _job_item(item):
+    """Queue entry for one email of a job, or the reason it will not be analysed"""
+    entry = {}
+    if isinstance(item, dict):
+        if 'id' in item:
+            entry['id'] = item['id']
+        email_content = item.get('email_content', '')
+    else:
+        email_content = item
+    
+    if not isinstance(email_content, str):
+        entry['error'] = 'Item must be a string or an object with email_content'
+        return entry
+    
+    email_content = email_content.strip()
+    error = _validate_email_content(email_content)
+    if error:
+        entry['error'] = error
+    else:
+        entry['email_content'] = email_content
+    return entry
+
+def _response_fields(profile):
+    """Result fields for a profile name, field list or comma-separated fields; None for all"""
+    if profile is None:
+        return None
+    if isinstance(profile, str):
+        if profile in RESPONSE_PROFILES:
+            return RESPONSE_PROFILES[profile]
+        profile = profile.split(',')
+    if not isinstance(profile, list) or not all(isinstance(field, str) for field in profile):
+        raise ValueError('profile must be a profile name or a list of field names')
+    
+    fields = tuple(dict.fromkeys(field.strip() for field in profile if field.strip()))
+    unknown = [field for field in fields if field not in RESULT_FIELDS + OPTIONAL_FIELDS]
+    if unknown or not fields:
+        raise ValueError(
+            f"Unknown profile or fields {', '.join(unknown) or repr(profile)}; use one of "
+            f"{', '.join(RESPONSE_PROFILES)} or fields from {', '.join(RESULT_FIELDS + OPTIONAL_FIELDS)}"
+        )
+    return fields
+
+def _cached_analysis(email_content, fields=None):
+    """Analyze email content, reusing results for identical bodies, and count the outcome"""
+    if fields is None:
+        result = result_cache.get_or_compute(
+            email_content, email_classifier.rules_version, _near_duplicate_analysis
+        )
+        stats_recorder.record(result)
+        return result
+    
+    # The near-duplicate index shares full results, so partial ones skip it
+    counted = fields + tuple(field for field in STATS_FIELDS if field not in fields)
+    result = result_cache.get_or_compute(
+        email_content, email_classifier.rules_version, lambda text: _classify(text, counted), variant=counted
+    )
+    stats_recorder.record(result)
+    if counted != fields:
+        result = {field: result[field] for field in fields if field in result}
+    return result
+
+def _near_duplicate_analysis(email_content):
+    """Analyze email content, reusing results for near-duplicate campaigns"""
+    # Shingling a very large body would cost the memory its windowed analysis avoids
+    if len(email_content) > LARGE_BODY:
+        return _classify(email_content)
+    return near_duplicate_index.analyze(
+        email_content, email_classifier.rules_version, _classify, _describe
+    )
+
+def _describe(email_content):
+    """Features and indicators of a body whose category comes from a near-duplicate"""
+    with admission.slot(_request_timeout()):
+        return email_classifier.describe(email_content)
+
+def _classify(email_content, fields=None):
+    """Analyze email content once admitted, window by window when it is very large"""
+    with admission.slot(_request_timeout()):
+        if len(email_content) > LARGE_BODY:
+            result = email_classifier.analyze_stream(email_content, fields=fields)
+        elif cascade.enabled:
+            result = cascade.analyze(email_content, _latency_budget(), fields)
+        else:
+            result = email_classifier.analyze_email(email_content, fields)
         
-        'newsletter': "Tech Weekly Newsletter - January 2025\n\nDear Subscriber,\n\nWelcome to this week's edition of Tech Weekly. Here's what's happening in technology:\n\n• AI breakthrough in natural language processing\n• New Python 3.13 features and improvements\n• Cybersecurity trends for 2025\n• Upcoming tech conferences\n\nRead full articles at techweekly.com\nUnsubscribe anytime at newsletter@techweekly.com",
+        if learned_classifier.loaded and (fields is None or 'learned' in fields):
+            result['learned'] = learned_classifier.predict(email_content)
         
-        'social': "Facebook Notification\n\nYou have new activity on Facebook:\n\n• 3 new friend requests from John, Sarah, and Mike\n• 5 people liked your recent photo\n• 2 new comments on your weekend trip post\n• Your friend Lisa shared an article you might like\n\nView all notifications in the Facebook mobile app or visit facebook.com"
-    }
+        if fields is not None:
+            result = {field: result[field] for field in fields if field in result}
+        return result
+
+def _request_timeout():
+    """Seconds this request may wait for an analysis slot"""
+    timeout = current_app.config['ANALYZE_TIMEOUT']
+    try:
+        timeout = float(request.headers.get('X-Request-Timeout', timeout))
+    except ValueError:
+        pass
+    return max(0.0, min(timeout, current_app.config['ANALYZE_MAX_TIMEOUT']))
+
+def _latency_budget():
+    """Seconds the cascade may spend on this request's analysis"""
+    try:
+        return float(request.headers['X-Latency-Budget'])
+    except (KeyError, ValueError):
+        return current_app.config['CASCADE_BUDGET']
+
+def _validate_email_content(email_content):
+    """Return an error message if the email content cannot be analyzed"""
+    if not email_content:
+        return 'Email content cannot be empty'
+    
+    if len(email_content) < 10:
+        return 'Email content too short for meaningful analysis'
     
-    if category not in samples:
+    return None
+
+@main_bp.route('/sample/<category>')
+def get_sample_email(category):
+    """Get sample email for testing"""
+    if category not in SAMPLE_EMAILS:
         return jsonify({'error': 'Invalid category'}), 400
     
-    return jsonify({
-        'category': category,
-        'content': samples[category]
-    })
+    payload = _cached_payload(('sample', category), None, lambda: CachedPayload(
+        json.dumps({'category': category, 'content': SAMPLE_EMAILS[category]}), 'application/json',
+        file_mtime(samples.__file__), current_app.config['HTTP_CACHE_MAX_AGE']
+    ))
+    return payload.response()
 
 @main_bp.route('/favicon.ico')
 def favicon():
     """Serve favicon"""
     try:
         return send_from_directory(
-            current_app.static_folder, 'favicon.ico', 
+            current_app.static_folder, 'favicon.ico',
             mimetype='image/vnd.microsoft.icon'
         )
     except:
         return Response(status=204)
 
+@main_bp.route('/metrics')
+def get_metrics():
+    """Latency histograms and counters in Prometheus text format"""
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 @main_bp.route('/api/stats')
 def get_stats():
     """Get application statistics"""
-    return jsonify({
-        'total_analyzed': 1247,
-        'spam_detected': 342,
-        'ham_classified': 673,  # This is now "not_spam" but keeping for compatibility
-        'accuracy_rate': 94.2,
-        'categories': {
-            'spam': {'count': 342, 'percentage': 27.4},
-            'not_spam': {'count': 673, 'percentage': 54.0},
-            'promotional': {'count': 156, 'percentage': 12.5},
-            'phishing': {'count': 43, 'percentage': 3.4},
-            'newsletter': {'count': 23, 'percentage': 1.8},
-            'social': {'count': 10, 'percentage': 0.8}
-        }
-    })
+    summary = stats_recorder.summary(email_classifier.categories)
+    categories = summary['categories']
+    return revalidated(jsonify({
+        'total_analyzed': summary['total_analyzed'],
+        'spam_detected': categories.get('spam', {}).get('count', 0),
+        'ham_classified': categories.get('not_spam', {}).get('count', 0),  # This is now "not_spam" but keeping for compatibility
+        'accuracy_rate': None,  # needs labelled feedback, which is not collected
+        'categories': categories,
+        'risk_levels': summary['risk_levels'],
+        'recent': summary['recent'],
+        'admission': admission.stats(),
+        'cascade': cascade.stats(),
+        'result_cache': result_cache.stats(),
+        'near_duplicates': near_duplicate_index.stats(),
+        'jobs': job_queue.stats(),
+        'sessions': session_store.stats()
+    }))
+
+@main_bp.route('/api/rules')
+def get_rules():
+    """Identity of the live rule pack and hot reload status"""
+    reloader = current_app.extensions.get('rule_reloader')
+    return revalidated(jsonify({
+        'rules': email_classifier.rules.info(),
+        'reload': reloader.stats() if reloader else None
+    }))
@@ -0,0 +1,247 @@
+"""
+Versioned rule packs: validation, precompilation and hot reload
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from types import MappingProxyType
+
+from app.matching import KeywordMatcher, PatternRegistry
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(__file__), 'rules', 'default.json')
+
+# Bump when the cached compiled form changes shape or validation gets stricter
+CACHE_FORMAT = 1
+
+# Names the classifier stages refer to directly, so every pack must define them
+REQUIRED_CATEGORIES = ('spam', 'not_spam', 'promotional', 'newsletter', 'social')
+REQUIRED_PATTERNS = ('money_amounts', 'urgency', 'caps_words', 'multiple_exclamation', 'suspicious_phrases')
+
+class RulePackError(ValueError):
+    """Raised when a rule file is malformed"""
+
+def _freeze(value):
+    """Read-only copy of parsed JSON"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def rules_digest(rules):
+    """Short content hash of parsed rules, independent of file formatting"""
+    canonical = json.dumps(rules, sort_keys=True, separators=(',', ':'))
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=8).hexdigest()
+
+def validate_rules(rules):
+    """Raise RulePackError unless rules has the shape the classifier relies on"""
+    if not isinstance(rules, dict):
+        raise RulePackError('Rules must be a JSON object')
+    for key in ('version', 'categories', 'patterns', 'pattern_signals', 'risk_thresholds'):
+        if key not in rules:
+            raise RulePackError(f'Rules are missing "{key}"')
+    
+    categories = rules['categories']
+    if not isinstance(categories, dict):
+        raise RulePackError('"categories" must be an object')
+    for name in REQUIRED_CATEGORIES:
+        if name not in categories:
+            raise RulePackError(f'Category "{name}" is required')
+    for name, data in categories.items():
+        if not isinstance(data, dict):
+            raise RulePackError(f'Category "{name}" must be an object')
+        keywords = data.get('keywords')
+        if not isinstance(keywords, list) or not all(isinstance(k, str) and k for k in keywords):
+            raise RulePackError(f'Category "{name}" needs a list of non-empty keywords')
+        if not isinstance(data.get('weight'), (int, float)):
+            raise RulePackError(f'Category "{name}" needs a numeric weight')
+        for field in ('display_name', 'color', 'icon'):
+            if not isinstance(data.get(field), str):
+                raise RulePackError(f'Category "{name}" needs a "{field}" string')
+    
+    patterns = rules['patterns']
+    if not isinstance(patterns, dict):
+        raise RulePackError('"patterns" must be an object')
+    for name in REQUIRED_PATTERNS:
+        if name not in patterns:
+            raise RulePackError(f'Pattern "{name}" is required')
+    for name, pattern in patterns.items():
+        try:
+            re.compile(pattern)
+        except (TypeError, re.error) as e:
+            raise RulePackError(f'Pattern "{name}" does not compile: {e}')
+    
+    signals = rules['pattern_signals']
+    if not isinstance(signals, list):
+        raise RulePackError('"pattern_signals" must be a list of [pattern, increments] pairs')
+    for signal in signals:
+        if not (isinstance(signal, list) and len(signal) == 2 and isinstance(signal[1], dict)):
+            raise RulePackError(f'Invalid pattern signal {signal!r}')
+        name, increments = signal
+        if name not in patterns:
+            raise RulePackError(f'Pattern signal refers to unknown pattern "{name}"')
+        for category, increment in increments.items():
+            if category not in categories or not isinstance(increment, (int, float)):
+                raise RulePackError(f'Invalid increment {category!r}: {increment!r} for pattern "{name}"')
+    
+    thresholds = rules['risk_thresholds']
+    if not isinstance(thresholds, dict) or 'spam' not in thresholds:
+        raise RulePackError('"risk_thresholds" must be an object with at least "spam"')
+    for name, levels in thresholds.items():
+        if not isinstance(levels, dict) or not all(
+            isinstance(levels.get(level), (int, float)) for level in ('high', 'medium')
+        ):
+            raise RulePackError(f'Risk thresholds for "{name}" need numeric "high" and "medium"')
+
+class RulePack:
+    """An immutable, compiled set of categories, patterns and thresholds"""
+    
+    def __init__(self, rules, keyword_state=None, source=None, validated=False):
+        if not validated:
+            validate_rules(rules)
+        self.source = source
+        self.version = str(rules['version'])
+        self.digest = rules_digest(rules)
+        self.id = f'{self.version}@{self.digest}'
+        self.categories = _freeze(rules['categories'])
+        self.patterns = _freeze(rules['patterns'])
+        self.pattern_signals = tuple((name, _freeze(increments)) for name, increments in rules['pattern_signals'])
+        self.risk_thresholds = _freeze(rules['risk_thresholds'])
+        
+        # Display metadata copied into every result, built once per pack
+        self.category_meta = MappingProxyType({
+            name: MappingProxyType({field: data[field] for field in ('display_name', 'color', 'icon')})
+            for name, data in self.categories.items()
+        })
+        
+        keywords = [keyword for data in self.categories.values() for keyword in data['keywords']]
+        if keyword_state and keyword_state.get('keywords') == list(dict.fromkeys(keywords)):
+            self.keyword_matcher = KeywordMatcher.from_state(keyword_state)
+        else:
+            self.keyword_matcher = KeywordMatcher(keywords)
+        self.pattern_registry = PatternRegistry(self.patterns)
+    
+    def info(self):
+        """Identity of the pack for status endpoints"""
+        return {
+            'id': self.id,
+            'version': self.version,
+            'digest': self.digest,
+            'source': self.source,
+            'categories': list(self.categories),
+            'patterns': list(self.patterns),
+            'keywords': len(self.keyword_matcher.keywords)
+        }
+
+def load_rule_pack(path=DEFAULT_RULES_PATH, cache_dir=None):
+    """Read, validate and compile a rule file
+    
+    With a cache_dir, the compiled keyword matcher is stored under the
+    rules' digest, so restarts and reloads of known rules skip that work.
+    Only rules that passed validation are cached, so a cache hit skips
+    validation as well.
+    """
+    try:
+        with open(path, 'rb') as f:
+            rules = json.loads(f.read())
+    except ValueError as e:
+        raise RulePackError(f'{path}: invalid JSON: {e}')
+    
+    cache_path = os.path.join(cache_dir, f'{rules_digest(rules)}.json') if cache_dir else None
+    
+    keyword_state = None
+    if cache_path:
+        try:
+            with open(cache_path, encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('format') == CACHE_FORMAT:
+                keyword_state = cached['keyword_matcher']
+        except (OSError, ValueError, KeyError):
+            keyword_state = None
+    
+    if keyword_state is None:
+        validate_rules(rules)
+    pack = RulePack(rules, keyword_state, source=os.path.abspath(path), validated=True)
+    
+    if cache_path and keyword_state is None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'format': CACHE_FORMAT, 'keyword_matcher': pack.keyword_matcher.state()}, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass  # the cache only saves compile time
+    
+    return pack
+
+class RuleReloader:
+    """Swap a classifier onto a new rule pack when its file changes
+    
+    check() is cheap enough to call on every request: it stats the file at
+    most once per interval, and only one caller compiles at a time. A file
+    that fails to load leaves the current pack in place.
+    """
+    
+    def __init__(self, classifier, path, cache_dir=None, interval=5.0, clock=time.monotonic):
+        self.classifier = classifier
+        self.path = path
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.clock = clock
+        self._stamp = self._stat()
+        self._checked = clock()
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+    
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+    
+    def check(self, force=False):
+        """Reload if the file changed since the last check; True when a new pack went live"""
+        if not force and self.clock() - self._checked < self.interval:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False  # another thread is already checking
+        
+        try:
+            self._checked = self.clock()
+            stamp = self._stat()
+            if stamp == self._stamp and not force:
+                return False
+            self._stamp = stamp
+            
+            try:
+                pack = load_rule_pack(self.path, self.cache_dir)
+            except (OSError, RulePackError) as e:
+                self.failures += 1
+                self.last_error = str(e)
+                return False
+            
+            self.last_error = None
+            if pack.id == self.classifier.rules.id:
+                return False
+            self.classifier.set_rules(pack)
+            self.reloads += 1
+            return True
+        finally:
+            self._lock.release()
+    
+    def stats(self):
+        """Reload counters and the last load error"""
+        return {
+            'path': os.path.abspath(self.path),
+            'interval': self.interval,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,16 @@
+"""
+Sample emails for each classification category
+"""
+SAMPLE_EMAILS = {
+    'spam': "URGENT! CONGRATULATIONS! You have won $1,000,000 in our international lottery! This is not a scam! You must click here immediately and send your bank details to claim your prize! ACT NOW! LIMITED TIME! Don't miss this once-in-a-lifetime opportunity!",
+    
+    'not_spam': "Dear John,\n\nI hope this email finds you well. I wanted to follow up on our project meeting yesterday regarding the quarterly timeline and resource allocation.\n\nCould we schedule a brief call this week to discuss the next steps? I'm available Thursday or Friday afternoon.\n\nPlease let me know your availability.\n\nBest regards,\nSarah Smith\nProject Manager",
+    
+    'promotional': "🎉 HUGE BLACK FRIDAY SALE! 🎉\n\nSave up to 70% on all electronics this weekend only!\n• Laptops starting at $299\n• Smartphones 50% off\n• Free shipping on orders over $50\n\nUse code: SAVE70\nShop now at TechStore.com - Sale ends Sunday midnight!",
+    
+    'phishing': "SECURITY ALERT: Your account has been temporarily suspended!\n\nWe detected unusual login activity on your account. Your account will be permanently closed within 24 hours unless you verify your identity immediately.\n\nClick here to verify now and enter your username, password, and banking details to restore access.\n\nThis is urgent - do not ignore this message!",
+    
+    'newsletter': "Tech Weekly Newsletter - January 2025\n\nDear Subscriber,\n\nWelcome to this week's edition of Tech Weekly. Here's what's happening in technology:\n\n• AI breakthrough in natural language processing\n• New Python 3.13 features and improvements\n• Cybersecurity trends for 2025\n• Upcoming tech conferences\n\nRead full articles at techweekly.com\nUnsubscribe anytime at newsletter@techweekly.com",
+    
+    'social': "Facebook Notification\n\nYou have new activity on Facebook:\n\n• 3 new friend requests from John, Sarah, and Mike\n• 5 people liked your recent photo\n• 2 new comments on your weekend trip post\n• Your friend Lisa shared an article you might like\n\nView all notifications in the Facebook mobile app or visit facebook.com"
+}
@@ -0,0 +1,186 @@
+"""
+Classification counters accumulated in memory and flushed to SQLite in hourly buckets
+"""
+import atexit
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+BUCKET_SECONDS = 3600
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stat_buckets (
+    bucket INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    risk_level TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (bucket, category, risk_level)
+);
+CREATE TABLE IF NOT EXISTS stat_totals (
+    category TEXT NOT NULL,
+    risk_level TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (category, risk_level)
+);
+'''
+
+class StatsRecorder:
+    """Per-process classification counts, written to a shared store off the request path
+    
+    record() only bumps an in-memory counter. A background thread flushes
+    the counts every flush_interval seconds in one transaction, adding them
+    to hourly buckets and to running totals, so reads touch a bounded number
+    of rows however long the history grows.
+    """
+    
+    def __init__(self, path=None, flush_interval=5.0, retention_days=30, clock=time.time):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self.clock = clock
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._thread = None
+        self._stop = threading.Event()
+        self._pruned = 0.0
+    
+    def configure(self, path=None, flush_interval=None, retention_days=None):
+        """Point the recorder at a database file or change its intervals"""
+        if path is not None:
+            self.path = path
+            self._local = threading.local()
+        if flush_interval is not None:
+            self.flush_interval = flush_interval
+        if retention_days is not None:
+            self.retention_days = retention_days
+    
+    def _connect(self):
+        """This thread's connection, creating the schema on first use"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+    
+    def record(self, result):
+        """Count one classification result"""
+        category = result.get('category')
+        if category is None:
+            return
+        bucket = int(self.clock() // BUCKET_SECONDS) * BUCKET_SECONDS
+        key = (bucket, category, result.get('risk_level', 'unknown'))
+        with self._lock:
+            self._pending[key] += 1
+    
+    def flush(self):
+        """Write the pending counts; on failure they stay pending for the next flush"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending or self.path is None:
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        
+        totals = Counter()
+        for (_, category, risk_level), count in pending.items():
+            totals[category, risk_level] += count
+        
+        try:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    'INSERT INTO stat_buckets (bucket, category, risk_level, count) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (bucket, category, risk_level) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in pending.items()]
+                )
+                connection.executemany(
+                    'INSERT INTO stat_totals (category, risk_level, count) VALUES (?, ?, ?) '
+                    'ON CONFLICT (category, risk_level) DO UPDATE SET count = count + excluded.count',
+                    [(*key, count) for key, count in totals.items()]
+                )
+                if self.clock() - self._pruned > BUCKET_SECONDS:
+                    self._pruned = self.clock()
+                    connection.execute(
+                        'DELETE FROM stat_buckets WHERE bucket < ?', (self.clock() - self.retention_days * 86400,)
+                    )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error:
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+        return sum(pending.values())
+    
+    def start(self):
+        """Flush in the background from now on, and once more at exit"""
+        if self._thread is not None or self.path is None or multiprocessing.parent_process() is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='stats-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+    
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+    
+    def summary(self, categories=(), window=24 * 3600):
+        """All-time and recent counts by category and risk level, including unflushed ones"""
+        with self._lock:
+            pending = list(self._pending.items())
+        
+        since = self.clock() - window
+        totals = Counter()
+        recent = Counter()
+        if self.path is not None:
+            connection = self._connect()
+            for category, risk_level, count in connection.execute(
+                'SELECT category, risk_level, count FROM stat_totals'
+            ):
+                totals[category, risk_level] += count
+            for category, count in connection.execute(
+                'SELECT category, SUM(count) FROM stat_buckets WHERE bucket >= ? GROUP BY category',
+                (since - since % BUCKET_SECONDS,)
+            ):
+                recent[category] += count
+        for (bucket, category, risk_level), count in pending:
+            totals[category, risk_level] += count
+            if bucket >= since - since % BUCKET_SECONDS:
+                recent[category] += count
+        
+        by_category = Counter(dict.fromkeys(categories, 0))
+        by_risk = Counter()
+        for (category, risk_level), count in totals.items():
+            by_category[category] += count
+            by_risk[risk_level] += count
+        total = sum(by_category.values())
+        
+        def shares(counts):
+            return {
+                name: {'count': count, 'percentage': round(count / total * 100, 1) if total else 0.0}
+                for name, count in counts.items()
+            }
+        
+        return {
+            'total_analyzed': total,
+            'categories': shares(by_category),
+            'risk_levels': shares(by_risk),
+            'recent': {
+                'window': window,
+                'total_analyzed': sum(recent.values()),
+                'categories': dict(recent)
+            }
+        }
+
+# Global recorder, configured and started by create_app
+stats_recorder = StatsRecorder()
@@ -0,0 +1,116 @@
+"""
+Incremental JSON readers for batch email submissions
+"""
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\r\n'
+
+class StreamFormatError(ValueError):
+    """Raised when a streamed body cannot be parsed any further"""
+
+def iter_ndjson(stream):
+    """Yield (value, error) for each non-blank line of a binary NDJSON stream"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f'Invalid JSON line: {e}'
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """Yield the items of a top-level JSON array without loading it whole"""
+    reader = _ChunkReader(stream, chunk_size)
+    
+    if reader.next_char() != '[':
+        raise StreamFormatError('Expected a JSON array')
+    reader.advance(1)
+    
+    if reader.next_char() == ']':
+        return
+    
+    while True:
+        yield reader.decode_value()
+        
+        char = reader.next_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise StreamFormatError('Expected "," or "]" in JSON array')
+        reader.advance(1)
+
+class _ChunkReader:
+    """Text buffer over a binary stream that only holds the current item"""
+    
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self._pending = b''
+    
+    def _fill(self, size):
+        """Read at least one more chunk into the buffer"""
+        if self.eof:
+            return False
+        
+        data = self.stream.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+            if self._pending:
+                raise StreamFormatError('Invalid UTF-8 in request body')
+            return False
+        
+        # Keep an incomplete trailing UTF-8 sequence for the next read
+        data = self._pending + data
+        try:
+            text = data.decode('utf-8')
+            self._pending = b''
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise StreamFormatError('Invalid UTF-8 in request body')
+            text = data[:e.start].decode('utf-8')
+            self._pending = data[e.start:]
+        
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+    
+    def next_char(self):
+        """Return the next non-whitespace character, or '' at end of stream"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+    
+    def advance(self, count):
+        self.pos += count
+    
+    def decode_value(self):
+        """Decode the next JSON value, reading more input until it is complete"""
+        self.next_char()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                value, end = None, None
+            
+            # A value ending exactly at the buffer edge may be a truncated number
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.pos = end
+                return value
+            
+            # Grow reads with the item so huge values are not re-parsed per chunk
+            if not self._fill(len(self.buffer) - self.pos):
+                if end is not None:
+                    self.pos = end
+                    return value
+                raise StreamFormatError('Invalid JSON value in array')
@@ -0,0 +1,151 @@
+"""
+Reproducible throughput, stage-time and memory benchmark for analyze_email
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from app import metrics
+from app.models import EmailClassifier
+from benchmarks.corpus import generate_corpus
+
+# (message size in characters, messages per size class)
+SIZE_PROFILE = [
+    (50, 400),
+    (1000, 300),
+    (8 * 1024, 200),
+    (64 * 1024, 50),
+    (512 * 1024, 8),
+    (4 * 1024 * 1024, 2)
+]
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _peak_memory(classifier, text):
+    """Peak bytes allocated while analyzing text"""
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        classifier.analyze_email(text)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+def benchmark_size(size, count, seed=0, repeat=3):
+    """Measure one size class over a deterministic mixed-category corpus"""
+    texts = [item['email_content'] for item in generate_corpus(count, seed, [size])]
+    classifier = EmailClassifier()
+    classifier.analyze_email(texts[0])
+    
+    # Best of several runs is the least noisy throughput figure
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            classifier.analyze_email(text)
+        best = min(best, time.perf_counter() - start)
+    
+    histogram = metrics.Histogram('bench_stage_seconds', 'Stage time', ['stage', 'size'])
+    timed = EmailClassifier()
+    metrics.instrument_classifier(timed, histogram=histogram)
+    for text in texts:
+        timed.analyze_email(text)
+    stages = {}
+    for (stage, _), (_, total) in histogram.totals().items():
+        stages[stage] = round(total / count * 1000, 4)
+    
+    chars = sum(len(text) for text in texts)
+    return {
+        'size': size,
+        'emails': count,
+        'seconds': round(best, 6),
+        'emails_per_sec': round(count / best, 2),
+        'mb_per_sec': round(chars / best / 1e6, 3),
+        'stage_ms_per_email': dict(sorted(stages.items())),
+        'peak_memory_bytes': _peak_memory(EmailClassifier(), max(texts, key=len))
+    }
+
+def run(profile=SIZE_PROFILE, seed=0, repeat=3, scale=1.0):
+    """Run every size class and return the JSON-ready report"""
+    results = []
+    for size, count in profile:
+        count = max(1, int(count * scale))
+        result = benchmark_size(size, count, seed, repeat)
+        print(f"{size:>9} chars  {result['emails_per_sec']:>10.1f} emails/s  "
+              f"{result['mb_per_sec']:>7.2f} MB/s  peak {result['peak_memory_bytes'] / 1024:>9.0f} KB",
+              file=sys.stderr)
+        results.append(result)
+    
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeat': repeat,
+            'scale': scale,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        },
+        'results': results
+    }
+
+def compare(baseline, current, threshold):
+    """Regressions beyond threshold percent, as readable messages"""
+    previous = {result['size']: result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = previous.get(result['size'])
+        if old is None:
+            continue
+        
+        change = (result['emails_per_sec'] - old['emails_per_sec']) / old['emails_per_sec'] * 100
+        if change < -threshold:
+            regressions.append(f"{result['size']} chars: throughput {change:+.1f}% "
+                               f"({old['emails_per_sec']} -> {result['emails_per_sec']} emails/s)")
+        
+        if old['peak_memory_bytes']:
+            change = (result['peak_memory_bytes'] - old['peak_memory_bytes']) / old['peak_memory_bytes'] * 100
+            if change > threshold:
+                regressions.append(f"{result['size']} chars: peak memory {change:+.1f}% "
+                                   f"({old['peak_memory_bytes']} -> {result['peak_memory_bytes']} bytes)")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark EmailClassifier.analyze_email')
+    parser.add_argument('-o', '--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed regression in percent')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply messages per size class')
+    args = parser.parse_args(argv)
+    
+    report = run(seed=args.seed, repeat=args.repeat, scale=args.scale)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        for message in regressions:
+            print(f'REGRESSION {message}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold}%', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
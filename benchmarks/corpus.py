@@ -0,0 +1,93 @@
+"""
+Deterministic synthetic email corpus built from the sample templates
+"""
+import argparse
+import json
+import random
+import re
+import sys
+
+from app.samples import SAMPLE_EMAILS
+
+CATEGORIES = tuple(SAMPLE_EMAILS)
+
+NAMES = ['John', 'Sarah', 'Mike', 'Lisa', 'Priya', 'Chen', 'Amara', 'Diego', 'Olga', 'Tom']
+
+_SENTENCE_RE = re.compile(r'[^.!?\n]+[.!?]*\s*')
+_NUMBER_RE = re.compile(r'\d+')
+_NAME_RE = re.compile(r'\b(?:%s)\b' % '|'.join(NAMES))
+
+# Sentences of each template, used as building blocks
+_SENTENCES = {
+    category: [s for s in _SENTENCE_RE.findall(text) if s.strip()]
+    for category, text in SAMPLE_EMAILS.items()
+}
+
+def _vary(rng, sentence):
+    """Swap numbers and names so generated messages are not identical"""
+    sentence = _NUMBER_RE.sub(lambda m: str(rng.randint(1, 10 ** len(m.group()))), sentence)
+    return _NAME_RE.sub(lambda m: rng.choice(NAMES), sentence)
+
+def generate_email(rng, category, size, noise=0.2):
+    """Build one email of about size characters that reads like category
+    
+    Messages start from the category template and grow with its sentences,
+    mixing in a share of sentences from other categories.
+    """
+    template = SAMPLE_EMAILS[category]
+    if size <= len(template):
+        cut = template.rfind(' ', 0, size)
+        return template[:cut if cut > 0 else size]
+    
+    parts = [template]
+    length = len(template)
+    while length < size:
+        source = rng.choice(CATEGORIES) if rng.random() < noise else category
+        sentence = _vary(rng, rng.choice(_SENTENCES[source]))
+        if rng.random() < 0.15:
+            sentence += '\n\n'
+        parts.append(sentence)
+        length += len(sentence)
+    
+    return ''.join(parts)[:size]
+
+def generate_corpus(count, seed=0, sizes=(50, 4 * 1024 * 1024), categories=CATEGORIES, noise=0.2):
+    """Yield count emails as {'id', 'category', 'size', 'email_content'}
+    
+    A (min, max) pair draws sizes log-uniformly; a list of sizes is cycled.
+    The same arguments always produce the same corpus.
+    """
+    rng = random.Random(seed)
+    for index in range(count):
+        if isinstance(sizes, tuple) and len(sizes) == 2:
+            low, high = sizes
+            size = int(round(low * (high / low) ** rng.random()))
+        else:
+            size = sizes[index % len(sizes)]
+        category = categories[index % len(categories)] if rng.random() < 0.5 else rng.choice(categories)
+        yield {
+            'id': index,
+            'category': category,
+            'size': size,
+            'email_content': generate_email(rng, category, size, noise)
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic email corpus as NDJSON')
+    parser.add_argument('-n', '--count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-size', type=int, default=50, help='smallest message in characters')
+    parser.add_argument('--max-size', type=int, default=4 * 1024 * 1024, help='largest message in characters')
+    parser.add_argument('-o', '--output', help='output file (default: stdout)')
+    args = parser.parse_args(argv)
+    
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for item in generate_corpus(args.count, args.seed, (args.min_size, args.max_size)):
+            out.write(json.dumps(item) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+"""
+Load generator that replays a corpus against the Flask app and reports latency over time
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import platform
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+from app.streaming import iter_ndjson
+from benchmarks.bench import _git_commit
+from benchmarks.corpus import CATEGORIES
+
+SCENARIO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios')
+
+PERCENTILES = (50, 95, 99)
+
+class InProcessTarget:
+    """Requests through the Flask test client, one client per thread"""
+    
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+    
+    def describe(self):
+        return 'in-process'
+    
+    def request(self, method, path, body=None):
+        """(status, decoded JSON body or None)"""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+class HttpTarget:
+    """Requests to a running server over keep-alive connections, one per thread"""
+    
+    def __init__(self, url, timeout=60):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f'Not an http(s) URL: {url}')
+        self.url = url
+        self.timeout = timeout
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self._host = parts.hostname
+        self._port = parts.port
+        self._prefix = parts.path.rstrip('/')
+        self._local = threading.local()
+    
+    def describe(self):
+        return self.url
+    
+    def request(self, method, path, body=None):
+        """(status, decoded JSON body or None); a failed connection is reopened on the next request"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connection_class(self._host, self._port, timeout=self.timeout)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        try:
+            connection.request(method, self._prefix + path, body=data, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self._local.connection = None
+            raise
+        try:
+            return response.status, json.loads(payload)
+        except ValueError:
+            return response.status, None
+
+def load_corpus(path, limit=None):
+    """The email_content of each item of an NDJSON corpus"""
+    messages = []
+    with open(path, 'rb') as f:
+        for item, error in iter_ndjson(f):
+            if error is None and isinstance(item, dict) and item.get('email_content'):
+                messages.append(item['email_content'])
+                if limit and len(messages) >= limit:
+                    break
+    if not messages:
+        raise ValueError(f'No email_content items in {path}')
+    return messages
+
+def load_samples(target):
+    """The /sample/<category> messages, fetched through the target"""
+    messages = []
+    for category in CATEGORIES:
+        status, body = target.request('GET', f'/sample/{category}')
+        if status != 200 or not body:
+            raise ValueError(f'/sample/{category} returned {status}')
+        messages.append(body['content'])
+    return messages
+
+def load_scenario(name):
+    """A saved scenario by name, or a scenario JSON file
+    
+    A scenario is {"description": ..., "phases": [...]}. Each phase runs for
+    duration seconds, either open-loop at rate requests per second (a
+    [start, end] pair ramps linearly) or closed-loop with concurrency
+    clients that each send their next request as soon as one completes.
+    """
+    path = name if os.path.exists(name) else os.path.join(SCENARIO_DIR, f'{name}.json')
+    try:
+        with open(path, encoding='utf-8') as f:
+            scenario = json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f'Unknown scenario {name!r}; saved scenarios: {", ".join(scenario_names())}')
+    
+    phases = scenario.get('phases') if isinstance(scenario, dict) else None
+    if not phases:
+        raise ValueError(f'Scenario {name!r} has no phases')
+    for index, phase in enumerate(phases):
+        phase.setdefault('name', f'phase-{index + 1}')
+        if not isinstance(phase.get('duration'), (int, float)) or phase['duration'] <= 0:
+            raise ValueError(f"Phase {phase['name']!r} needs a positive duration")
+        if ('rate' in phase) == ('concurrency' in phase):
+            raise ValueError(f"Phase {phase['name']!r} needs exactly one of rate and concurrency")
+    scenario.setdefault('name', os.path.splitext(os.path.basename(path))[0])
+    return scenario
+
+def scenario_names():
+    """Names of the scenarios saved next to this module"""
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(SCENARIO_DIR) if name.endswith('.json'))
+
+def send_times(rate, duration):
+    """Offsets into a phase at which an open-loop rate sends, constant or ramped linearly
+    
+    The k-th request goes out when the integral of the rate reaches k.
+    """
+    start, end = (rate, rate) if isinstance(rate, (int, float)) else rate
+    total = (start + end) / 2 * duration
+    slope = (end - start) / duration / 2
+    for k in range(math.ceil(total)):
+        if slope == 0:
+            yield k / start
+        else:
+            yield (math.sqrt(start * start + 4 * slope * k) - start) / (2 * slope)
+
+class LoadRun:
+    """One run of a scenario against a target, collecting a sample per request
+    
+    Open-loop phases hand scheduled send times to a pool of workers, and
+    latency counts from the scheduled time, so a server that falls behind
+    shows the queueing its clients would see instead of slowing the load.
+    """
+    
+    def __init__(self, target, messages, path='/analyze', workers=32, unique=False, clock=time.perf_counter):
+        self.target = target
+        self.path = path
+        self.workers = workers
+        self.unique = unique
+        self.clock = clock
+        self.samples = []
+        self._messages = itertools.cycle(messages)
+        self._sent = itertools.count()
+        self._lock = threading.Lock()
+        self._start = None
+    
+    def _send(self, phase, scheduled):
+        with self._lock:
+            message = next(self._messages)
+            number = next(self._sent)
+        if self.unique:
+            # Distinct text keeps repeated messages from being served by the result cache
+            message = f'{message}\n\nRef: load-{number}'
+        try:
+            status, _ = self.target.request('POST', self.path, {'email_content': message})
+            outcome = None if status < 400 else str(status)
+        except Exception as e:
+            outcome = type(e).__name__
+        done = self.clock()
+        with self._lock:
+            self.samples.append((phase, done - self._start, done - scheduled, outcome))
+    
+    def _drain(self, tickets):
+        while True:
+            ticket = tickets.get()
+            if ticket is None:
+                return
+            self._send(*ticket)
+    
+    def _wait_until(self, moment):
+        delay = moment - self.clock()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def run(self, phases):
+        """Run the phases in order; returns their actual (start, end) offsets"""
+        tickets = queue.Queue()
+        pool = [threading.Thread(target=self._drain, args=(tickets,), daemon=True) for _ in range(self.workers)]
+        for thread in pool:
+            thread.start()
+        
+        self._start = self.clock()
+        spans = []
+        for index, phase in enumerate(phases):
+            begin = self.clock()
+            if 'rate' in phase:
+                for offset in send_times(phase['rate'], phase['duration']):
+                    self._wait_until(begin + offset)
+                    tickets.put((index, begin + offset))
+                self._wait_until(begin + phase['duration'])
+            else:
+                deadline = begin + phase['duration']
+                
+                def loop():
+                    while self.clock() < deadline:
+                        self._send(index, self.clock())
+                
+                clients = [threading.Thread(target=loop, daemon=True) for _ in range(phase['concurrency'])]
+                for thread in clients:
+                    thread.start()
+                for thread in clients:
+                    thread.join()
+            spans.append((begin - self._start, self.clock() - self._start))
+        
+        for _ in pool:
+            tickets.put(None)
+        for thread in pool:
+            thread.join()
+        return spans
+
+def _percentile(ordered, percent):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+def summarize(samples, seconds):
+    """Throughput, error rate and latency percentiles of a set of samples"""
+    latencies = sorted(sample[2] for sample in samples)
+    errors = Counter(sample[3] for sample in samples if sample[3] is not None)
+    failed = sum(errors.values())
+    summary = {
+        'requests': len(samples),
+        'throughput': round(len(samples) / seconds, 2) if seconds > 0 else 0.0,
+        'errors': failed,
+        'error_rate': round(failed / len(samples), 4) if samples else 0.0,
+        'error_kinds': dict(errors.most_common()),
+        'latency_ms': None
+    }
+    if latencies:
+        summary['latency_ms'] = {f'p{percent}': round(_percentile(latencies, percent) * 1000, 2)
+                                 for percent in PERCENTILES}
+        summary['latency_ms']['max'] = round(latencies[-1] * 1000, 2)
+    return summary
+
+def build_report(samples, phases, spans, interval=1.0):
+    """Overall, per-phase and per-interval summaries of a finished run"""
+    elapsed = max([end for _, end in spans] + [sample[1] for sample in samples])
+    slots = max(1, math.ceil(elapsed / interval))
+    
+    by_phase = [[] for _ in phases]
+    by_interval = {}
+    for sample in samples:
+        by_phase[sample[0]].append(sample)
+        by_interval.setdefault(min(int(sample[1] // interval), slots - 1), []).append(sample)
+    
+    timeline = []
+    for slot in range(slots):
+        entry = summarize(by_interval.get(slot, []), interval)
+        entry['t'] = round(slot * interval, 3)
+        timeline.append(entry)
+    
+    return {
+        'overall': summarize(samples, elapsed),
+        'phases': [
+            dict(summarize(phase_samples, end - begin), name=phase['name'], duration=round(end - begin, 3))
+            for phase, phase_samples, (begin, end) in zip(phases, by_phase, spans)
+        ],
+        'timeline': timeline
+    }
+
+def _format(summary):
+    latency = summary['latency_ms'] or {}
+    return (f"{summary['requests']:>7} req  {summary['throughput']:>8.1f} req/s  "
+            f"err {summary['error_rate'] * 100:>5.1f}%  "
+            f"p50 {latency.get('p50', 0):>8.1f}  p95 {latency.get('p95', 0):>8.1f}  p99 {latency.get('p99', 0):>8.1f} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay emails against /analyze under a load scenario')
+    parser.add_argument('--url', help='base URL of a running server (default: the app in this process)')
+    parser.add_argument('--config', default=os.getenv('FLASK_CONFIG') or 'default',
+                        help='configuration for the in-process app')
+    parser.add_argument('--corpus', help='NDJSON corpus of email_content items (default: the /sample messages)')
+    parser.add_argument('--limit', type=int, help='messages to read from the corpus')
+    parser.add_argument('--scenario', default='steady',
+                        help=f'saved scenario ({", ".join(scenario_names())}) or a scenario JSON file')
+    parser.add_argument('--rate', type=float, help='run one open-loop phase at this rate instead of a scenario')
+    parser.add_argument('--concurrency', type=int, help='run one closed-loop phase with this many clients instead')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds for --rate or --concurrency')
+    parser.add_argument('--path', default='/analyze', help='endpoint to post to')
+    parser.add_argument('-w', '--workers', type=int, default=32, help='threads sending open-loop requests')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds per timeline entry')
+    parser.add_argument('--unique', action='store_true', help='make every message distinct to bypass the result cache')
+    parser.add_argument('-o', '--output', help='write the JSON report here (default: stdout)')
+    args = parser.parse_args(argv)
+    
+    try:
+        if args.rate is not None and args.concurrency is not None:
+            raise ValueError('Use only one of --rate and --concurrency')
+        if args.rate is not None:
+            scenario = {'name': 'rate', 'phases': [{'name': 'rate', 'duration': args.duration, 'rate': args.rate}]}
+        elif args.concurrency is not None:
+            scenario = {'name': 'concurrency', 'phases': [
+                {'name': 'concurrency', 'duration': args.duration, 'concurrency': args.concurrency}
+            ]}
+        else:
+            scenario = load_scenario(args.scenario)
+        
+        if args.url:
+            target = HttpTarget(args.url)
+        else:
+            from app import create_app
+            target = InProcessTarget(create_app(args.config))
+        messages = load_corpus(args.corpus, args.limit) if args.corpus else load_samples(target)
+    except (OSError, ValueError) as e:
+        print(f'error: {e}', file=sys.stderr)
+        sys.exit(2)
+    
+    print(f"{scenario['name']}: {len(scenario['phases'])} phases against {target.describe()}, "
+          f"{len(messages)} messages", file=sys.stderr)
+    run = LoadRun(target, messages, path=args.path, workers=args.workers, unique=args.unique)
+    spans = run.run(scenario['phases'])
+    report = build_report(run.samples, scenario['phases'], spans, args.interval)
+    
+    for entry in report['timeline']:
+        print(f"{entry['t']:>7.1f}s  {_format(entry)}", file=sys.stderr)
+    for phase in report['phases']:
+        print(f"{phase['name']:>12}  {_format(phase)}", file=sys.stderr)
+    print(f"{'overall':>12}  {_format(report['overall'])}", file=sys.stderr)
+    
+    report['meta'] = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'target': target.describe(),
+        'path': args.path,
+        'scenario': scenario,
+        'messages': len(messages),
+        'workers': args.workers,
+        'unique': args.unique,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Command-line bulk classifier for mbox, Maildir and NDJSON corpora
+"""
+import argparse
+import sys
+
+from app.bulk import INPUT_FORMATS, OUTPUT_FORMATS, cluster, run
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Classify an email corpus offline across a process pool')
+    parser.add_argument('input', help='mbox file, Maildir directory or NDJSON file')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    parser.add_argument('--input-format', choices=INPUT_FORMATS, help='default: detected from the path')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='ndjson')
+    parser.add_argument('-w', '--workers', type=int, help='worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, default=64, help='messages per worker task')
+    parser.add_argument('--unordered', action='store_true', help='write results as soon as they finish')
+    parser.add_argument('--rules', help='rule pack JSON file (default: the built-in rules)')
+    parser.add_argument('--checkpoint', help='progress file used to resume an interrupted run')
+    parser.add_argument('--clusters', action='store_true',
+                        help='group messages into near-duplicate campaigns instead of classifying them')
+    parser.add_argument('--threshold', type=float, default=0.8, help='similarity threshold for --clusters')
+    parser.add_argument('--max-clusters', type=int, default=50000,
+                        help='campaigns --clusters remembers at once, about 6 KB each (default: 50000)')
+    args = parser.parse_args(argv)
+    
+    try:
+        if args.clusters:
+            written = cluster(
+                args.input, args.output,
+                input_format=args.input_format,
+                output_format=args.output_format,
+                threshold=args.threshold,
+                max_clusters=args.max_clusters
+            )
+            print(f'Clustered {written} messages', file=sys.stderr)
+            return
+        
+        written = run(
+            args.input, args.output,
+            input_format=args.input_format,
+            output_format=args.output_format,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            ordered=not args.unordered,
+            checkpoint_path=args.checkpoint,
+            rules_path=args.rules
+        )
+    except (OSError, ValueError) as e:
+        parser.exit(1, f'classify: {e}\n')
+    
+    print(f'Classified {written} messages', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
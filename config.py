@@ -30,9 +30,60 @@ class Config:
     SPAM_THRESHOLD = 0.7
     PHISHING_THRESHOLD = 0.8
     
-    # Model settings
-    MODEL_FILENAME = 'spam_classifier.pkl'
-    VECTORIZER_FILENAME = 'tfidf_vectorizer.pkl'
+    # Result cache for repeated email bodies (size 0 disables it)
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 4096))
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 600))  # seconds
+    
+    # Near-duplicate campaign index (size 0 disables it)
+    NEAR_DUPLICATE_INDEX_SIZE = int(os.environ.get('NEAR_DUPLICATE_INDEX_SIZE', 10000))
+    NEAR_DUPLICATE_MAX_AGE = int(os.environ.get('NEAR_DUPLICATE_MAX_AGE', 3600))  # seconds
+    NEAR_DUPLICATE_THRESHOLD = float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', 0.8))
+    
+    # Admission control for analyses; concurrency must be at least 1
+    ANALYZE_CONCURRENCY = int(os.environ.get('ANALYZE_CONCURRENCY', 4))
+    ANALYZE_QUEUE_SIZE = int(os.environ.get('ANALYZE_QUEUE_SIZE', 32))
+    ANALYZE_TIMEOUT = float(os.environ.get('ANALYZE_TIMEOUT', 5.0))  # seconds, default per-request deadline
+    ANALYZE_MAX_TIMEOUT = float(os.environ.get('ANALYZE_MAX_TIMEOUT', 30.0))  # cap on X-Request-Timeout
+    
+    # Cascade mode: a keyword pass decides clear-cut emails, the full pipeline and
+    # learned model run only while the top category's lead is below the margin
+    CASCADE_ENABLED = os.environ.get('CASCADE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    CASCADE_KEYWORD_MARGIN = float(os.environ.get('CASCADE_KEYWORD_MARGIN', 0.5))
+    CASCADE_FULL_MARGIN = float(os.environ.get('CASCADE_FULL_MARGIN', 0.2))
+    CASCADE_BUDGET = float(os.environ.get('CASCADE_BUDGET', 0.05))  # seconds, default per-request budget
+    
+    # Compose-time analysis sessions, re-analysing only the edited part of a draft
+    INCREMENTAL_SESSIONS = int(os.environ.get('INCREMENTAL_SESSIONS', 1000))  # open at once, least recently used evicted
+    INCREMENTAL_IDLE_TIMEOUT = int(os.environ.get('INCREMENTAL_IDLE_TIMEOUT', 900))  # seconds
+    INCREMENTAL_MAX_CHARS = int(os.environ.get('INCREMENTAL_MAX_CHARS', 200000))  # per draft
+    
+    # Background jobs on a local SQLite queue (0 workers processes none in this app)
+    JOBS_DB = os.environ.get('JOBS_DB') or os.path.join(DATA_DIR, 'jobs.sqlite3')
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))  # analysis processes
+    JOBS_NICENESS = int(os.environ.get('JOBS_NICENESS', 10))  # CPU priority below request handling
+    JOBS_RESULT_TTL = int(os.environ.get('JOBS_RESULT_TTL', 3600))  # seconds results are kept
+    JOBS_MAX_EMAILS = int(os.environ.get('JOBS_MAX_EMAILS', 10000))  # per job
+    
+    # Classification counts behind /api/stats, flushed from each process in hourly buckets
+    STATS_DB = os.environ.get('STATS_DB') or os.path.join(DATA_DIR, 'stats.sqlite3')
+    STATS_FLUSH_INTERVAL = float(os.environ.get('STATS_FLUSH_INTERVAL', 5.0))  # seconds between batched writes
+    STATS_RETENTION_DAYS = int(os.environ.get('STATS_RETENTION_DAYS', 30))  # hourly buckets kept; totals are kept
+    
+    # Rule pack with categories, patterns and risk thresholds, reloaded when the file changes
+    RULES_PATH = os.environ.get('RULES_PATH') or os.path.join(BASE_DIR, 'app', 'rules', 'default.json')
+    RULES_CACHE_DIR = os.path.join(DATA_DIR, 'rule_cache')  # compiled matchers by rules digest
+    RULES_RELOAD_INTERVAL = float(os.environ.get('RULES_RELOAD_INTERVAL', 5.0))  # seconds, 0 disables reload
+    
+    # Browser and proxy caching of the main page and sample emails
+    HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE', 300))  # seconds
+    
+    # Per-stage latency histograms served at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    
+    # Model settings: flat memory-mapped artifacts written by train.py. They replace the
+    # old .pkl names, whose pickle format is not read; run train.py to produce them.
+    MODEL_FILENAME = 'spam_classifier.bin'
+    VECTORIZER_FILENAME = 'tfidf_vectorizer.bin'
     
     # Session timeout
     PERMANENT_SESSION_LIFETIME = timedelta(hours=2)
@@ -50,6 +101,9 @@ class ProductionConfig(Config):
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
+    JOBS_DB = 'file:jobs?mode=memory&cache=shared'  # shared by this process's connections, never on disk
+    JOBS_WORKERS = 0
+    STATS_DB = None  # counts stay in memory
     WTF_CSRF_ENABLED = False
 
 # Configuration dictionary
@@ -0,0 +1,702 @@
+"""
+Tests for the Email Classification System
+"""
+import base64
+import io
+import json
+import random
+import re
+import time
+
+import numpy as np
+import pytest
+
+from app.bulk import classify_chunk, message_text, run
+from app.cache import ResultCache
+from app.matching import KeywordCounter, PatternRegistry, count_email_addresses
+from app.cascade import Cascade
+from app.features import _PHONE_NUMBER_RE, _SENTENCE_SPLIT_RE, _URL_RE, _count_plain, _count_vector
+from app.incremental import IncrementalAnalysis, SessionStore
+from app.jobs import JobQueue
+from app.learned import LearnedClassifier, MappedArrays, TfidfVectorizer, train, write_arrays
+from app.mime import extract_message, strip_html
+from app.near_duplicates import MinHasher, NearDuplicateIndex, cluster_corpus
+from app.stats import StatsRecorder
+from app.samples import SAMPLE_EMAILS
+from app.rule_packs import DEFAULT_RULES_PATH, RulePackError, RuleReloader, load_rule_pack
+from app.models import EmailClassifier, _HTTP_URL_RE, _WHITESPACE_RE
+from benchmarks.corpus import generate_corpus
+from benchmarks.load import LoadRun, build_report, send_times
+
+# The original backtracking forms of the hardened matchers
+EMAIL_ADDRESS_REGEX = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+PERCENTAGES_REGEX = r'\d+%\s*(?:off|discount|save)'
+
+SIZE = 200000
+
+def _repeat(unit, size=SIZE):
+    return (unit * (size // len(unit) + 1))[:size]
+
+# (name, adversarial input, time budget in seconds for an analysis or a single matcher)
+PATHOLOGICAL_INPUTS = [
+    ('address chars without @', _repeat('a.'), 1.0),
+    ('dotted words', _repeat('.a'), 1.0),
+    ('numbered list', _repeat('1.'), 1.0),
+    ('bare percents', _repeat('1%'), 1.0),
+    ('percent without offer', _repeat('1%of'), 1.0),
+    ('phone fragments', _repeat('123-456-'), 1.0),
+    ('long digit run', _repeat('5'), 1.0),
+    ('repeated www', _repeat('www.'), 1.0),
+    ('repeated scheme', _repeat('http://'), 1.0),
+    ('unterminated scheme', _repeat('http:/'), 1.0),
+    ('long local part', _repeat('a') + '@example.com', 1.0),
+    ('long domain', 'a@' + _repeat('b.'), 1.0),
+    ('domain without tld', 'a@' + _repeat('b-'), 1.0),
+    ('tld into word char', 'a@b.' + _repeat('c') + '_', 1.0),
+    ('many at signs', _repeat('a@'), 1.0),
+    ('address runs', _repeat('a@b.c'), 1.0),
+    ('address into word char', _repeat('x@y.zz1'), 1.0),
+    ('piped tlds', _repeat('a@b.c|'), 1.0),
+    ('money separators', _repeat('$1,00,'), 1.0),
+    ('money chain', '$1' + _repeat(',000'), 1.0),
+    ('bare dollars', _repeat('$'), 1.0),
+    ('caps run into digit', _repeat('A') + '1', 1.0),
+    ('caps words', _repeat('AAA1 '), 1.0),
+    ('accented caps', _repeat('AÉ'), 1.0),
+    ('exclamations', _repeat('!'), 1.0),
+    ('punctuation run', _repeat('!?.'), 1.0),
+    ('whitespace run', _repeat(' \t\n'), 1.0),
+    ('keyword prefixes', _repeat('urgen'), 1.0),
+    ('phrase prefixes', _repeat('click '), 1.0),
+    ('unclosed style tags', _repeat('<style'), 1.0),
+    ('unclosed script tags', _repeat('<script'), 1.0),
+    ('unclosed comments', _repeat('<!--'), 1.0),
+    ('unclosed tags', _repeat('<'), 1.0),
+    ('unclosed break tags', _repeat('<br'), 1.0),
+    ('closing tag prefixes', _repeat('</'), 1.0)
+]
+
+@pytest.fixture(scope='module')
+def classifier():
+    return EmailClassifier()
+
+def _elapsed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+@pytest.mark.parametrize('name, text, budget', PATHOLOGICAL_INPUTS, ids=[case[0] for case in PATHOLOGICAL_INPUTS])
+def test_analysis_stays_within_time_budget(classifier, name, text, budget):
+    assert _elapsed(classifier.analyze_email, text) < budget
+
+@pytest.mark.parametrize('name, text, budget', PATHOLOGICAL_INPUTS, ids=[case[0] for case in PATHOLOGICAL_INPUTS])
+def test_every_matcher_stays_within_time_budget(classifier, name, text, budget):
+    matchers = [_WHITESPACE_RE.sub, _SENTENCE_SPLIT_RE.split, _URL_RE.findall, _HTTP_URL_RE.findall,
+                _PHONE_NUMBER_RE.findall]
+    for ignore_case in (True, False):
+        matchers += [regex.findall for regex in classifier.pattern_registry.compiled(ignore_case).values()]
+    
+    for matcher in matchers:
+        args = (' ', text) if matcher == _WHITESPACE_RE.sub else (text,)
+        assert _elapsed(matcher, *args) < budget, matcher
+    assert _elapsed(count_email_addresses, text) < budget
+
+@pytest.mark.parametrize('name, text, budget', PATHOLOGICAL_INPUTS, ids=[case[0] for case in PATHOLOGICAL_INPUTS])
+def test_html_extraction_stays_within_time_budget(name, text, budget):
+    assert _elapsed(strip_html, text) < budget
+    message = b'Content-Type: text/html; charset=utf-8\r\n\r\n' + text.encode('utf-8')
+    assert _elapsed(extract_message, message) < budget
+
+@pytest.mark.parametrize('name, text, budget', PATHOLOGICAL_INPUTS, ids=[case[0] for case in PATHOLOGICAL_INPUTS])
+def test_hardened_matchers_count_like_the_originals(classifier, name, text, budget):
+    # Short enough for the backtracking originals to finish quickly
+    text = text[:300] + text[-300:]
+    assert count_email_addresses(text) == len(EMAIL_ADDRESS_REGEX.findall(text))
+    for ignore_case in (True, False):
+        original = re.compile(PERCENTAGES_REGEX, re.IGNORECASE if ignore_case else 0)
+        hardened = classifier.pattern_registry.compiled(ignore_case)['percentages']
+        assert len(hardened.findall(text)) == len(original.findall(text))
+
+def test_email_address_count_matches_regex_on_random_text():
+    rng = random.Random(0)
+    parts = ['john.doe', '@', 'example', '.com', '.co', '|x', '_', 'é', '1', '-', ' ', '\n', '.', 'a', '..', '%+']
+    for _ in range(20000):
+        text = ''.join(rng.choice(parts) for _ in range(rng.randint(0, 12)))
+        assert count_email_addresses(text) == len(EMAIL_ADDRESS_REGEX.findall(text)), text
+
+def test_percentages_count_matches_original_on_random_text(classifier):
+    rng = random.Random(0)
+    parts = ['1', '23', '%', ' ', 'off', 'discount', 'save', 'x', '\t', 'OFF']
+    original = re.compile(PERCENTAGES_REGEX, re.IGNORECASE)
+    hardened = classifier.pattern_registry.compiled()['percentages']
+    for _ in range(20000):
+        text = ''.join(rng.choice(parts) for _ in range(rng.randint(0, 12)))
+        assert len(hardened.findall(text)) == len(original.findall(text)), text
+
+def test_lowercase_match_table_agrees_with_searching_the_lowercased_text(classifier):
+    patterns = dict(classifier.patterns, hex_caps=r'\x41{2}', shouting=r'[A-Z]{4,}!')
+    registry = PatternRegistry(patterns)
+    assert 'caps_words' not in registry.case_free and 'urgency' in registry.case_free
+    assert not {'hex_caps', 'shouting'} & registry.case_free
+    
+    texts = list(SAMPLE_EMAILS.values()) + ['URGENT: ACT NOW!!! WIN $1,000 AAaa', 'STOP! Ünïcode URGENT AA', '']
+    for text in texts:
+        lower_text = text.lower()
+        lower = registry.scan_lowered(lower_text, registry.scan(text))
+        for name, pattern in patterns.items():
+            assert lower.count(name) == len(re.findall(pattern, lower_text)), (name, text)
+            found = re.search(pattern, lower_text)
+            assert lower.first(name) == (found.start() if found else None), (name, text)
+
+def test_vectorised_character_counts_match_the_string_counts():
+    rng = random.Random(0)
+    parts = ['Hello', 'WORLD', ' ', '\n', '\t', '\x1c', '\xa0', '\u2003', '.', '!!', '?', '...', 'É', 'ß',
+             '555', '-', '123.456.7890', '5551234567', '\u0663', 'x1', '\ud800']
+    for _ in range(2000):
+        text = ''.join(rng.choice(parts) for _ in range(rng.randint(1, 80)))
+        assert _count_vector(text) == _count_plain(text), text
+
+def _write_rules(path, **changes):
+    with open(DEFAULT_RULES_PATH, encoding='utf-8') as f:
+        rules = json.load(f)
+    rules.update(changes)
+    path.write_text(json.dumps(rules), encoding='utf-8')
+    return rules
+
+def test_rule_pack_cache_restores_the_same_matcher(tmp_path):
+    built = load_rule_pack(DEFAULT_RULES_PATH, tmp_path)
+    cached = load_rule_pack(DEFAULT_RULES_PATH, tmp_path)
+    assert len(list(tmp_path.iterdir())) == 1
+    assert cached.id == built.id
+    assert cached.keyword_matcher.state() == built.keyword_matcher.state()
+
+def test_rule_pack_cache_hit_skips_validation_and_compiles_lazily(tmp_path, monkeypatch):
+    import app.rule_packs
+    validations = []
+    validate = app.rule_packs.validate_rules
+    monkeypatch.setattr(app.rule_packs, 'validate_rules', lambda rules: validations.append(1) or validate(rules))
+    
+    load_rule_pack(DEFAULT_RULES_PATH, tmp_path)
+    assert len(validations) == 1
+    cached = load_rule_pack(DEFAULT_RULES_PATH, tmp_path)
+    assert len(validations) == 1
+    
+    registry = cached.pattern_registry
+    assert registry._compiled == {}
+    assert registry.scan('URGENT: act now!!!').found('urgency')
+    assert list(registry._compiled) == [re.IGNORECASE]
+    assert registry.compiled() is registry.compiled(ignore_case=True)
+
+def test_invalid_rule_packs_are_rejected(tmp_path):
+    path = tmp_path / 'rules.json'
+    _write_rules(path, patterns={'urgency': '('})
+    with pytest.raises(RulePackError):
+        load_rule_pack(path)
+
+def test_reloader_swaps_valid_packs_and_keeps_the_last_good_one(tmp_path):
+    path = tmp_path / 'rules.json'
+    rules = _write_rules(path)
+    classifier = EmailClassifier(load_rule_pack(path))
+    reloader = RuleReloader(classifier, path, interval=0)
+    text = 'Quarterly roadmap review: ' + 'roadmap ' * 7
+    assert classifier.analyze_email(text)['rules_version'].startswith('1.0.0@')
+    
+    rules['categories']['spam']['keywords'].append('roadmap')
+    _write_rules(path, version='1.1.0', categories=rules['categories'])
+    assert reloader.check(force=True)
+    result = classifier.analyze_email(text)
+    assert result['rules_version'].startswith('1.1.0@')
+    assert result['category'] == 'spam'
+    
+    path.write_text('{"version": ', encoding='utf-8')
+    assert not reloader.check(force=True)
+    assert reloader.failures == 1
+    assert classifier.analyze_email(text)['rules_version'] == result['rules_version']
+
+def test_cascade_exits_early_only_on_clear_leads(classifier):
+    cascade = Cascade(classifier, budget=10.0)
+    clear = 'Congratulations winner! Claim your FREE cash prize and bonus money now, guaranteed.'
+    result = cascade.analyze(clear)
+    assert result['cascade']['tier'] == 'keywords'
+    full = classifier.analyze_email(clear)
+    assert result['category'] == full['category']
+    
+    # An early exit has the same shape, with the email's own features and indicators
+    assert set(result) - {'cascade'} == set(full)
+    assert result['features'] == full['features']
+    assert sorted(result['indicators']) == sorted(full['indicators'])
+    assert set(cascade.analyze(clear, fields=('category', 'features'))) == {'category', 'features', 'cascade'}
+    
+    unclear = 'Hi, see the attached notes from our call.'
+    result = cascade.analyze(unclear)
+    assert result['cascade']['tier'] == 'full'
+    expected = classifier.analyze_email(unclear)
+    assert {k: v for k, v in result.items() if k != 'cascade'} == expected
+
+def test_cascade_stops_at_the_latency_budget(classifier):
+    cascade = Cascade(classifier, budget=0.0)
+    cascade._rates['full'] = 1.0
+    result = cascade.analyze('Hi, see the attached notes from our call.')
+    assert result['cascade']['tier'] == 'keywords'
+    assert result['cascade']['reason'] == 'budget'
+    assert result['features'] == classifier.analyze_email('Hi, see the attached notes from our call.')['features']
+    assert cascade.stats()['budget_stops'] == 1
+
+@pytest.mark.parametrize('fields', [('category', 'confidence', 'risk_level'), ('scores', 'category'), ('indicators',)])
+def test_result_fields_match_the_full_result(classifier, fields):
+    for text in ('URGENT!!! Claim your $1,000 prize at http://x.co now', 'Dear team, the report is attached.', ' '):
+        full = classifier.analyze_email(text)
+        assert classifier.analyze_email(text, fields) == {field: full[field] for field in fields}
+
+def test_analyze_message_reads_text_parts_and_skips_attachments(classifier):
+    attachment = base64.encodebytes(bytes(range(256)) * 4000).replace(b'\n', b'\r\n')
+    raw = (
+        b'From: "billing@paypal.com" <alerts@example.net>\r\n'
+        b'Subject: =?utf-8?q?Your_account?=\r\n'
+        b'Content-Type: multipart/mixed; boundary="outer"\r\n\r\n'
+        b'--outer\r\nContent-Type: multipart/alternative; boundary=inner\r\n\r\n'
+        b'--inner\r\nContent-Type: text/plain; charset=utf-8\r\nContent-Transfer-Encoding: quoted-printable\r\n\r\n'
+        b'Verify your caf=C3=A9 acco=\r\nunt now\r\n'
+        b'--inner\r\nContent-Type: text/html\r\n\r\n<p>Verify your account <b>now</b></p>\r\n'
+        b'--inner--\r\n'
+        b'--outer\r\nContent-Type: application/zip\r\nContent-Disposition: attachment; filename="a.zip"\r\n'
+        b'Content-Transfer-Encoding: base64\r\n\r\n' + attachment + b'--outer--\r\n'
+    )
+    
+    message = extract_message(io.BytesIO(raw))
+    assert message.text == 'Your account\n\nVerify your café account now'
+    assert message.attachments == [{'type': 'application/zip', 'filename': 'a.zip', 'size': len(attachment)}]
+    assert message.features['display_name_mismatch'] and message.features['from_domain'] == 'example.net'
+    assert strip_html('<style>p {}</style><p>Save&nbsp;<b>50%</b></p><p>now</p>') == 'Save 50%\n\nnow'
+    
+    result = classifier.analyze_message(raw)
+    expected = classifier.analyze_email(message.text)
+    assert result['category'] == expected['category'] and result['scores'] == expected['scores']
+    assert result['message']['parts'] == [{'type': 'text/plain', 'size': 38}]
+
+def test_incremental_analysis_matches_full_analysis_after_edits(classifier):
+    rng = random.Random(5)
+    pieces = ' '.join(SAMPLE_EMAILS.values()).split(' ') + ['exclusivexclusive', '!!!', '\n\n', 'click here', 'a@b.com']
+    draft = ' '.join(rng.choice(pieces) for _ in range(1500))
+    analysis = IncrementalAnalysis(classifier, draft)
+    
+    for _ in range(60):
+        offset = rng.randint(0, len(draft))
+        deleted = rng.randint(0, min(len(draft) - offset, rng.choice([0, 1, 40, 3000])))
+        inserted = ' '.join(rng.choice(pieces) for _ in range(rng.choice([0, 1, 5, 200])))
+        draft = draft[:offset] + inserted + draft[offset + deleted:]
+        analysis.apply([(offset, deleted, inserted)])
+        assert analysis.result() == classifier.analyze_email(draft)
+    
+    with pytest.raises(ValueError):
+        analysis.apply([(0, 0, 'kept only if every edit fits '), (len(draft) + 100, 1, '')])
+    assert analysis.text == draft
+    
+    now = [0.0]
+    store = SessionStore(classifier, maxsize=2, idle_timeout=60, clock=lambda: now[0])
+    first, _ = store.create('first draft')
+    now[0] += 61
+    second, _ = store.create('second draft')
+    assert store.get(first) is None and store.get(second) is not None
+    assert store.stats()['expired'] == 1
+
+def test_job_queue_orders_by_priority_and_resumes_abandoned_jobs(tmp_path):
+    now = [1000.0]
+    queue = JobQueue(tmp_path / 'jobs.sqlite3', lease=30, chunk_size=1, clock=lambda: now[0])
+    items = [{'email_content': 'first email body'}, {'email_content': 'second email body'}]
+    low = queue.submit(items)
+    high = queue.submit(items[:1], priority=5, single=True)
+    
+    job = queue.claim()
+    assert job['id'] == high
+    queue.save_chunk(high, 0, [{'index': 0, 'success': True, 'result': {'category': 'spam'}}])
+    queue.finish(high)
+    assert queue.get(high)['result'] == {'category': 'spam'}
+    
+    # The worker stores one chunk of the other job, then dies
+    job = queue.claim()
+    assert job['id'] == low and job['finished_chunks'] == set()
+    queue.save_chunk(low, 0, [{'index': 0, 'success': True, 'result': {}}])
+    assert queue.claim() is None
+    
+    now[0] += 31
+    job = queue.claim()
+    assert job['id'] == low and job['finished_chunks'] == {0} and job['attempts'] == 1
+    assert queue.get(low)['progress'] == {'done': 1, 'total': 2}
+    
+    now[0] += queue.result_ttl + 1
+    assert queue.get(high) is None
+    assert queue.purge() == 1
+
+def test_stats_recorder_aggregates_across_flushes_and_processes(tmp_path):
+    now = [7200.0]
+    path = tmp_path / 'stats.sqlite3'
+    first = StatsRecorder(path, clock=lambda: now[0])
+    second = StatsRecorder(path, clock=lambda: now[0])
+    
+    first.record({'category': 'spam', 'risk_level': 'high'})
+    first.record({'category': 'spam', 'risk_level': 'high'})
+    first.record({'confidence': 50.0})  # partial results without a category are not counted
+    assert first.flush() == 2
+    
+    now[0] += 2 * 86400
+    second.record({'category': 'not_spam', 'risk_level': 'low'})
+    assert second.flush() == 1
+    second.record({'category': 'promotional', 'risk_level': 'low'})  # still pending
+    
+    summary = second.summary(['spam', 'not_spam', 'promotional', 'social'])
+    assert summary['total_analyzed'] == 4
+    assert summary['categories']['spam'] == {'count': 2, 'percentage': 50.0}
+    assert summary['categories']['social'] == {'count': 0, 'percentage': 0.0}
+    assert summary['risk_levels']['low']['count'] == 2
+    assert summary['recent']['total_analyzed'] == 2
+    assert summary['recent']['categories'] == {'not_spam': 1, 'promotional': 1}
+
+def test_load_run_paces_open_loop_phases_and_reports_errors():
+    assert len(list(send_times(10, 2))) == 20
+    ramp = list(send_times([0, 40], 1))
+    assert len(ramp) == 20 and ramp == sorted(ramp) and ramp[-1] < 1
+    assert ramp[10] - ramp[9] < ramp[1] - ramp[0]  # sends get closer as the rate rises
+    
+    class Target:
+        def request(self, method, path, body=None):
+            if 'fail' in body['email_content']:
+                return 503, None
+            return 200, {'success': True}
+    
+    phases = [{'name': 'open', 'duration': 0.2, 'rate': 50}, {'name': 'closed', 'duration': 0.1, 'concurrency': 2}]
+    run = LoadRun(Target(), ['ok', 'fail'], workers=4)
+    spans = run.run(phases)
+    report = build_report(run.samples, phases, spans, interval=0.1)
+    
+    opened = report['phases'][0]
+    assert opened['name'] == 'open' and opened['requests'] == 10
+    assert opened['errors'] == 5 and opened['error_kinds'] == {'503': 5}
+    assert report['phases'][1]['requests'] > 0
+    assert report['overall']['requests'] == len(run.samples)
+    assert sum(entry['requests'] for entry in report['timeline']) == len(run.samples)
+    assert set(report['overall']['latency_ms']) == {'p50', 'p95', 'p99', 'max'}
+
+def test_minhash_signature_is_computed_in_bounded_blocks():
+    import tracemalloc
+    shingles = np.unique(np.random.RandomState(0).randint(0, 1 << 32, size=200000).astype(np.uint64))
+    hasher = MinHasher()
+    tracemalloc.start()
+    try:
+        signature = hasher.signature(shingles)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 16 * 1024 * 1024
+    assert np.array_equal(signature, MinHasher(block_size=len(shingles)).signature(shingles))
+    assert np.array_equal(signature, MinHasher(block_size=7).signature(shingles))
+
+def test_near_duplicate_reuses_scores_but_describes_the_submitted_email(classifier):
+    index = NearDuplicateIndex(threshold=0.5)
+    first = SAMPLE_EMAILS['spam']
+    second = first + ' CALL NOW!!! Visit http://example.com http://example.org http://example.net'
+    
+    original = index.analyze(first, 1, classifier.analyze_email, classifier.describe)
+    reused = index.analyze(second, 1, classifier.analyze_email, classifier.describe)
+    assert reused['near_duplicate']['matched'] and not original['near_duplicate']['matched']
+    assert reused['category'] == original['category'] and reused['scores'] == original['scores']
+    
+    expected = classifier.analyze_email(second)
+    assert reused['features'] == expected['features'] != original['features']
+    assert sorted(reused['indicators']) == sorted(expected['indicators'])
+
+def test_disabled_near_duplicate_index_computes_without_shingling(classifier, monkeypatch):
+    index = NearDuplicateIndex(maxsize=0)
+    monkeypatch.setattr(index.hasher, 'shingles', lambda text: pytest.fail('shingled a bypassed email'))
+    assert index.analyze(SAMPLE_EMAILS['spam'], 1, classifier.analyze_email) == classifier.analyze_email(SAMPLE_EMAILS['spam'])
+    assert index.stats()['size'] == 0
+
+def test_cluster_corpus_keeps_at_most_max_clusters_representatives():
+    texts = [SAMPLE_EMAILS[name] for name in ('spam', 'promotional', 'newsletter')]
+    items = list(enumerate(texts + [texts[2], texts[0]]))
+    clusters = [cluster for _, cluster, _, _ in cluster_corpus(items, max_clusters=2)]
+    
+    # The newsletter repeat still matches; the spam campaign was forgotten to make room
+    assert len(set(clusters[:3])) == 3 and clusters[3] == clusters[2]
+    assert clusters[4] not in clusters[:4]
+    assert [cluster for _, cluster, _, _ in cluster_corpus(items)][4] == clusters[0]
+
+def test_bulk_reads_messages_like_the_message_endpoint(classifier):
+    raw = (
+        b'Subject: Your invoice\r\nContent-Type: text/html; charset=utf-8\r\n\r\n'
+        b'<html><head><style>.x {}</style></head><body><script>var win = "WINNER";</script>'
+        b'<p>Invoice attached&nbsp;for March</p></body></html>\r\n'
+    )
+    text = message_text(raw)
+    assert text == extract_message(raw).text == 'Your invoice\n\nInvoice attached for March'
+    assert classifier.analyze_email(text)['category'] == classifier.analyze_message(raw)['category']
+
+def _write_corpus(tmp_path, input_format, texts):
+    """Path of a corpus in input_format holding texts in order"""
+    if input_format == 'ndjson':
+        path = tmp_path / 'corpus.ndjson'
+        lines = [json.dumps({'id': f'm{number}', 'email_content': text}) + '\n' for number, text in enumerate(texts)]
+        path.write_text(''.join(lines), encoding='utf-8')
+        return str(path)
+    
+    import mailbox
+    from email.message import EmailMessage
+    path = str(tmp_path / ('corpus.mbox' if input_format == 'mbox' else 'maildir'))
+    box = mailbox.mbox(path) if input_format == 'mbox' else mailbox.Maildir(path)
+    for number, text in enumerate(texts):
+        message = EmailMessage()
+        message['Subject'] = f'Message {number}'
+        message.set_content(text)
+        box.add(message)
+    box.close()
+    return path
+
+def _crash_on_chunk(monkeypatch, crash_seq):
+    def classify(chunk):
+        if chunk[0] == crash_seq:
+            raise RuntimeError('worker died')
+        return classify_chunk(chunk)
+    monkeypatch.setattr('app.bulk.classify_chunk', classify)
+
+@pytest.mark.parametrize('input_format', ['mbox', 'maildir', 'ndjson'])
+def test_bulk_run_resumes_without_duplicates_or_gaps(tmp_path, monkeypatch, input_format):
+    texts = [item['email_content'] for item in generate_corpus(11, seed=5, sizes=[200, 800])]
+    corpus = _write_corpus(tmp_path, input_format, texts)
+    expected_path = tmp_path / 'expected.ndjson'
+    assert run(corpus, str(expected_path), workers=1, chunk_size=3) == 11
+    expected = expected_path.read_text(encoding='utf-8').splitlines()
+    records = [json.loads(line) for line in expected]
+    assert len({record['id'] for record in records}) == 11 and all('category' in record for record in records)
+    
+    output, checkpoint = tmp_path / 'output.ndjson', str(tmp_path / 'output.checkpoint')
+    _crash_on_chunk(monkeypatch, 1)
+    with pytest.raises(RuntimeError):
+        run(corpus, str(output), workers=1, chunk_size=3, checkpoint_path=checkpoint)
+    assert output.read_text(encoding='utf-8').splitlines() == expected[:3]
+    
+    # Resume, then die again partway through writing a record after the last checkpoint
+    _crash_on_chunk(monkeypatch, 3)
+    with pytest.raises(RuntimeError):
+        run(corpus, str(output), workers=1, chunk_size=3, checkpoint_path=checkpoint)
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write(expected[9][:20])
+    
+    monkeypatch.undo()
+    assert run(corpus, str(output), workers=1, chunk_size=3, checkpoint_path=checkpoint) == 2
+    assert output.read_text(encoding='utf-8').splitlines() == expected
+
+def test_bulk_run_orders_output_only_when_asked(tmp_path):
+    texts = [item['email_content'] for item in generate_corpus(20, seed=6, sizes=[200, 800])]
+    corpus = _write_corpus(tmp_path, 'ndjson', texts)
+    outputs = {}
+    for name, workers, ordered in [('serial', 1, True), ('ordered', 2, True), ('unordered', 2, False)]:
+        path = tmp_path / f'{name}.ndjson'
+        assert run(corpus, str(path), workers=workers, chunk_size=2, ordered=ordered, max_in_flight=3) == 20
+        outputs[name] = path.read_text(encoding='utf-8').splitlines()
+    assert outputs['ordered'] == outputs['serial']
+    assert sorted(outputs['unordered']) == sorted(outputs['serial'])
+
+def _keyword_soup(rng, keywords, size):
+    parts = list(keywords) + [keyword[:len(keyword) // 2] for keyword in keywords] + [' ', 'e', 'é', '!', 'ss']
+    return ''.join(rng.choice(parts) for _ in range(size))
+
+@pytest.mark.parametrize('seed', range(4))
+def test_keyword_matcher_counts_like_str_count(classifier, seed):
+    rng = random.Random(seed)
+    matcher = classifier.keyword_matcher
+    texts = [classifier._clean_text(text) for text in SAMPLE_EMAILS.values()]
+    texts += [_keyword_soup(rng, matcher.keywords, rng.randint(0, 40)) for _ in range(300)]
+    for text in texts:
+        expected = [text.count(keyword) for keyword in matcher.keywords]
+        assert matcher.count(text) == expected, text
+        
+        # The same counts when the text arrives in pieces
+        cuts = sorted(rng.randint(0, len(text)) for _ in range(3))
+        counter = KeywordCounter(matcher)
+        for start, end in zip([0] + cuts, cuts + [len(text)]):
+            counter.feed(text[start:end])
+        assert counter.finish() == expected, (text, cuts)
+
+@pytest.mark.parametrize('sizes', [[50, 300, 1000], [4 * 1024, 20 * 1024]], ids=['short', 'long'])
+def test_analyze_batch_matches_analyze_email(classifier, sizes):
+    texts = [item['email_content'] for item in generate_corpus(24, seed=len(sizes), sizes=sizes)]
+    texts += list(SAMPLE_EMAILS.values()) + ['', '   ', 'ÉCRIVEZ-NOUS MAINTENANT!!! $5,000 à gagner']
+    assert classifier.analyze_batch(texts) == [classifier.analyze_email(text) for text in texts]
+
+WINDOW = 64 * 1024
+
+# Tokens placed across the first window boundary, at several offsets before it
+BOUNDARY_TOKENS = [
+    ' make money fast ', ' act now ', ' winner ', ' click here to claim ', '!!!!!! ', ' ...? ',
+    ' http://example.com/' + 'a' * 300 + ' ', ' john.doe@example.com ', ' 555-123-4567 ', ' $1,000,000 ',
+    ' URGENT ACTION REQUIRED ', '\n\n\t  \n'
+]
+
+@pytest.mark.parametrize('token', BOUNDARY_TOKENS)
+@pytest.mark.parametrize('offset', [2, 7])
+def test_analyze_stream_matches_analyze_email_across_window_boundaries(classifier, token, offset):
+    filler = _repeat(SAMPLE_EMAILS['not_spam'] + ' ', 2 * WINDOW)
+    start = WINDOW - min(offset, len(token) - 1)
+    text = filler[:start] + token + filler[start:]
+    expected = classifier.analyze_email(text)
+    
+    assert classifier.analyze_stream(text) == expected
+    assert classifier.analyze_stream(text[i:i + 7777] for i in range(0, len(text), 7777)) == expected
+
+def test_mapped_arrays_round_trip_through_the_flat_artifact(tmp_path):
+    path = str(tmp_path / 'arrays.bin')
+    arrays = {
+        'hashes': np.array([3, 1 << 63, 7], dtype=np.uint64),
+        'matrix': np.arange(12, dtype=np.float32).reshape(4, 3),
+        'empty': np.zeros(0, dtype=np.intp)
+    }
+    write_arrays(path, arrays, {'id': 'x', 'classes': ['a', 'b']})
+    
+    mapped = MappedArrays(path)
+    assert mapped.meta == {'id': 'x', 'classes': ['a', 'b']}
+    for name, array in arrays.items():
+        assert mapped[name].dtype == array.dtype and np.array_equal(mapped[name], array)
+        assert not mapped[name].flags.writeable
+    assert mapped['matrix'].ctypes.data % 64 == 0
+    
+    (tmp_path / 'other.bin').write_bytes(b'not a model')
+    with pytest.raises(ValueError):
+        MappedArrays(str(tmp_path / 'other.bin'))
+
+def test_trained_model_predicts_the_same_after_loading_from_disk(tmp_path):
+    items = [(item['email_content'], item['category']) for item in generate_corpus(120, seed=3, sizes=[200, 800])]
+    model_path, vectorizer_path = str(tmp_path / 'model.bin'), str(tmp_path / 'vectorizer.bin')
+    summary = train(items, model_path, vectorizer_path, min_df=1, epochs=50)
+    assert summary['documents'] == 120 and summary['classes'] == sorted({label for _, label in items})
+    
+    loaded = LearnedClassifier()
+    loaded.load(model_path, vectorizer_path)
+    assert loaded.classes == summary['classes'] and len(loaded.vectorizer.hashes) == summary['terms']
+    
+    # The same model held in ordinary in-memory arrays
+    in_memory = LearnedClassifier()
+    in_memory.vectorizer = TfidfVectorizer(np.array(loaded.vectorizer.hashes), np.array(loaded.vectorizer.idf))
+    in_memory.classes = list(loaded.classes)
+    in_memory.coef, in_memory.intercept = np.array(loaded.coef), np.array(loaded.intercept)
+    in_memory.version = loaded.version
+    
+    reloaded = LearnedClassifier()
+    reloaded.load(model_path, vectorizer_path)
+    texts = [text for text, _ in items[:20]] + list(SAMPLE_EMAILS.values()) + ['', 'zzz unseen words only']
+    for text in texts:
+        assert loaded.predict(text) == reloaded.predict(text) == in_memory.predict(text)
+    
+    # A model from one run never pairs with another run's vectorizer
+    train(items[:60], str(tmp_path / 'other.bin'), str(tmp_path / 'other_vectorizer.bin'), min_df=1, epochs=5)
+    with pytest.raises(ValueError):
+        LearnedClassifier().load(model_path, str(tmp_path / 'other_vectorizer.bin'))
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+def _counting(calls):
+    def compute(text):
+        calls.append(text)
+        return {'category': text, 'scores': {'spam': len(text)}, 'indicators': [text]}
+    return compute
+
+def test_result_cache_evicts_the_least_recently_used_entry():
+    calls = []
+    cache = ResultCache(maxsize=2, ttl=60)
+    compute = _counting(calls)
+    cache.get_or_compute('a', 1, compute)
+    cache.get_or_compute('b', 1, compute)
+    cache.get_or_compute('a', 1, compute)
+    cache.get_or_compute('c', 1, compute)
+    
+    # 'b' was used least recently, so it made room for 'c'
+    cache.get_or_compute('a', 1, compute)
+    cache.get_or_compute('b', 1, compute)
+    assert calls == ['a', 'b', 'c', 'b']
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (2, 2, 4, 2)
+    assert stats['hit_rate'] == 33.33
+
+def test_result_cache_expires_entries_after_the_ttl():
+    calls = []
+    clock = FakeClock()
+    cache = ResultCache(maxsize=8, ttl=10, clock=clock)
+    compute = _counting(calls)
+    cache.get_or_compute('a', 1, compute)
+    clock.now = 9.9
+    cache.get_or_compute('a', 1, compute)
+    clock.now = 10.0
+    cache.get_or_compute('a', 1, compute)
+    assert calls == ['a', 'a']
+    assert cache.stats()['expirations'] == 1 and cache.stats()['hits'] == 1
+
+def test_result_cache_hands_out_copies():
+    calls = []
+    cache = ResultCache(maxsize=8, ttl=60)
+    computed = cache.get_or_compute('a', 1, _counting(calls))
+    computed['scores']['spam'] = -1
+    cached = cache.get_or_compute('a', 1, _counting(calls))
+    cached['indicators'].append('mutated')
+    cached['category'] = 'mutated'
+    
+    assert cache.get_or_compute('a', 1, _counting(calls)) == {'category': 'a', 'scores': {'spam': 1}, 'indicators': ['a']}
+    assert calls == ['a']
+
+def test_result_cache_misses_after_a_rules_version_change_and_keeps_variants_apart():
+    calls = []
+    cache = ResultCache(maxsize=8, ttl=60)
+    compute = _counting(calls)
+    cache.get_or_compute('a', 1, compute)
+    cache.get_or_compute('a', 1, compute, variant='compact')
+    cache.get_or_compute('a', 2, compute)
+    cache.get_or_compute('a', 2, compute)
+    assert calls == ['a', 'a', 'a']
+    assert cache.stats()['invalidations'] == 1 and cache.stats()['size'] == 1
+
+def test_result_cache_computes_each_key_once_under_concurrent_lookups():
+    import threading
+    calls = []
+    lock = threading.Lock()
+    started = threading.Event()
+    
+    def compute(text):
+        started.wait()
+        with lock:
+            calls.append(text)
+        return {'category': text}
+    
+    cache = ResultCache(maxsize=64, ttl=60)
+    keys = [f'email {number}' for number in range(8)]
+    results = []
+    
+    def hammer(offset):
+        for round_ in range(20):
+            key = keys[(offset + round_) % len(keys)]
+            results.append((key, cache.get_or_compute(key, 1, compute)))
+    
+    threads = [threading.Thread(target=hammer, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+    
+    assert sorted(calls) == keys
+    assert all(result == {'category': key} for key, result in results)
+    stats = cache.stats()
+    assert stats['misses'] == len(keys) and stats['hits'] == len(results) - len(keys)
+
+def test_result_cache_recomputes_after_a_failed_computation():
+    cache = ResultCache(maxsize=8, ttl=60)
+    
+    def fail(text):
+        raise RuntimeError('boom')
+    
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('a', 1, fail)
+    assert cache.get_or_compute('a', 1, lambda text: {'category': text}) == {'category': 'a'}
+    assert cache.stats()['misses'] == 2 and cache.stats()['size'] == 1
@@ -0,0 +1,272 @@
+"""
+Tests for the HTTP routes of the Email Classification System
+"""
+import gzip
+import json
+import os
+import re
+import uuid
+
+import pytest
+
+from app import create_app, metrics
+from app.admission import admission
+from app.cascade import cascade
+from app.models import email_classifier
+from app.samples import SAMPLE_EMAILS
+from config import Config, TestingConfig, config
+
+@pytest.fixture(scope='module')
+def app():
+    return create_app('testing')
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def _lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_jobs_run_on_an_in_memory_queue_in_testing(app, client):
+    assert app.config['JOBS_DB'].startswith('file:')
+    existed = os.path.exists(os.path.join(Config.DATA_DIR, 'jobs.sqlite3'))
+    
+    response = client.post('/jobs', json={'email_content': 'Lunch at noon tomorrow?'})
+    assert response.status_code == 202
+    job = client.get(response.headers['Location']).get_json()
+    assert job['status'] == 'queued'
+    assert os.path.exists(os.path.join(Config.DATA_DIR, 'jobs.sqlite3')) == existed
+
+def test_batch_streams_ndjson_results_in_input_order(client):
+    emails = [SAMPLE_EMAILS['spam'], SAMPLE_EMAILS['not_spam'], SAMPLE_EMAILS['newsletter']]
+    body = '\n'.join(json.dumps({'id': f'm{number}', 'email_content': text}) for number, text in enumerate(emails))
+    response = client.post('/analyze/batch', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 200 and response.mimetype == 'application/x-ndjson'
+    
+    lines = _lines(response)
+    assert [line['index'] for line in lines] == [0, 1, 2]
+    assert [line['id'] for line in lines] == ['m0', 'm1', 'm2']
+    for line, text in zip(lines, emails):
+        single = client.post('/analyze', json={'email_content': text}).get_json()['result']
+        assert line['success'] and line['result']['category'] == single['category']
+
+def test_batch_accepts_a_json_array_of_strings_and_objects(client):
+    items = [SAMPLE_EMAILS['promotional'], {'email_content': SAMPLE_EMAILS['social'], 'profile': 'compact'}]
+    response = client.post('/analyze/batch', data=json.dumps(items), content_type='application/json')
+    lines = _lines(response)
+    assert [line['index'] for line in lines] == [0, 1]
+    assert all(line['success'] for line in lines)
+    assert set(lines[1]['result']) == {'category', 'confidence', 'risk_level'} < set(lines[0]['result'])
+
+def test_batch_reports_bad_lines_on_their_own_records(client):
+    body = '\n'.join([
+        json.dumps({'id': 'ok', 'email_content': SAMPLE_EMAILS['spam']}),
+        '{not json',
+        json.dumps({'id': 'short', 'email_content': 'hi'}),
+        json.dumps({'id': 'number', 'email_content': 42}),
+        '',
+        json.dumps({'id': 'profile', 'email_content': SAMPLE_EMAILS['spam'], 'profile': 'nope'}),
+        json.dumps(SAMPLE_EMAILS['not_spam'])
+    ])
+    lines = _lines(client.post('/analyze/batch', data=body, content_type='application/x-ndjson'))
+    assert [line['index'] for line in lines] == [0, 1, 2, 3, 4, 5]
+    assert lines[0]['success'] and lines[5]['success']
+    assert lines[1]['error'].startswith('Invalid JSON line')
+    assert lines[2] == {'index': 2, 'id': 'short', 'error': 'Email content too short for meaningful analysis'}
+    assert lines[3]['error'] == 'Item must be a string or an object with email_content'
+    assert lines[4]['id'] == 'profile' and 'Unknown profile' in lines[4]['error']
+
+def test_batch_rejects_other_content_types_and_reports_a_broken_array(client):
+    assert client.post('/analyze/batch', data='x', content_type='text/plain').status_code == 415
+    
+    body = '[%s, %s' % (json.dumps(SAMPLE_EMAILS['spam']), '{"email_content": ')
+    lines = _lines(client.post('/analyze/batch', data=body, content_type='application/json'))
+    assert lines[0]['index'] == 0 and lines[0]['success']
+    assert lines[-1]['index'] == 1 and lines[-1]['error'].startswith('Batch aborted')
+
+@pytest.fixture
+def one_slot(app):
+    """Admission limited to one concurrent analysis, restored afterwards"""
+    limits = admission.concurrency, admission.queue_size, admission.service_time
+    admission.configure(concurrency=1, queue_size=0)
+    yield admission
+    admission.concurrency, admission.queue_size, admission.service_time = limits
+
+def _unique_email():
+    # Distinct text keeps the result cache and near-duplicate index out of the way
+    return f'Quarterly planning notes {uuid.uuid4().hex} for the team meeting.'
+
+def test_full_analysis_queue_is_shed_with_429_and_retry_after(client, one_slot):
+    one_slot.acquire(0)
+    try:
+        response = client.post('/analyze', json={'email_content': _unique_email()})
+    finally:
+        one_slot.release(0.5)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(response.get_json()['retry_after']) == '1'
+    assert client.post('/analyze', json={'email_content': _unique_email()}).status_code == 200
+
+def test_missed_deadline_is_shed_with_503_and_retry_after(client, one_slot):
+    one_slot.configure(queue_size=4)
+    one_slot.service_time = 2.0
+    one_slot.acquire(0)
+    try:
+        # The queue would take longer than the request may wait
+        rejected = client.post('/analyze', json={'email_content': _unique_email()}, headers={'X-Request-Timeout': '1'})
+        one_slot.service_time = None
+        timed_out = client.post('/analyze', json={'email_content': _unique_email()},
+                                headers={'X-Request-Timeout': '0.05'})
+    finally:
+        one_slot.release(0.0)
+    for response in (rejected, timed_out):
+        assert response.status_code == 503
+        assert int(response.headers['Retry-After']) == response.get_json()['retry_after'] >= 1
+    assert 'deadline' in rejected.get_json()['error'] and 'deadline' in timed_out.get_json()['error']
+    assert one_slot.stats()['queue_depth'] == 0
+
+def test_failed_analysis_releases_its_slot(client, one_slot, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError('boom')
+    
+    monkeypatch.setattr(email_classifier, 'analyze_email', fail)
+    response = client.post('/analyze', json={'email_content': _unique_email()})
+    assert response.status_code == 500 and 'boom' in response.get_json()['error']
+    assert one_slot.stats()['active'] == 0
+    
+    monkeypatch.undo()
+    assert client.post('/analyze', json={'email_content': _unique_email()}).status_code == 200
+
+def test_admission_rejects_a_concurrency_below_one(client, one_slot):
+    for concurrency in (0, -1):
+        with pytest.raises(ValueError):
+            one_slot.configure(concurrency=concurrency)
+    assert one_slot.stats()['concurrency'] == 1
+    assert client.post('/analyze', json={'email_content': _unique_email()}).status_code == 200
+
+@pytest.mark.parametrize('path', ['/', '/sample/spam'])
+def test_cached_pages_revalidate_with_etags(client, path):
+    first = client.get(path)
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'Content-Encoding' not in first.headers
+    assert 'Accept-Encoding' in first.headers['Vary']
+    assert first.headers['Last-Modified'] and 'max-age' in first.headers['Cache-Control']
+    
+    again = client.get(path, headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.get_data() == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+    assert client.get(path, headers={'If-None-Match': '"stale"'}).status_code == 200
+
+@pytest.mark.parametrize('path', ['/', '/sample/spam'])
+def test_cached_pages_are_gzipped_only_when_accepted(client, path):
+    plain = client.get(path, headers={'Accept-Encoding': 'identity'})
+    refused = client.get(path, headers={'Accept-Encoding': 'gzip;q=0, identity'})
+    zipped = client.get(path, headers={'Accept-Encoding': 'gzip, deflate'})
+    
+    assert 'Content-Encoding' not in plain.headers and 'Content-Encoding' not in refused.headers
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    
+    # Each representation has its own tag, so a gzip tag does not validate the plain body
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert client.get(path, headers={'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']}).status_code == 304
+    assert client.get(path, headers={'If-None-Match': zipped.headers['ETag']}).status_code == 200
+
+def test_dynamic_json_is_revalidated_with_etags(client):
+    first = client.get('/api/rules')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert 'no-cache' in first.headers['Cache-Control']
+    
+    again = client.get('/api/rules', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.get_data() == b''
+
+SAMPLE_LINE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def _scrape(client):
+    """{(name, labels): value} from /metrics, checking the exposition format on the way"""
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.content_type == metrics.CONTENT_TYPE
+    families, samples = set(), {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line.startswith('# TYPE '):
+            families.add(line.split()[2])
+            continue
+        if line.startswith('# HELP '):
+            continue
+        match = SAMPLE_LINE_RE.match(line)
+        assert match, line
+        name, labels, value = match.groups()
+        family, _, suffix = name.rpartition('_')
+        assert name in families or (family in families and suffix in ('bucket', 'sum', 'count')), line
+        samples[name, frozenset(LABEL_RE.findall(labels or ''))] = float(value)
+    return samples
+
+def _value(samples, name, **labels):
+    return samples.get((name, frozenset(labels.items())), 0)
+
+def _buckets(samples, name, **labels):
+    """Cumulative bucket counts of one series in increasing bound order"""
+    series = [
+        (float(dict(key)['le']), value) for (sample, key), value in samples.items()
+        if sample == name + '_bucket' and set(labels.items()) < key
+    ]
+    return [value for _, value in sorted(series)]
+
+def test_metrics_scrape_records_request_latency_by_size(client):
+    before = _scrape(client)
+    email = _unique_email() * 300
+    assert client.post('/analyze', json={'email_content': email}).status_code == 200
+    after = _scrape(client)
+    
+    request_labels = {'endpoint': '/analyze', 'size': '100KB'}
+    count = _value(after, 'http_request_duration_seconds_count', **request_labels)
+    assert count == _value(before, 'http_request_duration_seconds_count', **request_labels) + 1
+    buckets = _buckets(after, 'http_request_duration_seconds', **request_labels)
+    assert len(buckets) == len(metrics.LATENCY_BUCKETS) + 1
+    assert buckets == sorted(buckets) and buckets[-1] == count
+    assert _value(after, 'http_request_duration_seconds_sum', **request_labels) > 0
+    
+    for stage in ('analyze_email', 'clean_text', 'keyword_classification', 'create_result'):
+        labels = {'stage': stage, 'size': '100KB'}
+        assert _value(after, 'email_classifier_stage_duration_seconds_count', **labels) == \
+            _value(before, 'email_classifier_stage_duration_seconds_count', **labels) + 1
+    assert _value(after, 'result_cache_misses_total') == _value(before, 'result_cache_misses_total') + 1
+
+def test_metrics_time_the_cascade_stream_and_describe_entry_points(client):
+    before = _scrape(client)
+    email = _unique_email()
+    cascade.analyze(email)
+    email_classifier.analyze_stream(iter([email, email]))
+    email_classifier.describe(email)
+    after = _scrape(client)
+    
+    def added(stage, size):
+        labels = {'stage': stage, 'size': size}
+        return _value(after, 'email_classifier_stage_duration_seconds_count', **labels) - \
+            _value(before, 'email_classifier_stage_duration_seconds_count', **labels)
+    
+    assert added('cascade', '1KB') == 1
+    assert added('analyze_stream', 'unknown') == 1
+    assert added('describe', '1KB') == 1
+    # The stages the entry points run are labelled with their input size
+    assert added('keyword_classification', '1KB') >= 1
+    assert added('context_classification', 'unknown') == 1
+    assert added('extract_features', '1KB') >= 1
+
+@pytest.fixture
+def metrics_off_client(app, monkeypatch):
+    """Client of an app built with METRICS_ENABLED off, instrumentation restored afterwards"""
+    monkeypatch.setitem(config, 'metrics_off', type('MetricsOffConfig', (TestingConfig,), {'METRICS_ENABLED': False}))
+    yield create_app('metrics_off').test_client()
+    metrics.instrument_classifier(email_classifier, enabled=app.config['METRICS_ENABLED'])
+    metrics.instrument_cascade(cascade, enabled=app.config['METRICS_ENABLED'])
+
+def test_disabled_metrics_are_not_served_and_leave_the_classifier_unwrapped(metrics_off_client):
+    timed = set(metrics.CLASSIFIER_ENTRY_POINTS + metrics.CLASSIFIER_STAGES)
+    assert not timed & set(vars(email_classifier)) and 'analyze' not in vars(cascade)
+    
+    observed = metrics.request_latency.totals(), metrics.stage_latency.totals()
+    assert metrics_off_client.post('/analyze', json={'email_content': _unique_email()}).status_code == 200
+    assert (metrics.request_latency.totals(), metrics.stage_latency.totals()) == observed
+    assert metrics_off_client.get('/metrics').status_code == 404
@@ -0,0 +1,55 @@
+"""
+Offline trainer for the learned TF-IDF and linear model artifacts
+"""
+import argparse
+import json
+import os
+import sys
+
+from app.learned import train
+from config import Config
+
+def iter_labelled(path, text_field, label_field):
+    """Yield (text, label) from an NDJSON corpus, skipping unlabelled lines"""
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'{path}:{number}: invalid JSON: {e}')
+            text, label = item.get(text_field), item.get(label_field)
+            if isinstance(text, str) and label:
+                yield text, label
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train the learned model from a labelled NDJSON corpus')
+    parser.add_argument('corpus', help='NDJSON file with one labelled email per line')
+    parser.add_argument('-o', '--model-dir', default=Config.MODEL_DIR, help='default: MODEL_DIR from config.py')
+    parser.add_argument('--text-field', default='email_content')
+    parser.add_argument('--label-field', default='category')
+    parser.add_argument('--max-features', type=int, default=50000, help='vocabulary size limit')
+    parser.add_argument('--min-df', type=int, default=2, help='minimum document frequency of a term')
+    parser.add_argument('--epochs', type=int, default=300)
+    args = parser.parse_args(argv)
+    
+    try:
+        os.makedirs(args.model_dir, exist_ok=True)
+        summary = train(
+            iter_labelled(args.corpus, args.text_field, args.label_field),
+            os.path.join(args.model_dir, Config.MODEL_FILENAME),
+            os.path.join(args.model_dir, Config.VECTORIZER_FILENAME),
+            max_features=args.max_features,
+            min_df=args.min_df,
+            epochs=args.epochs
+        )
+    except (OSError, ValueError) as e:
+        parser.exit(1, f'train: {e}\n')
+    
+    print(f"Trained on {summary['documents']} emails: {summary['terms']} terms, "
+          f"classes {', '.join(summary['classes'])}, training accuracy {summary['train_accuracy']:.1%}",
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()